@@ -62,6 +62,57 @@ class Config:
         UPLOAD_FOLDER = os.path.abspath(os.path.join(BASE_DIR, 'uploads'))
         
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+    # Uploads up to this size are processed (hashed, OCR'd) in memory without a temp file
+    UPLOAD_SPOOL_MAX_BYTES = int(os.getenv('UPLOAD_SPOOL_MAX_BYTES', str(4 * 1024 * 1024)))
+    # OCR admission control (services/ocr_limiter.py). Queued requests hold a
+    # gunicorn thread too, so running + queued stays below --threads.
+    OCR_MAX_CONCURRENT_PER_WORKER = int(os.getenv('OCR_MAX_CONCURRENT_PER_WORKER', '2'))
+    OCR_MAX_QUEUE = int(os.getenv('OCR_MAX_QUEUE', '1'))                             # Per worker
+    OCR_QUEUE_TIMEOUT = float(os.getenv('OCR_QUEUE_TIMEOUT', '15'))                  # Seconds before a queued request gets 429
+    OCR_MAX_PER_USER = int(os.getenv('OCR_MAX_PER_USER', '2'))                       # Running + queued per user, per worker
+    OCR_RATE_PER_MINUTE = float(os.getenv('OCR_RATE_PER_MINUTE', '60'))              # Shared by all workers; 0 disables
+    OCR_BURST = float(os.getenv('OCR_BURST', '5'))
+    OCR_TOKEN_BUCKET_PATH = os.getenv('OCR_TOKEN_BUCKET_PATH')                       # Default /dev/shm/labos-ocr-token-bucket
+    # Unreferenced upload blobs (e.g. OCR'd but never submitted) are kept this long before `flask storage-gc`
+    BLOB_GC_GRACE_HOURS = float(os.getenv('BLOB_GC_GRACE_HOURS', '24'))
+
+    # Upload storage backend (services/storage_backends.py): 'local' or 's3'
+    STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'local')
+    S3_BUCKET = os.getenv('S3_BUCKET')
+    S3_PREFIX = os.getenv('S3_PREFIX', '')
+    S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL')                                   # e.g. http://localhost:9000 for MinIO
+    S3_REGION = os.getenv('S3_REGION')
+    S3_ACCESS_KEY_ID = os.getenv('S3_ACCESS_KEY_ID')
+    S3_SECRET_ACCESS_KEY = os.getenv('S3_SECRET_ACCESS_KEY')
+    S3_PRESIGN_EXPIRES = int(os.getenv('S3_PRESIGN_EXPIRES', '300'))                 # Seconds a download/upload URL stays valid
+    STORAGE_CACHE_DIR = os.getenv('STORAGE_CACHE_DIR')                               # Local read cache for S3 objects
+    STORAGE_CACHE_MAX_BYTES = int(os.getenv('STORAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+
+    # Document downloads (services/file_serving.py)
+    FILE_SERVING_MODE = os.getenv('FILE_SERVING_MODE', '')                           # '', 'x-accel' or 'x-sendfile'
+    X_ACCEL_PREFIX = os.getenv('X_ACCEL_PREFIX', '/protected-uploads/')              # nginx internal location for UPLOAD_FOLDER
+    USE_X_SENDFILE = FILE_SERVING_MODE == 'x-sendfile'
+    FILE_CACHE_MAX_AGE = int(os.getenv('FILE_CACHE_MAX_AGE', str(7 * 24 * 3600)))  # Stored names never change content
+
+    # Preview thumbnails (services/thumbnails.py); cache defaults to UPLOAD_FOLDER/.thumbs
+    THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', '320'))                         # Longest edge in pixels
+    THUMBNAIL_CACHE_DIR = os.getenv('THUMBNAIL_CACHE_DIR')
+    THUMBNAIL_CACHE_MAX_BYTES = int(os.getenv('THUMBNAIL_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+
+    # API responses (services/json_provider.py, services/compression.py)
+    JSON_BACKEND = os.getenv('JSON_BACKEND', 'orjson')                               # 'orjson' or 'json' (stdlib)
+    COMPRESS_ENABLED = os.getenv('COMPRESS_ENABLED', 'true').lower() == 'true'
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))                  # Bytes; smaller bodies are sent as-is
+    COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+    COMPRESS_BR_QUALITY = int(os.getenv('COMPRESS_BR_QUALITY', '4'))                 # Higher costs much more CPU per request
+    COMPRESS_MIMETYPES = {
+        'application/json', 'text/html', 'text/css', 'text/plain', 'text/csv',
+        'application/javascript', 'text/javascript', 'image/svg+xml',
+    }
+
+    # Readiness probe (/health/ready) settings
+    HEALTH_CHECK_TIMEOUT = float(os.getenv('HEALTH_CHECK_TIMEOUT', '2'))              # Seconds per dependency check
+    HEALTH_CHECK_CACHE_SECONDS = float(os.getenv('HEALTH_CHECK_CACHE_SECONDS', '5'))  # Reuse the last report this long
 
     @staticmethod
     def init_app(app):
@@ -92,15 +143,9 @@ class Config:
         elif not os.access(app.config['UPLOAD_FOLDER'], os.R_OK | os.W_OK):
             logging.error(f"CRITICAL: UPLOAD_FOLDER exists but is not readable/writable: {app.config['UPLOAD_FOLDER']}")
         else:
-            # Log successful creation and check if folder is empty
-            try:
-                file_count = len(os.listdir(app.config['UPLOAD_FOLDER']))
-                logging.info(f"✅ UPLOAD_FOLDER configured: {app.config['UPLOAD_FOLDER']}")
-                logging.info(f"📁 Upload folder contains {file_count} files")
-                if file_count == 0:
-                    logging.warning("⚠️  Upload folder is empty - no files have been uploaded yet or folder was recently cleared")
-            except Exception as e:
-                logging.warning(f"Could not list UPLOAD_FOLDER contents: {e}")
+            # Don't list the folder here: it holds every upload ever made and this
+            # runs on each worker boot. File counts live in the stored_file table.
+            logging.info(f"✅ UPLOAD_FOLDER configured: {app.config['UPLOAD_FOLDER']}")
         
         # Set permissions for UPLOAD_FOLDER
         # On Render, ensure the user running the app has write permissions to /var/data/uploads
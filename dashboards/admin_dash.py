@@ -7,6 +7,7 @@ import pandas as pd
 from sqlalchemy import func
 from datetime import datetime, timedelta
 from models import Expense, Department, Category, User, db
+from services.year_archive import filter_active_departments
 
 def create_admin_dashboard(server):
     # Create a Dash app
@@ -71,7 +72,7 @@ def create_admin_dashboard(server):
         
         expenses = db.session.query(
             func.date_trunc('month', Expense.date).label('month'),
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('total')
+            func.sum(Expense.amount_ils).label('total')
         ).filter(
             Expense.date >= start_date,
             Expense.date <= end_date
@@ -92,11 +93,11 @@ def create_admin_dashboard(server):
     )
     def update_department_budget():
         # Get department budgets and their usage
-        departments = Department.query.all()
+        departments = filter_active_departments(Department.query).all()
         dept_data = []
         
         for dept in departments:
-            total_expenses = db.session.query(func.sum(func.coalesce(Expense.amount_ils, Expense.amount)))\
+            total_expenses = db.session.query(func.sum(Expense.amount_ils))\
                 .join(Category)\
                 .filter(Category.department_id == dept.id)\
                 .scalar() or 0
@@ -139,10 +140,10 @@ def create_admin_dashboard(server):
         # Get top 10 spenders
         top_spenders = db.session.query(
             User.username,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('total')
+            func.sum(Expense.amount_ils).label('total')
         ).join(Expense)\
         .group_by(User.username)\
-        .order_by(func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).desc())\
+        .order_by(func.sum(Expense.amount_ils).desc())\
         .limit(10).all()
         
         df = pd.DataFrame(top_spenders, columns=['User', 'Total Spent'])
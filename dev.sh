@@ -43,6 +43,7 @@ elif [ -d "venv" ]; then
 fi
 export FLASK_APP=app.py
 export FLASK_ENV=development
+flask init-db --retries 1 || echo -e "${YELLOW}Database init failed - is Postgres running?${NC}"
 python app.py &
 FLASK_PID=$!
 
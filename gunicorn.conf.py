@@ -0,0 +1,15 @@
+# Gunicorn hooks. Worker/thread/timeout settings stay on the command line in
+# Procfile and render.yaml; this file only adds the warm-up hooks.
+
+
+def when_ready(server):
+    # With --preload the app is already imported in the master at this point
+    from app import app
+    from services.warmup import warm_up_before_fork
+    warm_up_before_fork(app)
+
+
+def post_fork(server, worker):
+    from app import app
+    from services.warmup import warm_up_worker
+    warm_up_worker(app)
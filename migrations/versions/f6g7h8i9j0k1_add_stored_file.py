@@ -0,0 +1,38 @@
+"""Add stored_file table for sharded upload storage metadata
+
+Revision ID: f6g7h8i9j0k1
+Revises: e5f6g7h8i9j0
+Create Date: 2026-03-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'f6g7h8i9j0k1'
+down_revision = 'e5f6g7h8i9j0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    # Existing files are relocated and indexed by `flask storage-migrate`
+    if 'stored_file' not in inspector.get_table_names():
+        op.create_table('stored_file',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(length=255), nullable=False),
+            sa.Column('storage_path', sa.String(length=512), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('mime_type', sa.String(length=100), nullable=True),
+            sa.Column('content_hash', sa.String(length=64), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.UniqueConstraint('name', name='uq_stored_file_name')
+        )
+
+
+def downgrade():
+    op.drop_table('stored_file')
@@ -0,0 +1,54 @@
+"""Add expense_attachment table and backfill it from the legacy filename columns
+
+Revision ID: g7h8i9j0k1l2
+Revises: f6g7h8i9j0k1
+Create Date: 2026-03-25
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'g7h8i9j0k1l2'
+down_revision = 'f6g7h8i9j0k1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if 'expense_attachment' not in inspector.get_table_names():
+        op.create_table('expense_attachment',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('expense_id', sa.Integer(), sa.ForeignKey('expense.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('kind', sa.String(length=20), nullable=False),
+            sa.Column('stored_name', sa.String(length=255), nullable=False),
+            sa.Column('content_hash', sa.String(length=64), nullable=True),
+            sa.Column('size', sa.BigInteger(), nullable=True),
+            sa.Column('mime_type', sa.String(length=100), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True)
+        )
+        op.create_index('ix_expense_attachment_expense_id', 'expense_attachment', ['expense_id'])
+        op.create_index('ix_expense_attachment_stored_name', 'expense_attachment', ['stored_name'], unique=True)
+
+    # One row per legacy filename; metadata comes from stored_file when the
+    # file has already been indexed by `flask storage-migrate`
+    for kind in ('quote', 'invoice', 'receipt'):
+        op.execute(f"""
+            INSERT INTO expense_attachment (expense_id, kind, stored_name, content_hash, size, mime_type, created_at)
+            SELECT e.id, '{kind}', e.{kind}_filename, sf.content_hash, sf.size, sf.mime_type,
+                   COALESCE(e.submit_date, e.date)
+            FROM expense e
+            LEFT JOIN stored_file sf ON sf.name = e.{kind}_filename
+            WHERE e.{kind}_filename IS NOT NULL AND e.{kind}_filename <> ''
+            ON CONFLICT (stored_name) DO NOTHING
+        """)
+
+
+def downgrade():
+    op.drop_index('ix_expense_attachment_stored_name', table_name='expense_attachment')
+    op.drop_index('ix_expense_attachment_expense_id', table_name='expense_attachment')
+    op.drop_table('expense_attachment')
@@ -0,0 +1,43 @@
+"""Add stored_blob for content-deduplicated uploads and index attachment hashes
+
+Revision ID: h8i9j0k1l2m3
+Revises: g7h8i9j0k1l2
+Create Date: 2026-04-01
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'h8i9j0k1l2m3'
+down_revision = 'g7h8i9j0k1l2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if 'stored_blob' not in inspector.get_table_names():
+        op.create_table('stored_blob',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('content_hash', sa.String(length=64), nullable=False),
+            sa.Column('storage_path', sa.String(length=512), nullable=False),
+            sa.Column('size', sa.BigInteger(), nullable=False),
+            sa.Column('mime_type', sa.String(length=100), nullable=True),
+            sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('last_referenced_at', sa.DateTime(), nullable=True),
+            sa.UniqueConstraint('content_hash', name='uq_stored_blob_content_hash')
+        )
+
+    existing = [ix['name'] for ix in inspector.get_indexes('expense_attachment')]
+    if 'ix_expense_attachment_content_hash' not in existing:
+        op.create_index('ix_expense_attachment_content_hash', 'expense_attachment', ['content_hash'])
+
+
+def downgrade():
+    op.drop_index('ix_expense_attachment_content_hash', table_name='expense_attachment')
+    op.drop_table('stored_blob')
@@ -0,0 +1,70 @@
+"""Add lineage_id to department, category and subcategory
+
+Existing rows are linked the way rollover used to match them: departments
+by name, categories by name within a department lineage, subcategories by
+name within a category lineage.
+
+Revision ID: i9j0k1l2m3n4
+Revises: h8i9j0k1l2m3
+Create Date: 2026-05-04
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'i9j0k1l2m3n4'
+down_revision = 'h8i9j0k1l2m3'
+branch_labels = None
+depends_on = None
+
+
+# table, parent column, parent lineage expression, parent join, index name
+_LEVELS = [
+    ('department', 'year_id', 'NULL::integer', '', 'ix_department_lineage_year'),
+    ('category', 'department_id', 'p.lineage_id', 'JOIN department p ON p.id = t.department_id',
+     'ix_category_lineage_department'),
+    ('subcategory', 'category_id', 'p.lineage_id', 'JOIN category p ON p.id = t.category_id',
+     'ix_subcategory_lineage_category'),
+]
+
+
+def upgrade():
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    for table, parent_column, parent_lineage, parent_join, index_name in _LEVELS:
+        if 'lineage_id' in [c['name'] for c in inspector.get_columns(table)]:
+            continue
+        seq = f'{table}_lineage_seq'
+
+        op.execute(f'CREATE SEQUENCE IF NOT EXISTS {seq}')
+        op.add_column(table, sa.Column('lineage_id', sa.Integer(), nullable=True))
+
+        # Same name under the same parent lineage (n-th duplicate to n-th
+        # duplicate) shares the lowest id as its lineage
+        op.execute(f"""
+            UPDATE {table} u SET lineage_id = l.lineage_id
+            FROM (
+                SELECT id, min(id) OVER (PARTITION BY parent_lineage, name, n) AS lineage_id
+                FROM (
+                    SELECT t.id, t.name, {parent_lineage} AS parent_lineage,
+                           row_number() OVER (PARTITION BY t.{parent_column}, t.name ORDER BY t.id) AS n
+                    FROM {table} t {parent_join}
+                ) ranked
+            ) l
+            WHERE l.id = u.id
+        """)
+        op.execute(f"SELECT setval('{seq}', COALESCE(MAX(lineage_id), 0) + 1, false) FROM {table}")
+
+        op.alter_column(table, 'lineage_id', nullable=False,
+                        server_default=sa.text(f"nextval('{seq}')"))
+        op.create_index(index_name, table, ['lineage_id', parent_column])
+
+
+def downgrade():
+    for table, _, _, _, index_name in reversed(_LEVELS):
+        op.drop_index(index_name, table_name=table)
+        op.drop_column(table, 'lineage_id')
+        op.execute(f'DROP SEQUENCE IF EXISTS {table}_lineage_seq')
@@ -0,0 +1,65 @@
+"""Denormalize category, department and budget year onto expense
+
+Revision ID: j0k1l2m3n4o5
+Revises: i9j0k1l2m3n4
+Create Date: 2026-05-18
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'j0k1l2m3n4o5'
+down_revision = 'i9j0k1l2m3n4'
+branch_labels = None
+depends_on = None
+
+
+_COLUMNS = [
+    ('category_id', 'category'),
+    ('department_id', 'department'),
+    ('budget_year_id', 'budget_year'),
+]
+
+
+def upgrade():
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    existing_columns = [c['name'] for c in inspector.get_columns('expense')]
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        for column, table in _COLUMNS:
+            if column not in existing_columns:
+                batch_op.add_column(sa.Column(column, sa.Integer(), nullable=True))
+                batch_op.create_foreign_key(f'fk_expense_{column}', table, [column], ['id'])
+
+    op.execute("""
+        UPDATE expense e
+        SET category_id = c.id,
+            department_id = c.department_id,
+            budget_year_id = d.year_id
+        FROM subcategory s
+        JOIN category c ON c.id = s.category_id
+        JOIN department d ON d.id = c.department_id
+        WHERE s.id = e.subcategory_id
+          AND (e.category_id IS DISTINCT FROM c.id
+               OR e.department_id IS DISTINCT FROM c.department_id
+               OR e.budget_year_id IS DISTINCT FROM d.year_id)
+    """)
+
+    existing_indexes = [ix['name'] for ix in inspector.get_indexes('expense')]
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.alter_column('category_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('department_id', existing_type=sa.Integer(), nullable=False)
+        for column, _ in _COLUMNS:
+            if f'ix_expense_{column}' not in existing_indexes:
+                batch_op.create_index(f'ix_expense_{column}', [column])
+
+
+def downgrade():
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        for column, _ in reversed(_COLUMNS):
+            batch_op.drop_index(f'ix_expense_{column}')
+            batch_op.drop_constraint(f'fk_expense_{column}', type_='foreignkey')
+            batch_op.drop_column(column)
@@ -0,0 +1,88 @@
+"""Backfill expense.amount_ils, make it NOT NULL and add covering spend indexes
+
+Run `flask backfill-amount-ils` before upgrading to resolve historical rates
+through the exchange rate APIs. Whatever is still missing here is filled
+from the stored exchange_rate, then the latest cached rate on or before the
+expense date, then the same fallback rates the request path uses.
+
+Revision ID: k1l2m3n4o5p6
+Revises: j0k1l2m3n4o5
+Create Date: 2026-06-01
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'k1l2m3n4o5p6'
+down_revision = 'j0k1l2m3n4o5'
+branch_labels = None
+depends_on = None
+
+
+_INDEXES = [
+    ('ix_expense_status_subcategory_amount', ['status', 'subcategory_id']),
+    ('ix_expense_status_category_amount', ['status', 'category_id']),
+    ('ix_expense_status_department_amount', ['status', 'department_id']),
+    ('ix_expense_status_date_amount', ['status', 'date']),
+]
+
+
+def upgrade():
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    op.execute("""
+        UPDATE expense SET amount_ils = amount, exchange_rate = 1.0
+        WHERE amount_ils IS NULL AND currency = 'ILS'
+    """)
+    op.execute("""
+        UPDATE expense SET amount_ils = round((amount * exchange_rate)::numeric, 2)
+        WHERE amount_ils IS NULL AND exchange_rate IS NOT NULL
+    """)
+    op.execute("""
+        WITH resolved AS (
+            SELECT e.id, r.rate_to_ils AS rate
+            FROM expense e
+            JOIN LATERAL (
+                SELECT c.rate_to_ils FROM exchange_rate_cache c
+                WHERE c.currency = e.currency AND c.date <= e.date::date
+                ORDER BY c.date DESC
+                LIMIT 1
+            ) r ON true
+            WHERE e.amount_ils IS NULL
+        )
+        UPDATE expense e
+        SET exchange_rate = resolved.rate,
+            amount_ils = round((e.amount * resolved.rate)::numeric, 2)
+        FROM resolved
+        WHERE resolved.id = e.id
+    """)
+    # services.exchange_rate.FALLBACK_RATES; unknown currencies keep the
+    # amount as-is, as submit does
+    op.execute("""
+        UPDATE expense e
+        SET exchange_rate = f.rate,
+            amount_ils = round((e.amount * f.rate)::numeric, 2)
+        FROM (
+            SELECT currency, CASE currency WHEN 'USD' THEN 3.65 WHEN 'EUR' THEN 3.95 ELSE 1.0 END AS rate
+            FROM expense WHERE amount_ils IS NULL GROUP BY currency
+        ) f
+        WHERE e.amount_ils IS NULL AND e.currency = f.currency
+    """)
+
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.alter_column('amount_ils', existing_type=sa.Float(), nullable=False)
+
+    existing = [ix['name'] for ix in inspector.get_indexes('expense')]
+    for name, columns in _INDEXES:
+        if name not in existing:
+            op.create_index(name, 'expense', columns, postgresql_include=['amount_ils'])
+
+
+def downgrade():
+    for name, _ in reversed(_INDEXES):
+        op.drop_index(name, table_name='expense')
+    with op.batch_alter_table('expense', schema=None) as batch_op:
+        batch_op.alter_column('amount_ils', existing_type=sa.Float(), nullable=True)
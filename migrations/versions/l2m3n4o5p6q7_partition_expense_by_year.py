@@ -0,0 +1,108 @@
+"""Partition expense by budget year
+
+Rebuilds expense as a LIST-partitioned table on budget_year_id with one
+partition per budget year and a DEFAULT partition (expenses of departments
+without a year). Partitioned tables cannot be the target of a foreign key on
+id alone, so expense_attachment.expense_id loses its database-level FK: ORM
+deletes still cascade, and `flask storage-gc` removes attachments orphaned
+by other deletes. id is unique per partition only; across partitions it
+relies on the shared expense_id_seq. Postgres only.
+
+Revision ID: l2m3n4o5p6q7
+Revises: k1l2m3n4o5p6
+Create Date: 2026-06-15
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'l2m3n4o5p6q7'
+down_revision = 'k1l2m3n4o5p6'
+branch_labels = None
+depends_on = None
+
+
+def _is_partitioned(conn):
+    return conn.execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('expense'))"
+    )).scalar()
+
+
+def _definitions(conn, table):
+    """Secondary index and foreign key DDL of a table, to replay on its copy."""
+    # Partitioned parents report their indexes as "ON ONLY"
+    indexes = conn.execute(sa.text("""
+        SELECT replace(pg_get_indexdef(i.indexrelid), ' ON ONLY ', ' ON ')
+        FROM pg_index i
+        WHERE i.indrelid = to_regclass(:table) AND NOT i.indisprimary
+    """), {'table': table}).scalars().all()
+    foreign_keys = conn.execute(sa.text("""
+        SELECT conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE conrelid = to_regclass(:table) AND contype = 'f'
+    """), {'table': table}).all()
+    return indexes, foreign_keys
+
+
+def _rebuild(conn, old_table, create_sql, prepare):
+    """Recreate expense from create_sql and move the rows over.
+
+    prepare() runs before the copy (e.g. to create partitions) and returns
+    statements to run once the rows are loaded.
+    """
+    indexes, foreign_keys = _definitions(conn, 'expense')
+    sequence = conn.execute(sa.text("SELECT pg_get_serial_sequence('expense', 'id')")).scalar()
+
+    for fk in sa.inspect(conn).get_foreign_keys('expense_attachment'):
+        if fk['referred_table'] == 'expense':
+            op.drop_constraint(fk['name'], 'expense_attachment', type_='foreignkey')
+
+    op.execute(f'ALTER TABLE expense RENAME TO {old_table}')
+    op.execute(create_sql)
+    post_load = prepare()
+    op.execute(f'INSERT INTO expense SELECT * FROM {old_table}')
+    for statement in post_load:
+        op.execute(statement)
+    op.execute(f'ALTER SEQUENCE {sequence} OWNED BY expense.id')
+    op.execute(f'DROP TABLE {old_table} CASCADE')
+
+    # Index names are free again once the old table is gone
+    for index_sql in indexes:
+        op.execute(index_sql)
+    for name, definition in foreign_keys:
+        op.execute(f'ALTER TABLE expense ADD CONSTRAINT {name} {definition}')
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != 'postgresql' or _is_partitioned(conn):
+        return
+
+    def create_partitions():
+        op.execute('CREATE TABLE expense_default PARTITION OF expense DEFAULT')
+        statements = ['ALTER TABLE expense_default ADD PRIMARY KEY (id)']
+        for year_id in conn.execute(sa.text('SELECT id FROM budget_year ORDER BY id')).scalars():
+            op.execute(f'CREATE TABLE expense_y{year_id} PARTITION OF expense FOR VALUES IN ({year_id})')
+            statements.append(f'ALTER TABLE expense_y{year_id} ADD PRIMARY KEY (id)')
+        # Point lookups by id without a year probe each partition's key
+        statements.append('CREATE INDEX ix_expense_id ON expense (id)')
+        return statements
+
+    _rebuild(conn, 'expense_unpartitioned', """
+        CREATE TABLE expense (LIKE expense_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+        PARTITION BY LIST (budget_year_id)
+    """, create_partitions)
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != 'postgresql' or not _is_partitioned(conn):
+        return
+
+    op.execute('DROP INDEX IF EXISTS ix_expense_id')
+    _rebuild(conn, 'expense_partitioned', """
+        CREATE TABLE expense (LIKE expense_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+    """, lambda: ['ALTER TABLE expense ADD PRIMARY KEY (id)'])
+    op.create_foreign_key('expense_attachment_expense_id_fkey', 'expense_attachment', 'expense',
+                          ['expense_id'], ['id'], ondelete='CASCADE')
@@ -0,0 +1,75 @@
+"""Add cold archive for closed budget years
+
+Adds budget_year.is_archived/archived_at and the expense_archive table.
+When expense is partitioned, expense_archive is partitioned the same way so
+archiving a year is a DETACH/ATTACH of its partition (services/year_archive.py).
+
+Revision ID: m3n4o5p6q7r8
+Revises: l2m3n4o5p6q7
+Create Date: 2026-07-06
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'm3n4o5p6q7r8'
+down_revision = 'l2m3n4o5p6q7'
+branch_labels = None
+depends_on = None
+
+
+def _is_partitioned(conn, table):
+    return conn.execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table))"
+    ), {'table': table}).scalar()
+
+
+def upgrade():
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    existing_columns = [c['name'] for c in inspector.get_columns('budget_year')]
+    with op.batch_alter_table('budget_year', schema=None) as batch_op:
+        if 'is_archived' not in existing_columns:
+            batch_op.add_column(sa.Column('is_archived', sa.Boolean(), nullable=False,
+                                          server_default=sa.false()))
+        if 'archived_at' not in existing_columns:
+            batch_op.add_column(sa.Column('archived_at', sa.DateTime(), nullable=True))
+
+    if conn.dialect.name != 'postgresql':
+        return
+
+    expense_partitioned = _is_partitioned(conn, 'expense')
+    if inspector.has_table('expense_archive'):
+        # init-db creates a plain copy; swap it for a partitioned one while
+        # it is still empty
+        if not expense_partitioned or _is_partitioned(conn, 'expense_archive'):
+            return
+        if conn.execute(sa.text('SELECT EXISTS (SELECT 1 FROM expense_archive)')).scalar():
+            return
+        op.execute('DROP TABLE expense_archive')
+
+    if expense_partitioned:
+        op.execute("""
+            CREATE TABLE expense_archive (LIKE expense INCLUDING DEFAULTS INCLUDING CONSTRAINTS)
+            PARTITION BY LIST (budget_year_id)
+        """)
+    else:
+        op.execute('CREATE TABLE expense_archive (LIKE expense INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+        op.execute('ALTER TABLE expense_archive ADD PRIMARY KEY (id)')
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name == 'postgresql':
+        archived = conn.execute(sa.text(
+            'SELECT count(*) FROM budget_year WHERE is_archived'
+        )).scalar()
+        if archived:
+            raise RuntimeError(f'{archived} budget year(s) are archived; restore them before downgrading')
+    op.execute('DROP TABLE IF EXISTS expense_archive')
+    with op.batch_alter_table('budget_year', schema=None) as batch_op:
+        batch_op.drop_column('archived_at')
+        batch_op.drop_column('is_archived')
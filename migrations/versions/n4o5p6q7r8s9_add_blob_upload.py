@@ -0,0 +1,35 @@
+"""Add blob_upload: who uploaded which stored document
+
+Revision ID: n4o5p6q7r8s9
+Revises: m3n4o5p6q7r8
+Create Date: 2026-10-19
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'n4o5p6q7r8s9'
+down_revision = 'm3n4o5p6q7r8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    from sqlalchemy import inspect
+    conn = op.get_bind()
+    inspector = inspect(conn)
+
+    if 'blob_upload' not in inspector.get_table_names():
+        op.create_table('blob_upload',
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('user.id', ondelete='CASCADE'), nullable=False),
+            sa.Column('content_hash', sa.String(length=64), nullable=False),
+            sa.Column('uploaded_at', sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint('user_id', 'content_hash')
+        )
+        op.create_index('ix_blob_upload_uploaded_at', 'blob_upload', ['uploaded_at'])
+
+
+def downgrade():
+    op.drop_index('ix_blob_upload_uploaded_at', table_name='blob_upload')
+    op.drop_table('blob_upload')
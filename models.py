@@ -1,9 +1,38 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import event, func, inspect, select
 from datetime import datetime
 
 db = SQLAlchemy()
 
+# Lineage ids identify "the same" department/category/subcategory across
+# budget years; year rollover copies them, so they survive renames
+department_lineage_seq = db.Sequence('department_lineage_seq', metadata=db.metadata)
+category_lineage_seq = db.Sequence('category_lineage_seq', metadata=db.metadata)
+subcategory_lineage_seq = db.Sequence('subcategory_lineage_seq', metadata=db.metadata)
+
+
+def _next_lineage_id(sequence):
+    """Column default drawing a new lineage id.
+
+    Postgres takes it from the sequence (the migration also installs nextval()
+    as the server default). Databases without sequences, such as a SQLite dev
+    database built by db.create_all(), get max + 1, counted on per statement
+    so a multi-row insert does not hand out the same id twice.
+    """
+    def next_lineage_id(context):
+        if context.dialect.supports_sequences:
+            return context.connection.execute(select(sequence.next_value())).scalar()
+        column = context.current_column
+        next_ids = context.__dict__.setdefault('_next_lineage_ids', {})
+        if column not in next_ids:
+            next_ids[column] = context.connection.execute(
+                select(func.coalesce(func.max(column), 0) + 1)
+            ).scalar()
+        next_ids[column] += 1
+        return next_ids[column] - 1
+    return next_lineage_id
+
 class BudgetYear(db.Model):
     """Model for tracking budget years - each year has its own structure"""
     __tablename__ = 'budget_year'
@@ -12,14 +41,21 @@ class BudgetYear(db.Model):
     name = db.Column(db.String(50))  # e.g., "2024", "FY2024"
     is_active = db.Column(db.Boolean, default=True)
     is_current = db.Column(db.Boolean, default=False)  # Current working year
+    # Closed year whose expenses live in expense_archive (read-only)
+    is_archived = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    archived_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     departments = db.relationship('Department', back_populates='budget_year', lazy=True)
 
 class Department(db.Model):
     __tablename__ = 'department'
-    __table_args__ = (db.UniqueConstraint('name', 'year_id', name='uq_department_name_year'),)
+    __table_args__ = (
+        db.UniqueConstraint('name', 'year_id', name='uq_department_name_year'),
+        db.Index('ix_department_lineage_year', 'lineage_id', 'year_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
+    lineage_id = db.Column(db.Integer, default=_next_lineage_id(department_lineage_seq), nullable=False)
     budget = db.Column(db.Float, default=0.0)
     currency = db.Column(db.String(3), nullable=False, default='ILS')
     year_id = db.Column(db.Integer, db.ForeignKey('budget_year.id'), nullable=True)
@@ -29,8 +65,11 @@ class Department(db.Model):
 
 class Category(db.Model):
     __tablename__ = 'category'
+    # Categories carry their year through the department
+    __table_args__ = (db.Index('ix_category_lineage_department', 'lineage_id', 'department_id'),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
+    lineage_id = db.Column(db.Integer, default=_next_lineage_id(category_lineage_seq), nullable=False)
     budget = db.Column(db.Float, default=0.0)
     is_welfare = db.Column(db.Boolean, default=False)
     department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False)
@@ -38,8 +77,10 @@ class Category(db.Model):
 
 class Subcategory(db.Model):
     __tablename__ = 'subcategory'
+    __table_args__ = (db.Index('ix_subcategory_lineage_category', 'lineage_id', 'category_id'),)
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
+    lineage_id = db.Column(db.Integer, default=_next_lineage_id(subcategory_lineage_seq), nullable=False)
     budget = db.Column(db.Float, default=0.0)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     expenses = db.relationship('Expense', backref='subcategory', lazy=True)
@@ -116,8 +157,7 @@ class User(UserMixin, db.Model):
         else:
             end_date = datetime(year, month + 1, 1)
         
-        total = db.session.query(db.func.sum(
-                   db.func.coalesce(Expense.amount_ils, Expense.amount)))\
+        total = db.session.query(db.func.sum(Expense.amount_ils))\
             .filter(Expense.user_id == self.id,
                    Expense.status == 'approved',
                    Expense.type != 'future_approval',  # Exclude future approvals even if approved
@@ -164,11 +204,25 @@ class CreditCard(db.Model):
     expenses = db.relationship('Expense', backref='credit_card', lazy=True)
 
 class Expense(db.Model):
+    # On Postgres the table is LIST partitioned by budget_year_id (see
+    # services/expense_partitions.py); filter on it to read one year only
     __tablename__ = 'expense'
+    # Covering indexes: approved-spend sums per subcategory/category/
+    # department and per date range are answered from the index alone
+    __table_args__ = (
+        db.Index('ix_expense_status_subcategory_amount', 'status', 'subcategory_id',
+                 postgresql_include=['amount_ils']),
+        db.Index('ix_expense_status_category_amount', 'status', 'category_id',
+                 postgresql_include=['amount_ils']),
+        db.Index('ix_expense_status_department_amount', 'status', 'department_id',
+                 postgresql_include=['amount_ils']),
+        db.Index('ix_expense_status_date_amount', 'status', 'date',
+                 postgresql_include=['amount_ils']),
+    )
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float, nullable=False)
     currency = db.Column(db.String(3), nullable=False, default='ILS')
-    amount_ils = db.Column(db.Float, nullable=True)      # ILS equivalent
+    amount_ils = db.Column(db.Float, nullable=False)     # ILS equivalent
     exchange_rate = db.Column(db.Float, nullable=True)    # Rate used (e.g., 3.65 for USD->ILS)
     description = db.Column(db.String(200))
     reason = db.Column(db.String(500))
@@ -177,6 +231,11 @@ class Expense(db.Model):
     status = db.Column(db.String(20), default='pending')
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     subcategory_id = db.Column(db.Integer, db.ForeignKey('subcategory.id'), nullable=False)
+    # Copied from subcategory -> category -> department so aggregates and
+    # access filters need no joins; kept in sync by _sync_expense_placement
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False, index=True)
+    department_id = db.Column(db.Integer, db.ForeignKey('department.id'), nullable=False, index=True)
+    budget_year_id = db.Column(db.Integer, db.ForeignKey('budget_year.id'), nullable=True, index=True)
     quote_filename = db.Column(db.String(255))
     invoice_filename = db.Column(db.String(255))
     receipt_filename = db.Column(db.String(255))
@@ -206,6 +265,59 @@ class Expense(db.Model):
                             backref=db.backref('external_accounting_entries', lazy='dynamic'))
 
 
+# Expenses of archived budget years, moved out of the hot table by
+# services/year_archive.py. Same columns as expense; no secondary indexes.
+expense_archive = Expense.__table__.to_metadata(db.metadata, name='expense_archive')
+expense_archive.indexes.clear()
+
+
+_PLACEMENT_ATTRS = ('category_id', 'department_id', 'budget_year_id')
+
+
+@event.listens_for(Expense, 'before_insert')
+@event.listens_for(Expense, 'before_update')
+def _sync_expense_placement(mapper, connection, expense):
+    """Fill category/department/budget year whenever subcategory_id changes,
+    unless the caller already set all three in the same flush."""
+    attrs = inspect(expense).attrs
+    if not attrs.subcategory_id.history.has_changes():
+        return
+    if all(attrs[name].history.has_changes() for name in _PLACEMENT_ATTRS):
+        return
+    row = connection.execute(
+        select(Category.id, Category.department_id, Department.year_id)
+        .join_from(Subcategory, Category, Subcategory.category_id == Category.id)
+        .join(Department, Category.department_id == Department.id)
+        .where(Subcategory.id == expense.subcategory_id)
+    ).first()
+    if row is not None:
+        expense.category_id, expense.department_id, expense.budget_year_id = row
+
+
+class ExpenseAttachment(db.Model):
+    """A document (quote, invoice or receipt) attached to an expense.
+
+    An expense can hold several files of each kind. Expense.<kind>_filename is
+    kept pointing at the latest one for clients that read the legacy columns.
+    """
+    __tablename__ = 'expense_attachment'
+    id = db.Column(db.Integer, primary_key=True)
+    # Not enforced by Postgres once expense is partitioned; ORM deletes
+    # cascade through the relationship below, and `flask storage-gc` removes
+    # attachments orphaned by any other delete
+    expense_id = db.Column(db.Integer, db.ForeignKey('expense.id', ondelete='CASCADE'), nullable=False, index=True)
+    kind = db.Column(db.String(20), nullable=False)  # quote, invoice, receipt
+    stored_name = db.Column(db.String(255), nullable=False, unique=True, index=True)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # sha256 hex
+    size = db.Column(db.BigInteger, nullable=True)
+    mime_type = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expense = db.relationship('Expense',
+                              backref=db.backref('attachments', lazy=True,
+                                                 cascade='all, delete-orphan',
+                                                 order_by='ExpenseAttachment.id'))
+
+
 class ExchangeRateCache(db.Model):
     """Cache table for exchange rates to ILS"""
     __tablename__ = 'exchange_rate_cache'
@@ -213,4 +325,51 @@ class ExchangeRateCache(db.Model):
     currency = db.Column(db.String(3), nullable=False)
     date = db.Column(db.Date, nullable=False)
     rate_to_ils = db.Column(db.Float, nullable=False)
-    __table_args__ = (db.UniqueConstraint('currency', 'date'),)
\ No newline at end of file
+    __table_args__ = (db.UniqueConstraint('currency', 'date'),)
+
+class StoredFile(db.Model):
+    """Metadata for an uploaded file in UPLOAD_FOLDER.
+
+    `name` is the public filename stored on Expense (quote/invoice/receipt_filename);
+    `storage_path` is relative to UPLOAD_FOLDER: the shared StoredBlob path for
+    uploads since content deduplication, a shard of the name for older files.
+    """
+    __tablename__ = 'stored_file'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False, unique=True)
+    storage_path = db.Column(db.String(512), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)  # sha256 hex
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class StoredBlob(db.Model):
+    """A distinct uploaded document, stored once under blobs/ab/cd/<sha256>.
+
+    StoredFile rows for new uploads point at the blob's storage_path, so the
+    same PDF attached to several expenses takes disk space once. `ref_count`
+    counts those rows; blobs at zero are removed by `flask storage-gc`.
+    """
+    __tablename__ = 'stored_blob'
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True)  # sha256 hex
+    storage_path = db.Column(db.String(512), nullable=False)
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100), nullable=True)
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_referenced_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class BlobUpload(db.Model):
+    """A user sent the bytes of a StoredBlob (OCR or direct upload).
+
+    Submitting an expense may reference a document by hash only if the user
+    uploaded it recently or can already see an expense it is attached to;
+    knowing a hash is not proof of having the document.
+    """
+    __tablename__ = 'blob_upload'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    content_hash = db.Column(db.String(64), primary_key=True)  # sha256 hex
+    uploaded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
@@ -1,18 +1,24 @@
-from flask import jsonify, request, current_app
+from flask import jsonify, request
 from flask_login import login_required, current_user
 from models import Expense, Department, Category, Subcategory, User, Supplier, CreditCard, BudgetYear, db
 from services.manager_access import get_manager_access, build_category_access_filter, has_category_access, has_subcategory_access
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, and_, or_, select
 from sqlalchemy.orm import joinedload, subqueryload
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from werkzeug.security import generate_password_hash
 from werkzeug.utils import secure_filename
 import logging
-import os
 import pytz
 from . import api_v1
-from services.exchange_rate import get_exchange_rate
+from services.exchange_rate import convert_to_ils
+from services.file_storage import resolve_path
+from services.expense_serializers import EXPENSE_LIST_SHAPE, ACCOUNTING_EXPENSE_SHAPE, FieldSelectionError
+from services.ocr_limiter import get_ocr_limiter
+from services.attachments import ATTACHMENT_KINDS, add_attachment, remove_attachment, remove_attachments, serialize_attachments
+from services.budget_years import get_current_year_id
+from services.budget_hierarchy import get_year_hierarchy, get_subcategory_paths, get_year_summaries, format_path, assign_subcategory
+from services.year_archive import expense_source, filter_active_departments
 from utils.email_sender import send_email
 
 
@@ -84,7 +90,7 @@ def get_admin_stats():
         status_query = db.session.query(
             Expense.status,
             func.count(Expense.id).label('count'),
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('amount')
+            func.sum(Expense.amount_ils).label('amount')
         ).filter(
             Expense.date >= start_date,
             Expense.date <= end_date
@@ -121,7 +127,7 @@ def get_admin_stats():
             # Monthly breakdown
             trend_query = db.session.query(
                 func.date_trunc('month', Expense.date).label('month'),
-                func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('amount')
+                func.sum(Expense.amount_ils).label('amount')
             ).filter(
                 Expense.date >= start_date,
                 Expense.date <= end_date,
@@ -139,7 +145,7 @@ def get_admin_stats():
             # Weekly breakdown for shorter periods
             trend_query = db.session.query(
                 func.date_trunc('week', Expense.date).label('week'),
-                func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('amount')
+                func.sum(Expense.amount_ils).label('amount')
             ).filter(
                 Expense.date >= start_date,
                 Expense.date <= end_date,
@@ -157,15 +163,13 @@ def get_admin_stats():
         # Department spending
         dept_query = db.session.query(
             Department.name,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('amount')
-        ).join(Category, Department.id == Category.department_id)\
-         .join(Subcategory, Category.id == Subcategory.category_id)\
-         .join(Expense, Subcategory.id == Expense.subcategory_id)\
+            func.sum(Expense.amount_ils).label('amount')
+        ).join(Expense, Department.id == Expense.department_id)\
          .filter(
              Expense.date >= start_date,
              Expense.date <= end_date,
              Expense.status == 'approved'
-         ).group_by(Department.name).order_by(func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).desc()).limit(10).all()
+         ).group_by(Department.name).order_by(func.sum(Expense.amount_ils).desc()).limit(10).all()
         
         department_spending = [
             {'name': name, 'amount': float(amount or 0)}
@@ -175,15 +179,14 @@ def get_admin_stats():
         # Category distribution
         cat_query = db.session.query(
             Category.name,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('amount')
+            func.sum(Expense.amount_ils).label('amount')
         ).select_from(Expense)\
-         .join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-         .join(Category, Subcategory.category_id == Category.id)\
+         .join(Category, Expense.category_id == Category.id)\
          .filter(
              Expense.date >= start_date,
              Expense.date <= end_date,
              Expense.status == 'approved'
-         ).group_by(Category.name).order_by(func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).desc()).limit(10).all()
+         ).group_by(Category.name).order_by(func.sum(Expense.amount_ils).desc()).limit(10).all()
         
         category_distribution = [
             {'name': name, 'amount': float(amount or 0)}
@@ -193,14 +196,14 @@ def get_admin_stats():
         # Top users
         user_query = db.session.query(
             User.username,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('amount')
+            func.sum(Expense.amount_ils).label('amount')
         ).select_from(Expense)\
          .join(User, Expense.user_id == User.id)\
          .filter(
              Expense.date >= start_date,
              Expense.date <= end_date,
              Expense.status == 'approved'
-         ).group_by(User.username).order_by(func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).desc()).limit(10).all()
+         ).group_by(User.username).order_by(func.sum(Expense.amount_ils).desc()).limit(10).all()
         
         top_users = [
             {'name': username, 'amount': float(amount or 0)}
@@ -209,19 +212,17 @@ def get_admin_stats():
         
         # Budget usage by department - associate expenses with budget's department (subcategory->category->department)
         dept_spending_query = db.session.query(
-            Category.department_id,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('spent')
-        ).join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-         .join(Category, Subcategory.category_id == Category.id)\
-         .filter(
+            Expense.department_id,
+            func.sum(Expense.amount_ils).label('spent')
+        ).filter(
              Expense.date >= start_date,
              Expense.date <= end_date,
              Expense.status == 'approved'
-         ).group_by(Category.department_id).all()
+         ).group_by(Expense.department_id).all()
 
         dept_spending_map = {dept_id: float(spent or 0) for dept_id, spent in dept_spending_query}
 
-        departments = Department.query.all()
+        departments = filter_active_departments(Department.query).all()
         budget_usage = []
         for dept in departments:
             dept_expenses = dept_spending_map.get(dept.id, 0.0)
@@ -260,6 +261,19 @@ def get_admin_stats():
         return jsonify({'error': 'Failed to fetch admin statistics'}), 500
 
 
+@api_v1.route('/admin/ocr/metrics', methods=['GET'])
+@login_required
+def get_ocr_metrics():
+    """OCR limiter queue depth, wait times and rejections for the worker that answers."""
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admin access required'}), 403
+    try:
+        return jsonify(get_ocr_limiter().metrics()), 200
+    except Exception as e:
+        logging.error(f"Error getting OCR metrics: {str(e)}")
+        return jsonify({'error': 'Failed to fetch OCR metrics'}), 500
+
+
 # ==================== EXPENSE FILTER OPTIONS ====================
 
 @api_v1.route('/admin/expense-filter-options', methods=['GET'])
@@ -280,11 +294,11 @@ def get_expense_filter_options():
 
     try:
         # Get current budget year
-        current_year = BudgetYear.query.filter_by(is_current=True).first()
+        current_year_id = get_current_year_id()
 
         # 1. Departments (filtered by current budget year)
-        if current_year:
-            departments = Department.query.filter_by(year_id=current_year.id).all()
+        if current_year_id:
+            departments = Department.query.filter_by(year_id=current_year_id).all()
         else:
             departments = Department.query.all()
         dept_list = [{
@@ -317,8 +331,8 @@ def get_expense_filter_options():
             joinedload(Category.subcategories),
             joinedload(Category.department)
         )
-        if current_year:
-            base_query = base_query.filter(Department.year_id == current_year.id)
+        if current_year_id:
+            base_query = base_query.filter(Department.year_id == current_year_id)
         categories = base_query.order_by(Department.name, Category.name).all()
 
         cat_list = []
@@ -357,9 +371,9 @@ def get_expense_filter_options():
         } for card in cards]
 
         # 6. Subcategories flat list (filtered by budget year)
-        if current_year:
+        if current_year_id:
             subcategories = Subcategory.query.join(Category).join(Department).filter(
-                Department.year_id == current_year.id
+                Department.year_id == current_year_id
             ).all()
         else:
             subcategories = Subcategory.query.all()
@@ -396,7 +410,7 @@ def get_manager_expense_filter_options():
     try:
         # Get managed department IDs and cross-department category IDs
         if current_user.is_admin:
-            managed_dept_ids = [d.id for d in Department.query.all()]
+            managed_dept_ids = [d.id for d in filter_active_departments(Department.query.with_entities(Department.id))]
             managed_cat_ids = []
         else:
             managed_dept_ids, managed_cat_ids, managed_subcat_ids = get_manager_access(current_user)
@@ -416,7 +430,7 @@ def get_manager_expense_filter_options():
         cat_access_filter = build_category_access_filter(managed_dept_ids, managed_cat_ids, managed_subcat_ids if not current_user.is_admin else None)
 
         # Get current budget year
-        current_year = BudgetYear.query.filter_by(is_current=True).first()
+        current_year_id = get_current_year_id()
 
         # 1. Departments - managed ones + departments that contain cross-dept categories
         dept_ids_from_cats = []
@@ -426,8 +440,8 @@ def get_manager_expense_filter_options():
         all_dept_ids = list(set(managed_dept_ids + dept_ids_from_cats))
 
         dept_query = Department.query.filter(Department.id.in_(all_dept_ids))
-        if current_year:
-            dept_query = dept_query.filter(Department.year_id == current_year.id)
+        if current_year_id:
+            dept_query = dept_query.filter(Department.year_id == current_year_id)
             
         departments = dept_query.all() if all_dept_ids else []
         dept_list = [{
@@ -465,8 +479,8 @@ def get_manager_expense_filter_options():
         )
         if cat_access_filter is not None:
             cat_query = cat_query.filter(cat_access_filter)
-        if current_year:
-            cat_query = cat_query.filter(Department.year_id == current_year.id)
+        if current_year_id:
+            cat_query = cat_query.filter(Department.year_id == current_year_id)
         # HR users: exclude welfare categories from other departments (handled via HR dashboard)
         if current_user.is_hr and not current_user.is_admin:
             cat_query = cat_query.filter(or_(
@@ -514,8 +528,8 @@ def get_manager_expense_filter_options():
         subcat_query = Subcategory.query.join(Category).join(Department)
         if cat_access_filter is not None:
             subcat_query = subcat_query.filter(cat_access_filter)
-        if current_year:
-            subcat_query = subcat_query.filter(Department.year_id == current_year.id)
+        if current_year_id:
+            subcat_query = subcat_query.filter(Department.year_id == current_year_id)
         # HR users: exclude welfare subcategories from other departments (handled via HR dashboard)
         if current_user.is_hr and not current_user.is_admin:
             subcat_query = subcat_query.filter(or_(
@@ -1205,9 +1219,11 @@ def manager_list_expenses():
         return jsonify({'error': 'Manager access required'}), 403
 
     try:
+        include_archived = request.args.get('include_archived', '').lower() == 'true'
+
         # Get managed department IDs and cross-department category IDs
         if current_user.is_admin:
-            managed_dept_ids = [d.id for d in Department.query.all()]
+            managed_dept_ids = [d.id for d in filter_active_departments(Department.query.with_entities(Department.id), include_archived)]
             managed_cat_ids = []
         else:
             managed_dept_ids, managed_cat_ids, managed_subcat_ids = get_manager_access(current_user)
@@ -1235,10 +1251,16 @@ def manager_list_expenses():
         search = request.args.get('search', None, type=str)
         sort_by = request.args.get('sort_by', 'id', type=str)
         sort_order = request.args.get('sort_order', 'desc', type=str)
+        ExpenseSource = expense_source(include_archived)
+
+        # fields= picks attributes, include= the related objects to expand
+        try:
+            shape = EXPENSE_LIST_SHAPE.select(request.args.get('fields'), request.args.get('include'))
+        except FieldSelectionError as e:
+            return jsonify({'error': str(e)}), 400
 
         # Build query - manager sees expenses from managed departments + cross-dept categories
-        query = Expense.query.join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-            .join(Category, Subcategory.category_id == Category.id)
+        query = select(ExpenseSource.id).join(Category, ExpenseSource.category_id == Category.id)
 
         # Filter to managed departments + cross-department categories
         query = query.filter(cat_access_filter)
@@ -1252,140 +1274,71 @@ def manager_list_expenses():
             ))
 
         # Join User and Supplier for search and display
-        query = query.join(User, Expense.user_id == User.id)
-        query = query.outerjoin(Supplier, Expense.supplier_id == Supplier.id)
+        query = query.join(User, ExpenseSource.user_id == User.id)
+        query = query.outerjoin(Supplier, ExpenseSource.supplier_id == Supplier.id)
 
         # Apply filters
         if status:
-            query = query.filter(Expense.status == status)
+            query = query.filter(ExpenseSource.status == status)
 
         if department_id:
-            query = query.filter(Category.department_id == department_id)
+            query = query.filter(ExpenseSource.department_id == department_id)
 
         if user_id:
-            query = query.filter(Expense.user_id == user_id)
+            query = query.filter(ExpenseSource.user_id == user_id)
 
         if subcategory_id:
-            query = query.filter(Expense.subcategory_id == subcategory_id)
+            query = query.filter(ExpenseSource.subcategory_id == subcategory_id)
         elif category_id:
-            # Subcategory already joined above
-            query = query.filter(Subcategory.category_id == category_id)
+            query = query.filter(ExpenseSource.category_id == category_id)
 
         if supplier_id:
-            query = query.filter(Expense.supplier_id == supplier_id)
+            query = query.filter(ExpenseSource.supplier_id == supplier_id)
 
         if payment_method:
             if payment_method in ('transfer', 'bank_transfer'):
-                query = query.filter(Expense.payment_method.in_(['transfer', 'bank_transfer']))
+                query = query.filter(ExpenseSource.payment_method.in_(['transfer', 'bank_transfer']))
             else:
-                query = query.filter(Expense.payment_method == payment_method)
+                query = query.filter(ExpenseSource.payment_method == payment_method)
 
         if start_date:
             try:
-                query = query.filter(Expense.date >= datetime.fromisoformat(start_date))
+                query = query.filter(ExpenseSource.date >= datetime.fromisoformat(start_date))
             except ValueError:
                 return jsonify({'error': 'Invalid start_date format. Use ISO format (YYYY-MM-DD)'}), 400
 
         if end_date:
             try:
-                query = query.filter(Expense.date <= datetime.fromisoformat(end_date))
+                query = query.filter(ExpenseSource.date <= datetime.fromisoformat(end_date))
             except ValueError:
                 return jsonify({'error': 'Invalid end_date format. Use ISO format (YYYY-MM-DD)'}), 400
 
         if search:
             query = query.filter(
-                (Expense.description.ilike(f'%{search}%')) |
-                (Expense.reason.ilike(f'%{search}%')) |
+                (ExpenseSource.description.ilike(f'%{search}%')) |
+                (ExpenseSource.reason.ilike(f'%{search}%')) |
                 (User.first_name.ilike(f'%{search}%')) |
                 (User.last_name.ilike(f'%{search}%')) |
                 (Supplier.name.ilike(f'%{search}%')) |
-                (func.cast(Expense.amount, db.String).ilike(f'%{search}%'))
+                (func.cast(ExpenseSource.amount, db.String).ilike(f'%{search}%'))
             )
 
         # Apply sorting
         if sort_by == 'id':
-            query = query.order_by(Expense.id.desc() if sort_order == 'desc' else Expense.id.asc())
+            query = query.order_by(ExpenseSource.id.desc() if sort_order == 'desc' else ExpenseSource.id.asc())
         elif sort_by == 'date':
-            query = query.order_by(Expense.date.desc() if sort_order == 'desc' else Expense.date.asc())
+            query = query.order_by(ExpenseSource.date.desc() if sort_order == 'desc' else ExpenseSource.date.asc())
         elif sort_by == 'amount':
-            query = query.order_by(Expense.amount.desc() if sort_order == 'desc' else Expense.amount.asc())
+            query = query.order_by(ExpenseSource.amount.desc() if sort_order == 'desc' else ExpenseSource.amount.asc())
         elif sort_by == 'status':
-            query = query.order_by(Expense.status.desc() if sort_order == 'desc' else Expense.status.asc())
+            query = query.order_by(ExpenseSource.status.desc() if sort_order == 'desc' else ExpenseSource.status.asc())
         else:
-            query = query.order_by(Expense.id.desc())
-
-        # Add eager loading
-        query = query.options(
-            joinedload(Expense.submitter).joinedload(User.home_department),
-            joinedload(Expense.subcategory).joinedload(Subcategory.category).joinedload(Category.department).joinedload(Department.budget_year),
-            joinedload(Expense.supplier),
-            joinedload(Expense.credit_card),
-            joinedload(Expense.handler)
-        )
+            query = query.order_by(ExpenseSource.id.desc())
 
-        # Paginate
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-
-        expense_list = []
-        for expense in pagination.items:
-            expense_list.append({
-                'id': expense.id,
-                'amount': expense.amount,
-                'currency': expense.currency,
-                'amount_ils': expense.amount_ils,
-                'exchange_rate': expense.exchange_rate,
-                'description': expense.description,
-                'reason': expense.reason,
-                'date': expense.date.isoformat() if expense.date else None,
-                'invoice_date': expense.invoice_date.isoformat() if expense.invoice_date else None,
-                'status': expense.status,
-                'type': expense.type,
-                'payment_method': expense.payment_method,
-                'payment_status': expense.payment_status,
-                'rejection_reason': expense.rejection_reason,
-                'credit_card_id': expense.credit_card_id,
-                'credit_card': {
-                    'id': expense.credit_card.id,
-                    'name': expense.credit_card.description or f"Card *{expense.credit_card.last_four_digits}",
-                    'last_four_digits': expense.credit_card.last_four_digits
-                } if expense.credit_card else None,
-                'user': {
-                    'id': expense.submitter.id,
-                    'username': expense.submitter.username,
-                    'name': f"{expense.submitter.first_name} {expense.submitter.last_name}".strip(),
-                    'department': expense.subcategory.category.department.name if expense.subcategory and expense.subcategory.category and expense.subcategory.category.department else None,
-                    'department_id': expense.subcategory.category.department_id if expense.subcategory and expense.subcategory.category else None
-                },
-                'subcategory': {
-                    'id': expense.subcategory.id,
-                    'name': expense.subcategory.name
-                } if expense.subcategory else None,
-                'category': {
-                    'id': expense.subcategory.category.id,
-                    'name': expense.subcategory.category.name
-                } if expense.subcategory and expense.subcategory.category else None,
-                'supplier': {
-                    'id': expense.supplier.id,
-                    'name': expense.supplier.name
-                } if expense.supplier else None,
-                'budget_year': {
-                    'id': expense.subcategory.category.department.budget_year.id,
-                    'year': expense.subcategory.category.department.budget_year.year,
-                    'name': expense.subcategory.category.department.budget_year.name
-                } if expense.subcategory and expense.subcategory.category and expense.subcategory.category.department and expense.subcategory.category.department.budget_year else None,
-                'handler': {
-                    'id': expense.handler.id,
-                    'name': f"{expense.handler.first_name} {expense.handler.last_name}".strip()
-                } if expense.handler else None,
-                'handled_at': expense.handled_at.isoformat() if expense.handled_at else None,
-                'has_invoice': bool(expense.invoice_filename),
-                'has_receipt': bool(expense.receipt_filename),
-                'has_quote': bool(expense.quote_filename),
-                'invoice_filename': expense.invoice_filename,
-                'receipt_filename': expense.receipt_filename,
-                'quote_filename': expense.quote_filename,
-                'submit_date': expense.submit_date.isoformat() if expense.submit_date else None
-            })
+        # Paginate, selecting only the columns the response needs
+        pagination = shape.paginate(query, page, per_page, source=ExpenseSource,
+                                    joined={'category': Category, 'submitter': User, 'supplier': Supplier})
+        expense_list = pagination.items
 
         return jsonify({
             'expenses': expense_list,
@@ -1428,148 +1381,84 @@ def admin_list_expenses():
         search = request.args.get('search', None, type=str)
         sort_by = request.args.get('sort_by', 'id', type=str)  # Default to insertion order (newest first)
         sort_order = request.args.get('sort_order', 'desc', type=str)
+        include_archived = request.args.get('include_archived', '').lower() == 'true'
+        ExpenseSource = expense_source(include_archived)
+
+        # fields= picks attributes, include= the related objects to expand
+        try:
+            shape = EXPENSE_LIST_SHAPE.select(request.args.get('fields'), request.args.get('include'))
+        except FieldSelectionError as e:
+            return jsonify({'error': str(e)}), 400
 
         # Build query - admin sees all expenses
-        query = Expense.query.join(User, Expense.user_id == User.id)
+        query = select(ExpenseSource.id).join(User, ExpenseSource.user_id == User.id)
 
         # Left join Supplier for search functionality
-        query = query.outerjoin(Supplier, Expense.supplier_id == Supplier.id)
+        query = query.outerjoin(Supplier, ExpenseSource.supplier_id == Supplier.id)
 
         # Apply filters
         if status:
-            query = query.filter(Expense.status == status)
+            query = query.filter(ExpenseSource.status == status)
 
         if department_id:
-            query = query.join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-                .join(Category, Subcategory.category_id == Category.id)\
-                .filter(Category.department_id == department_id)
+            query = query.filter(ExpenseSource.department_id == department_id)
 
         if user_id:
-            query = query.filter(Expense.user_id == user_id)
+            query = query.filter(ExpenseSource.user_id == user_id)
 
         if subcategory_id:
-            query = query.filter(Expense.subcategory_id == subcategory_id)
+            query = query.filter(ExpenseSource.subcategory_id == subcategory_id)
         elif category_id:
-            if not department_id:  # Avoid duplicate join
-                query = query.join(Subcategory, Expense.subcategory_id == Subcategory.id)
-            query = query.filter(Subcategory.category_id == category_id)
+            query = query.filter(ExpenseSource.category_id == category_id)
 
         if supplier_id:
-            query = query.filter(Expense.supplier_id == supplier_id)
+            query = query.filter(ExpenseSource.supplier_id == supplier_id)
 
         if payment_method:
             if payment_method in ('transfer', 'bank_transfer'):
-                query = query.filter(Expense.payment_method.in_(['transfer', 'bank_transfer']))
+                query = query.filter(ExpenseSource.payment_method.in_(['transfer', 'bank_transfer']))
             else:
-                query = query.filter(Expense.payment_method == payment_method)
+                query = query.filter(ExpenseSource.payment_method == payment_method)
 
         if start_date:
             try:
-                query = query.filter(Expense.date >= datetime.fromisoformat(start_date))
+                query = query.filter(ExpenseSource.date >= datetime.fromisoformat(start_date))
             except ValueError:
                 return jsonify({'error': 'Invalid start_date format. Use ISO format (YYYY-MM-DD)'}), 400
 
         if end_date:
             try:
-                query = query.filter(Expense.date <= datetime.fromisoformat(end_date))
+                query = query.filter(ExpenseSource.date <= datetime.fromisoformat(end_date))
             except ValueError:
                 return jsonify({'error': 'Invalid end_date format. Use ISO format (YYYY-MM-DD)'}), 400
 
         if search:
             # Search in description, reason, employee name, supplier name, and amount
             query = query.filter(
-                (Expense.description.ilike(f'%{search}%')) |
-                (Expense.reason.ilike(f'%{search}%')) |
+                (ExpenseSource.description.ilike(f'%{search}%')) |
+                (ExpenseSource.reason.ilike(f'%{search}%')) |
                 (User.first_name.ilike(f'%{search}%')) |
                 (User.last_name.ilike(f'%{search}%')) |
                 (Supplier.name.ilike(f'%{search}%')) |
-                (func.cast(Expense.amount, db.String).ilike(f'%{search}%'))
+                (func.cast(ExpenseSource.amount, db.String).ilike(f'%{search}%'))
             )
 
         # Apply sorting
         if sort_by == 'id':
-            query = query.order_by(Expense.id.desc() if sort_order == 'desc' else Expense.id.asc())
+            query = query.order_by(ExpenseSource.id.desc() if sort_order == 'desc' else ExpenseSource.id.asc())
         elif sort_by == 'date':
-            query = query.order_by(Expense.date.desc() if sort_order == 'desc' else Expense.date.asc())
+            query = query.order_by(ExpenseSource.date.desc() if sort_order == 'desc' else ExpenseSource.date.asc())
         elif sort_by == 'amount':
-            query = query.order_by(Expense.amount.desc() if sort_order == 'desc' else Expense.amount.asc())
+            query = query.order_by(ExpenseSource.amount.desc() if sort_order == 'desc' else ExpenseSource.amount.asc())
         elif sort_by == 'status':
-            query = query.order_by(Expense.status.desc() if sort_order == 'desc' else Expense.status.asc())
+            query = query.order_by(ExpenseSource.status.desc() if sort_order == 'desc' else ExpenseSource.status.asc())
         else:
-            query = query.order_by(Expense.id.desc())  # Default to insertion order (newest first)
-
-        # Add eager loading to avoid N+1 queries
-        query = query.options(
-            joinedload(Expense.submitter).joinedload(User.home_department),
-            joinedload(Expense.subcategory).joinedload(Subcategory.category).joinedload(Category.department).joinedload(Department.budget_year),
-            joinedload(Expense.supplier),
-            joinedload(Expense.credit_card),
-            joinedload(Expense.handler)
-        )
-
-        # Paginate
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+            query = query.order_by(ExpenseSource.id.desc())  # Default to insertion order (newest first)
 
-        expense_list = []
-        for expense in pagination.items:
-            expense_list.append({
-                'id': expense.id,
-                'amount': expense.amount,
-                'currency': expense.currency,
-                'amount_ils': expense.amount_ils,
-                'exchange_rate': expense.exchange_rate,
-                'description': expense.description,
-                'reason': expense.reason,
-                'date': expense.date.isoformat() if expense.date else None,
-                'invoice_date': expense.invoice_date.isoformat() if expense.invoice_date else None,
-                'status': expense.status,
-                'type': expense.type,
-                'payment_method': expense.payment_method,
-                'payment_status': expense.payment_status,
-                'rejection_reason': expense.rejection_reason,
-                'credit_card_id': expense.credit_card_id,
-                'credit_card': {
-                    'id': expense.credit_card.id,
-                    'name': expense.credit_card.description or f"Card *{expense.credit_card.last_four_digits}",
-                    'last_four_digits': expense.credit_card.last_four_digits
-                } if expense.credit_card else None,
-                'user': {
-                    'id': expense.submitter.id,
-                    'username': expense.submitter.username,
-                    'name': f"{expense.submitter.first_name} {expense.submitter.last_name}".strip(),
-                    'department': expense.subcategory.category.department.name if expense.subcategory and expense.subcategory.category and expense.subcategory.category.department else None,
-                    'department_id': expense.subcategory.category.department_id if expense.subcategory and expense.subcategory.category else None
-                },
-                'subcategory': {
-                    'id': expense.subcategory.id,
-                    'name': expense.subcategory.name
-                } if expense.subcategory else None,
-                'category': {
-                    'id': expense.subcategory.category.id,
-                    'name': expense.subcategory.category.name
-                } if expense.subcategory and expense.subcategory.category else None,
-                'supplier': {
-                    'id': expense.supplier.id,
-                    'name': expense.supplier.name
-                } if expense.supplier else None,
-                'budget_year': {
-                    'id': expense.subcategory.category.department.budget_year.id,
-                    'year': expense.subcategory.category.department.budget_year.year,
-                    'name': expense.subcategory.category.department.budget_year.name
-                } if expense.subcategory and expense.subcategory.category and expense.subcategory.category.department and expense.subcategory.category.department.budget_year else None,
-                'handler': {
-                    'id': expense.handler.id,
-                    'name': f"{expense.handler.first_name} {expense.handler.last_name}".strip()
-                } if expense.handler else None,
-                'handled_at': expense.handled_at.isoformat() if expense.handled_at else None,
-                'has_invoice': bool(expense.invoice_filename),
-                'has_receipt': bool(expense.receipt_filename),
-                'has_quote': bool(expense.quote_filename),
-                'invoice_filename': expense.invoice_filename,
-                'receipt_filename': expense.receipt_filename,
-                'quote_filename': expense.quote_filename,
-                'submit_date': expense.submit_date.isoformat() if expense.submit_date else None
-            })
+        # Paginate, selecting only the columns the response needs
+        pagination = shape.paginate(query, page, per_page, source=ExpenseSource,
+                                    joined={'submitter': User, 'supplier': Supplier})
+        expense_list = pagination.items
 
         return jsonify({
             'expenses': expense_list,
@@ -1740,98 +1629,28 @@ def admin_update_expense(expense_id):
 
         # Recalculate ILS equivalent if amount, currency, or date changed
         if any(k in data for k in ['amount', 'currency', 'date']):
-            try:
-                if expense.currency == 'ILS':
-                    expense.amount_ils = expense.amount
-                    expense.exchange_rate = 1.0
-                else:
-                    expense_date = expense.date.date() if hasattr(expense.date, 'date') else expense.date
-                    rate = get_exchange_rate(expense.currency, expense_date)
-                    expense.exchange_rate = rate
-                    expense.amount_ils = round(expense.amount * rate, 2)
-            except Exception as e:
-                logging.warning(f"Failed to recalculate exchange rate: {e}")
-                expense.amount_ils = expense.amount
-                expense.exchange_rate = 1.0
-
-        # Handle file uploads
-        upload_folder = current_app.config.get('UPLOAD_FOLDER', 'uploads')
-
-        if 'quote' in request.files:
-            file = request.files['quote']
-            if file and file.filename and allowed_file(file.filename):
-                # Delete old file if exists
-                if expense.quote_filename:
-                    try:
-                        old_path = os.path.join(upload_folder, expense.quote_filename)
-                        if os.path.exists(old_path):
-                            os.remove(old_path)
-                    except OSError:
-                        pass
-                filename = f"{expense_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_quote_{secure_filename(file.filename)}"
-                file.save(os.path.join(upload_folder, filename))
-                expense.quote_filename = filename
-
-        if 'invoice' in request.files:
-            file = request.files['invoice']
-            if file and file.filename and allowed_file(file.filename):
-                # Delete old file if exists
-                if expense.invoice_filename:
-                    try:
-                        old_path = os.path.join(upload_folder, expense.invoice_filename)
-                        if os.path.exists(old_path):
-                            os.remove(old_path)
-                    except OSError:
-                        pass
-                filename = f"{expense_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_invoice_{secure_filename(file.filename)}"
-                file.save(os.path.join(upload_folder, filename))
-                expense.invoice_filename = filename
-
-        if 'receipt' in request.files:
-            file = request.files['receipt']
-            if file and file.filename and allowed_file(file.filename):
-                # Delete old file if exists
-                if expense.receipt_filename:
-                    try:
-                        old_path = os.path.join(upload_folder, expense.receipt_filename)
-                        if os.path.exists(old_path):
-                            os.remove(old_path)
-                    except OSError:
-                        pass
-                filename = f"{expense_id}_{datetime.now().strftime('%Y%m%d%H%M%S')}_receipt_{secure_filename(file.filename)}"
-                file.save(os.path.join(upload_folder, filename))
-                expense.receipt_filename = filename
+            expense.amount_ils, expense.exchange_rate = convert_to_ils(expense.amount, expense.currency, expense.date)
+
+        # Handle file uploads. A field replaces the existing files of that kind
+        # unless append_attachments is set; a field may carry several files.
+        append_attachments = data.get('append_attachments') in [True, 'true', 'True', '1', 1]
+        for kind in ATTACHMENT_KINDS:
+            files = [f for f in request.files.getlist(kind) if f and f.filename and allowed_file(f.filename)]
+            if not files:
+                continue
+            if not append_attachments:
+                # Delete old files if they exist
+                remove_attachments(expense, kind)
+            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+            for i, file in enumerate(files):
+                suffix = f"_{i}" if i else ""
+                filename = f"{expense_id}_{timestamp}{suffix}_{kind}_{secure_filename(file.filename)}"
+                add_attachment(expense, kind, file, filename)
 
         # Handle file deletion requests
-        if data.get('delete_quote') in [True, 'true', 'True', '1', 1]:
-            if expense.quote_filename:
-                try:
-                    old_path = os.path.join(upload_folder, expense.quote_filename)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                except OSError:
-                    pass
-                expense.quote_filename = None
-
-        if data.get('delete_invoice') in [True, 'true', 'True', '1', 1]:
-            if expense.invoice_filename:
-                try:
-                    old_path = os.path.join(upload_folder, expense.invoice_filename)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                except OSError:
-                    pass
-                expense.invoice_filename = None
-
-        if data.get('delete_receipt') in [True, 'true', 'True', '1', 1]:
-            if expense.receipt_filename:
-                try:
-                    old_path = os.path.join(upload_folder, expense.receipt_filename)
-                    if os.path.exists(old_path):
-                        os.remove(old_path)
-                except OSError:
-                    pass
-                expense.receipt_filename = None
+        for kind in ATTACHMENT_KINDS:
+            if data.get(f'delete_{kind}') in [True, 'true', 'True', '1', 1]:
+                remove_attachments(expense, kind)
 
         db.session.commit()
 
@@ -1847,18 +1666,10 @@ def admin_update_expense(expense_id):
         if new_files_uploaded:
             try:
                 attachments = []
-                if expense.invoice_filename:
-                    invoice_path = os.path.join(upload_folder, expense.invoice_filename)
-                    if os.path.exists(invoice_path):
-                        attachments.append(invoice_path)
-                if expense.receipt_filename:
-                    receipt_path = os.path.join(upload_folder, expense.receipt_filename)
-                    if os.path.exists(receipt_path):
-                        attachments.append(receipt_path)
-                if expense.quote_filename:
-                    quote_path = os.path.join(upload_folder, expense.quote_filename)
-                    if os.path.exists(quote_path):
-                        attachments.append(quote_path)
+                for attachment in expense.attachments:
+                    attachment_path = resolve_path(attachment.stored_name)
+                    if attachment_path:
+                        attachments.append((attachment_path, attachment.stored_name))
 
                 if attachments:
                     accounting_template = """
@@ -1911,7 +1722,8 @@ def admin_update_expense(expense_id):
                 'status': expense.status,
                 'quote_filename': expense.quote_filename,
                 'invoice_filename': expense.invoice_filename,
-                'receipt_filename': expense.receipt_filename
+                'receipt_filename': expense.receipt_filename,
+                'attachments': serialize_attachments(expense)
             }
         }), 200
 
@@ -1921,6 +1733,47 @@ def admin_update_expense(expense_id):
         return jsonify({'error': f'Failed to update expense: {str(e)}'}), 500
 
 
+@api_v1.route('/admin/expenses/<int:expense_id>/attachments/<int:attachment_id>', methods=['DELETE'])
+@login_required
+def admin_delete_expense_attachment(expense_id, attachment_id):
+    """Remove a single attachment from an expense (admin, or manager of its department)"""
+    if not current_user.is_admin and not current_user.is_manager:
+        return jsonify({'error': 'Admin or manager access required'}), 403
+
+    try:
+        expense = Expense.query.get(expense_id)
+        if not expense:
+            return jsonify({'error': 'Expense not found'}), 404
+
+        # Managers can only edit expenses from their managed departments
+        if current_user.is_manager and not current_user.is_admin:
+            managed_dept_ids = [d.id for d in current_user.managed_departments]
+            expense_dept_id = None
+            if expense.subcategory and expense.subcategory.category:
+                expense_dept_id = expense.subcategory.category.department_id
+            if expense_dept_id not in managed_dept_ids:
+                return jsonify({'error': 'You can only edit expenses from your managed departments'}), 403
+
+        attachment = next((a for a in expense.attachments if a.id == attachment_id), None)
+        if not attachment:
+            return jsonify({'error': 'Attachment not found'}), 404
+
+        remove_attachment(expense, attachment)
+        db.session.commit()
+
+        logging.info(f"Attachment {attachment_id} ({attachment.stored_name}) removed from expense {expense_id} by {current_user.username}")
+
+        return jsonify({
+            'message': 'Attachment deleted successfully',
+            'attachments': serialize_attachments(expense)
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error deleting attachment: {str(e)}", exc_info=True)
+        return jsonify({'error': 'Failed to delete attachment'}), 500
+
+
 @api_v1.route('/admin/expenses/<int:expense_id>', methods=['DELETE'])
 @login_required
 def admin_delete_expense(expense_id):
@@ -1939,6 +1792,9 @@ def admin_delete_expense(expense_id):
             if expense.user_id != current_user.id:
                 return jsonify({'error': 'Managers can only delete their own expenses'}), 403
 
+        # Release the expense's documents so unshared blobs can be collected
+        for kind in ATTACHMENT_KINDS:
+            remove_attachments(expense, kind)
         db.session.delete(expense)
         db.session.commit()
 
@@ -1954,55 +1810,18 @@ def admin_delete_expense(expense_id):
 
 # --- Move Expense to Different Budget Year ---
 
-def find_matching_subcategory(source_subcategory, target_year_id):
+def find_matching_subcategory(source_path, target_year_id):
     """
-    Find matching subcategory in target year based on name hierarchy
-    Returns: dict with 'exact_match' (Subcategory or None) and 'suggestions' (list of Subcategory)
+    Find matching subcategory in target year by lineage, else name hierarchy
+    Returns: dict with 'exact_match' (SubcategoryPath or None) and 'suggestions' (list of SubcategoryPath)
     """
     try:
-        # Get the full hierarchy of the source subcategory
-        source_category = Category.query.get(source_subcategory.category_id)
-        source_department = Department.query.get(source_category.department_id)
-
-        # Try to find exact match in target year: Department -> Category -> Subcategory by names
-        target_department = Department.query.filter_by(
-            year_id=target_year_id,
-            name=source_department.name
-        ).first()
-
-        exact_match = None
-        suggestions = []
-
-        if target_department:
-            target_category = Category.query.filter_by(
-                department_id=target_department.id,
-                name=source_category.name
-            ).first()
-
-            if target_category:
-                exact_match = Subcategory.query.filter_by(
-                    category_id=target_category.id,
-                    name=source_subcategory.name
-                ).first()
-
-                # Get all subcategories in this category as suggestions
-                suggestions = Subcategory.query.filter_by(
-                    category_id=target_category.id
-                ).order_by(Subcategory.name).all()
-
-        # If no exact match, get all subcategories in target year as suggestions
-        if not suggestions:
-            # Get all departments in target year
-            target_departments = Department.query.filter_by(year_id=target_year_id).all()
-            for dept in target_departments:
-                categories = Category.query.filter_by(department_id=dept.id).all()
-                for cat in categories:
-                    subs = Subcategory.query.filter_by(category_id=cat.id).order_by(Subcategory.name).all()
-                    suggestions.extend(subs)
-
+        hierarchy = get_year_hierarchy(target_year_id)
+        exact_match = hierarchy.find_match(source_path)
+        suggestions = hierarchy.suggestions_for(source_path)
         return {
             'exact_match': exact_match,
-            'suggestions': suggestions[:20]  # Limit to 20 suggestions
+            'suggestions': suggestions
         }
 
     except Exception as e:
@@ -2010,6 +1829,28 @@ def find_matching_subcategory(source_subcategory, target_year_id):
         return {'exact_match': None, 'suggestions': []}
 
 
+def _hierarchy_response(path, budget_year):
+    return {
+        'budget_year': {
+            'id': budget_year.id,
+            'year': budget_year.year,
+            'name': budget_year.name
+        } if budget_year else None,
+        'department': {
+            'id': path.department_id,
+            'name': path.department_name
+        },
+        'category': {
+            'id': path.category_id,
+            'name': path.category_name
+        },
+        'subcategory': {
+            'id': path.subcategory_id,
+            'name': path.subcategory_name
+        }
+    }
+
+
 @api_v1.route('/admin/expenses/<int:expense_id>/move-options/<int:target_year_id>', methods=['GET'])
 @login_required
 def get_move_expense_options(expense_id, target_year_id):
@@ -2028,36 +1869,18 @@ def get_move_expense_options(expense_id, target_year_id):
         if not target_year:
             return jsonify({'error': 'Target budget year not found'}), 404
 
-        # Get current hierarchy
-        current_subcategory = Subcategory.query.get(expense.subcategory_id)
-        current_category = Category.query.get(current_subcategory.category_id)
-        current_department = Department.query.get(current_category.department_id)
-        current_budget_year = BudgetYear.query.get(current_department.year_id)
+        # Get current hierarchy in one query
+        current_path = get_subcategory_paths([expense.subcategory_id]).get(expense.subcategory_id)
+        if not current_path:
+            return jsonify({'error': 'Expense subcategory not found'}), 404
+        current_budget_year = BudgetYear.query.get(current_path.year_id) if current_path.year_id else None
 
         # Find matching subcategory in target year
-        match_result = find_matching_subcategory(current_subcategory, target_year_id)
+        match_result = find_matching_subcategory(current_path, target_year_id)
 
         # Format response
         response = {
-            'current': {
-                'budget_year': {
-                    'id': current_budget_year.id,
-                    'year': current_budget_year.year,
-                    'name': current_budget_year.name
-                },
-                'department': {
-                    'id': current_department.id,
-                    'name': current_department.name
-                },
-                'category': {
-                    'id': current_category.id,
-                    'name': current_category.name
-                },
-                'subcategory': {
-                    'id': current_subcategory.id,
-                    'name': current_subcategory.name
-                }
-            },
+            'current': _hierarchy_response(current_path, current_budget_year),
             'target': {
                 'budget_year': {
                     'id': target_year.id,
@@ -2068,31 +1891,25 @@ def get_move_expense_options(expense_id, target_year_id):
         }
 
         # Add exact match if found
-        if match_result['exact_match']:
-            exact = match_result['exact_match']
-            cat = Category.query.get(exact.category_id)
-            dept = Department.query.get(cat.department_id)
+        exact = match_result['exact_match']
+        if exact:
             response['exact_match'] = {
-                'subcategory_id': exact.id,
-                'subcategory_name': exact.name,
-                'category_name': cat.name,
-                'department_name': dept.name
+                'subcategory_id': exact.subcategory_id,
+                'subcategory_name': exact.subcategory_name,
+                'category_name': exact.category_name,
+                'department_name': exact.department_name
             }
         else:
             response['exact_match'] = None
 
         # Add suggestions
-        response['suggestions'] = []
-        for sub in match_result['suggestions']:
-            cat = Category.query.get(sub.category_id)
-            dept = Department.query.get(cat.department_id)
-            response['suggestions'].append({
-                'subcategory_id': sub.id,
-                'subcategory_name': sub.name,
-                'category_name': cat.name,
-                'department_name': dept.name,
-                'full_path': f"{dept.name} > {cat.name} > {sub.name}"
-            })
+        response['suggestions'] = [{
+            'subcategory_id': sub.subcategory_id,
+            'subcategory_name': sub.subcategory_name,
+            'category_name': sub.category_name,
+            'department_name': sub.department_name,
+            'full_path': format_path(sub)
+        } for sub in match_result['suggestions']]
 
         return jsonify(response), 200
 
@@ -2120,46 +1937,43 @@ def move_expense_to_year(expense_id):
         if not expense:
             return jsonify({'error': 'Expense not found'}), 404
 
-        # Get target subcategory and validate it exists
-        target_subcategory = Subcategory.query.get(target_subcategory_id)
-        if not target_subcategory:
+        # Old and new hierarchy in one query
+        paths = get_subcategory_paths([expense.subcategory_id, target_subcategory_id])
+        target_path = paths.get(target_subcategory_id)
+        if not target_path:
             return jsonify({'error': 'Target subcategory not found'}), 404
-
-        # Get the full hierarchy for logging
-        target_category = Category.query.get(target_subcategory.category_id)
-        target_department = Department.query.get(target_category.department_id)
-        target_year = BudgetYear.query.get(target_department.year_id)
-
-        # Get old hierarchy for logging
-        old_subcategory = Subcategory.query.get(expense.subcategory_id)
-        old_category = Category.query.get(old_subcategory.category_id)
-        old_department = Department.query.get(old_category.department_id)
-        old_year = BudgetYear.query.get(old_department.year_id)
+        old_path = paths[expense.subcategory_id]
 
         # Validate that target is in a different year
-        if old_year.id == target_year.id:
+        if old_path.year_id == target_path.year_id:
             return jsonify({'error': 'Target subcategory is in the same budget year'}), 400
 
+        years = get_year_summaries([old_path.year_id, target_path.year_id])
+        old_year = years.get(old_path.year_id)
+        target_year = years.get(target_path.year_id)
+        if target_year and target_year.is_archived:
+            return jsonify({'error': 'Target budget year is archived'}), 400
+
         # Update the expense
         old_subcategory_id = expense.subcategory_id
-        expense.subcategory_id = target_subcategory_id
+        assign_subcategory(expense, target_path)
 
         db.session.commit()
 
         # Log the action
         logging.info(
-            f"Expense {expense_id} moved from budget year {old_year.year} "
-            f"({old_department.name} > {old_category.name} > {old_subcategory.name}) "
-            f"to budget year {target_year.year} "
-            f"({target_department.name} > {target_category.name} > {target_subcategory.name}) "
+            f"Expense {expense_id} moved from budget year {old_year.year if old_year else None} "
+            f"({format_path(old_path)}) "
+            f"to budget year {target_year.year if target_year else None} "
+            f"({format_path(target_path)}) "
             f"by admin {current_user.username}"
         )
 
         return jsonify({
             'message': 'Expense moved successfully',
             'expense_id': expense_id,
-            'old_year': old_year.year,
-            'new_year': target_year.year,
+            'old_year': old_year.year if old_year else None,
+            'new_year': target_year.year if target_year else None,
             'old_subcategory_id': old_subcategory_id,
             'new_subcategory_id': target_subcategory_id
         }), 200
@@ -2170,6 +1984,110 @@ def move_expense_to_year(expense_id):
         return jsonify({'error': f'Failed to move expense: {str(e)}'}), 500
 
 
+@api_v1.route('/admin/expenses/move-to-year', methods=['POST'])
+@login_required
+def bulk_move_expenses_to_year():
+    """Move many expenses to a budget year in one request.
+
+    Body: {"expense_ids": [...], "target_year_id": 5,
+           "overrides": {"<expense_id>": <target_subcategory_id>}, "dry_run": false}
+    Each expense goes to the subcategory with the same Department > Category >
+    Subcategory names in the target year unless an override is given.
+    Expenses without a match are reported and left untouched.
+    """
+    if not current_user.is_admin:
+        return jsonify({'error': 'Admin access required'}), 403
+
+    try:
+        data = request.get_json() or {}
+        expense_ids = data.get('expense_ids') or []
+        target_year_id = data.get('target_year_id')
+        if not expense_ids or not target_year_id:
+            return jsonify({'error': 'expense_ids and target_year_id are required'}), 400
+        try:
+            if not isinstance(expense_ids, list):
+                raise TypeError
+            expense_ids = [int(e) for e in expense_ids]
+            target_year_id = int(target_year_id)
+            overrides = {int(k): int(v) for k, v in (data.get('overrides') or {}).items()}
+        except (TypeError, ValueError, AttributeError):
+            return jsonify({'error': 'expense_ids, target_year_id and overrides must be integer ids'}), 400
+        dry_run = bool(data.get('dry_run', False))
+
+        target_year = BudgetYear.query.get(target_year_id)
+        if not target_year:
+            return jsonify({'error': 'Target budget year not found'}), 404
+        if target_year.is_archived:
+            return jsonify({'error': 'Target budget year is archived'}), 400
+
+        expenses = Expense.query.filter(Expense.id.in_(expense_ids)).all()
+        found_ids = {e.id for e in expenses}
+        not_found = [e for e in expense_ids if e not in found_ids]
+
+        hierarchy = get_year_hierarchy(target_year.id)
+        source_paths = get_subcategory_paths(e.subcategory_id for e in expenses)
+
+        moved, unmatched, skipped = [], [], []
+        for expense in expenses:
+            source_path = source_paths.get(expense.subcategory_id)
+            if source_path and source_path.year_id == target_year.id:
+                skipped.append({'expense_id': expense.id, 'reason': 'Already in target budget year'})
+                continue
+
+            if expense.id in overrides:
+                target_path = hierarchy.by_id.get(overrides[expense.id])
+                if not target_path:
+                    unmatched.append({'expense_id': expense.id, 'reason': 'Override subcategory is not in target budget year'})
+                    continue
+            elif source_path:
+                target_path = hierarchy.find_match(source_path)
+                if not target_path:
+                    unmatched.append({
+                        'expense_id': expense.id,
+                        'reason': 'No matching subcategory in target budget year',
+                        'current_path': format_path(source_path)
+                    })
+                    continue
+            else:
+                unmatched.append({'expense_id': expense.id, 'reason': 'Expense has no subcategory'})
+                continue
+
+            moved.append({
+                'expense_id': expense.id,
+                'old_subcategory_id': expense.subcategory_id,
+                'new_subcategory_id': target_path.subcategory_id,
+                'new_path': format_path(target_path)
+            })
+            if not dry_run:
+                assign_subcategory(expense, target_path)
+
+        if not dry_run and moved:
+            db.session.commit()
+            logging.info(
+                f"{len(moved)} expense(s) moved to budget year {target_year.year} "
+                f"by admin {current_user.username}"
+            )
+
+        return jsonify({
+            'message': f"{len(moved)} expense(s) {'would be ' if dry_run else ''}moved",
+            'dry_run': dry_run,
+            'target_year': {
+                'id': target_year.id,
+                'year': target_year.year,
+                'name': target_year.name
+            },
+            'moved': moved,
+            'unmatched': unmatched,
+            'skipped': skipped,
+            'not_found': not_found
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error bulk moving expenses to year: {str(e)}", exc_info=True)
+        return jsonify({'error': f'Failed to move expenses: {str(e)}'}), 500
+
+
 # ============================================================================
 # Accounting Dashboard API
 # ============================================================================
@@ -2194,23 +2112,23 @@ def get_accounting_expenses():
         search_text = request.args.get('search_text', '')
         amount_min = request.args.get('amount_min', '')
         amount_max = request.args.get('amount_max', '')
+        include_archived = request.args.get('include_archived', '').lower() == 'true'
+        ExpenseSource = expense_source(include_archived)
 
-        query = Expense.query.options(
-            joinedload(Expense.supplier),
-            joinedload(Expense.submitter),
-            joinedload(Expense.handler),
-            joinedload(Expense.paid_by),
-            joinedload(Expense.external_accounting_entry_by),
-            joinedload(Expense.credit_card),
-            joinedload(Expense.subcategory).joinedload(Subcategory.category)
-        ).filter_by(status='approved')
+        # fields= picks attributes, include= the related objects to expand
+        try:
+            shape = ACCOUNTING_EXPENSE_SHAPE.select(request.args.get('fields'), request.args.get('include'))
+        except FieldSelectionError as e:
+            return jsonify({'error': str(e)}), 400
+
+        query = select(ExpenseSource.id).where(ExpenseSource.status == 'approved')
 
         # Search text filter
         if search_text:
             search_term = f'%{search_text}%'
-            query = query.join(Supplier, Expense.supplier_id == Supplier.id, isouter=True).filter(
+            query = query.join(Supplier, ExpenseSource.supplier_id == Supplier.id, isouter=True).filter(
                 or_(
-                    Expense.description.ilike(search_term),
+                    ExpenseSource.description.ilike(search_term),
                     Supplier.notes.ilike(search_term),
                     Supplier.email.ilike(search_term),
                     Supplier.phone.ilike(search_term),
@@ -2222,18 +2140,18 @@ def get_accounting_expenses():
         # Supplier search
         if supplier_search:
             if not search_text:
-                query = query.join(Supplier, Expense.supplier_id == Supplier.id, isouter=True)
+                query = query.join(Supplier, ExpenseSource.supplier_id == Supplier.id, isouter=True)
             query = query.filter(Supplier.name.ilike(f'%{supplier_search}%'))
 
         # Amount range
         if amount_min:
             try:
-                query = query.filter(Expense.amount >= float(amount_min))
+                query = query.filter(ExpenseSource.amount >= float(amount_min))
             except ValueError:
                 pass
         if amount_max:
             try:
-                query = query.filter(Expense.amount <= float(amount_max))
+                query = query.filter(ExpenseSource.amount <= float(amount_max))
             except ValueError:
                 pass
 
@@ -2246,7 +2164,7 @@ def get_accounting_expenses():
                     end = datetime(int(year) + 1, 1, 1)
                 else:
                     end = datetime(int(year), int(mon) + 1, 1)
-                query = query.filter(Expense.date >= start, Expense.date < end)
+                query = query.filter(ExpenseSource.date >= start, ExpenseSource.date < end)
             except (ValueError, AttributeError):
                 pass
 
@@ -2273,127 +2191,67 @@ def get_accounting_expenses():
             else:
                 s = e = None
             if s and e:
-                query = query.filter(Expense.invoice_date >= s, Expense.invoice_date < e)
+                query = query.filter(ExpenseSource.invoice_date >= s, ExpenseSource.invoice_date < e)
 
         # Payment due date filter
         if payment_due_date != 'all':
-            query = query.filter(Expense.payment_due_date == payment_due_date)
+            query = query.filter(ExpenseSource.payment_due_date == payment_due_date)
 
         # Payment method filter - handle both legacy 'transfer' and new 'bank_transfer' values
         if payment_method != 'all':
             if payment_method in ('transfer', 'bank_transfer'):
-                query = query.filter(Expense.payment_method.in_(['transfer', 'bank_transfer']))
+                query = query.filter(ExpenseSource.payment_method.in_(['transfer', 'bank_transfer']))
             else:
-                query = query.filter(Expense.payment_method == payment_method)
+                query = query.filter(ExpenseSource.payment_method == payment_method)
 
         # Payment status filter
         if payment_status == 'paid':
-            query = query.filter(Expense.is_paid == True)
+            query = query.filter(ExpenseSource.is_paid == True)
         elif payment_status == 'pending':
-            query = query.filter(Expense.is_paid == False)
+            query = query.filter(ExpenseSource.is_paid == False)
 
         # External accounting filter
         if external_accounting == 'entered':
-            query = query.filter(Expense.external_accounting_entry == True)
+            query = query.filter(ExpenseSource.external_accounting_entry == True)
         elif external_accounting == 'not_entered':
-            query = query.filter(Expense.external_accounting_entry == False)
-
-        # Get totals before pagination
-        total_query = query.with_entities(
-            func.count(Expense.id),
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount))
-        ).first()
-        total_count = total_query[0] or 0
-        total_amount = float(total_query[1] or 0)
-
-        # Payment status summary
-        status_summary = query.with_entities(
-            Expense.payment_status,
-            func.count(Expense.id),
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount))
-        ).group_by(Expense.payment_status).all()
+            query = query.filter(ExpenseSource.external_accounting_entry == False)
+
+        # Totals and both breakdowns in one pass over the filtered set
+        is_paid = ExpenseSource.payment_status == 'paid'
+        is_entered = ExpenseSource.external_accounting_entry == True
+        totals = db.session.execute(query.with_only_columns(
+            func.count(ExpenseSource.id),
+            func.sum(ExpenseSource.amount_ils),
+            func.count(ExpenseSource.id).filter(is_paid),
+            func.sum(ExpenseSource.amount_ils).filter(is_paid),
+            func.count(ExpenseSource.id).filter(is_entered),
+        )).one()
+        total_count = totals[0] or 0
+        total_amount = float(totals[1] or 0)
+        paid_count = totals[2] or 0
+        paid_amount = float(totals[3] or 0)
+        external_entered_count = totals[4] or 0
 
         summary = {
             'total_count': total_count,
             'total_amount': round(total_amount, 2),
-            'paid_count': 0, 'paid_amount': 0,
-            'pending_count': 0, 'pending_amount': 0,
-            'external_entered_count': 0, 'external_not_entered_count': 0
+            'paid_count': paid_count,
+            'paid_amount': round(paid_amount, 2),
+            # Anything not marked paid, including a NULL payment_status
+            'pending_count': total_count - paid_count,
+            'pending_amount': round(total_amount - paid_amount, 2),
+            'external_entered_count': external_entered_count,
+            'external_not_entered_count': total_count - external_entered_count
         }
-        for ps, cnt, amt in status_summary:
-            if ps == 'paid':
-                summary['paid_count'] = cnt
-                summary['paid_amount'] = round(float(amt or 0), 2)
-            else:
-                summary['pending_count'] += cnt
-                summary['pending_amount'] += round(float(amt or 0), 2)
-
-        # External accounting summary
-        ext_summary = query.with_entities(
-            Expense.external_accounting_entry,
-            func.count(Expense.id)
-        ).group_by(Expense.external_accounting_entry).all()
-        for ext, cnt in ext_summary:
-            if ext:
-                summary['external_entered_count'] = cnt
-            else:
-                summary['external_not_entered_count'] = cnt
-
-        # Paginate
-        pagination = query.order_by(Expense.date.desc()).paginate(page=page, per_page=per_page, error_out=False)
-
-        expenses = []
-        for exp in pagination.items:
-            expenses.append({
-                'id': exp.id,
-                'date': exp.date.isoformat() if exp.date else None,
-                'description': exp.description,
-                'reason': exp.reason,
-                'amount': exp.amount,
-                'currency': exp.currency,
-                'amount_ils': exp.amount_ils,
-                'payment_method': exp.payment_method,
-                'payment_due_date': exp.payment_due_date,
-                'payment_status': exp.payment_status,
-                'is_paid': exp.is_paid,
-                'paid_by': exp.paid_by.username if exp.paid_by else None,
-                'paid_at': exp.paid_at.isoformat() if exp.paid_at else None,
-                'invoice_date': exp.invoice_date.isoformat() if exp.invoice_date else None,
-                'type': exp.type,
-                'external_accounting_entry': exp.external_accounting_entry,
-                'external_accounting_entry_by': exp.external_accounting_entry_by.username if exp.external_accounting_entry_by else None,
-                'external_accounting_entry_at': exp.external_accounting_entry_at.isoformat() if exp.external_accounting_entry_at else None,
-                'supplier': {
-                    'name': exp.supplier.name,
-                    'email': exp.supplier.email,
-                    'phone': exp.supplier.phone,
-                    'address': exp.supplier.address,
-                    'tax_id': exp.supplier.tax_id,
-                    'bank_name': exp.supplier.bank_name,
-                    'bank_account_number': exp.supplier.bank_account_number,
-                    'bank_branch': exp.supplier.bank_branch,
-                    'bank_swift': exp.supplier.bank_swift,
-                    'notes': exp.supplier.notes,
-                    'status': exp.supplier.status
-                } if exp.supplier else None,
-                'credit_card': {
-                    'description': exp.credit_card.description if hasattr(exp.credit_card, 'description') else '',
-                    'last_four_digits': exp.credit_card.last_four_digits
-                } if exp.credit_card else None,
-                'submitter': {
-                    'username': exp.submitter.username,
-                    'department': exp.submitter.home_department.name if exp.submitter.home_department else None
-                },
-                'handler': {
-                    'username': exp.handler.username
-                } if exp.handler else None,
-                'handled_at': exp.handled_at.isoformat() if exp.handled_at else None,
-                'category': exp.subcategory.category.name if exp.subcategory and exp.subcategory.category else None,
-                'subcategory': exp.subcategory.name if exp.subcategory else None,
-                'quote_filename': exp.quote_filename,
-                'invoice_filename': exp.invoice_filename,
-                'receipt_filename': exp.receipt_filename
-            })
+
+        # Paginate, selecting only the columns the response needs; the
+        # count above doubles as the pagination total
+        pagination = shape.paginate(
+            query.order_by(ExpenseSource.date.desc()), page, per_page, source=ExpenseSource,
+            joined={'supplier': Supplier} if search_text or supplier_search else None,
+            total=total_count
+        )
+        expenses = pagination.items
 
         # Generate month options (last 12 months)
         current_date = datetime.now()
@@ -1,7 +1,6 @@
 from flask import jsonify, request, session, url_for, redirect
 from flask_login import login_user, logout_user, current_user, login_required
 from models import User, db
-import msal
 import logging
 import requests
 import os
@@ -9,6 +8,8 @@ from . import api_v1
 from config import Config
 
 def _build_msal_app(cache=None):
+    import msal  # Only needed for the Azure AD login flow
+
     return msal.ConfidentialClientApplication(
         Config.AZURE_AD_CLIENT_ID,
         authority=f"https://login.microsoftonline.com/{Config.AZURE_AD_TENANT_ID}",
@@ -162,7 +163,7 @@ def create_test_user():
 def login_azure():
     """Initiate Azure AD login flow"""
     try:
-        redirect_uri = url_for('auth_callback', _external=True, _scheme='https')
+        redirect_uri = url_for('web.auth_callback', _external=True, _scheme='https')
         logging.info(f"API Azure Login - Redirect URI: {redirect_uri}")
 
         msal_app = _build_msal_app()
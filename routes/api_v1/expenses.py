@@ -1,17 +1,26 @@
 from flask import jsonify, request, current_app
 from flask_login import login_required, current_user
-from models import db, Expense, User, Department, Category, Subcategory, Supplier, CreditCard, BudgetYear
+from models import db, Expense, User, Department, Category, Subcategory, Supplier, CreditCard, BudgetYear, StoredBlob
 from services.manager_access import get_manager_access, build_category_access_filter, has_category_access
-from sqlalchemy import func, or_
+from sqlalchemy import func, or_, select
 from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
 from werkzeug.utils import secure_filename
 from . import api_v1
-from services.exchange_rate import get_exchange_rate
+from services.exchange_rate import get_exchange_rate, convert_to_ils
+from services.file_storage import resolve_path, get_blob, start_direct_upload, finish_direct_upload
+from services.attachments import (add_attachment, attach_blob, serialize_attachments, find_attachments_by_hash,
+                                  duplicate_warnings, attachable_hashes, record_upload, visible_expense_ids)
+from services.budget_years import get_current_year_id
+from services.expense_serializers import USER_EXPENSE_SHAPE, REPORT_EXPENSE_SHAPE, FieldSelectionError
+from services.expense_report import run_report, parse_names, DIMENSIONS, MEASURES, ReportError
+from services.budget_hierarchy import get_subcategory_paths
+from services.year_archive import expense_source, get_expense, is_year_archived
 from utils.email_sender import send_email
 from templates.email_templates import EXPENSE_REQUEST_CONFIRMATION_TEMPLATE, NEW_REQUEST_MANAGER_NOTIFICATION_TEMPLATE
 import logging
-import os
+import mimetypes
+import re
 
 
 def _filter_subcategories_for_user(subcategories, user, access=None):
@@ -56,8 +65,7 @@ def get_expense_summary():
         rejected = status_map.get('rejected', 0)
 
         # Calculate total amount for this month (approved only) - use ILS equivalent
-        total_amount = db.session.query(func.sum(
-            func.coalesce(Expense.amount_ils, Expense.amount))).filter(
+        total_amount = db.session.query(func.sum(Expense.amount_ils)).filter(
             Expense.user_id == current_user.id,
             Expense.status == 'approved',
             Expense.date >= start_of_month
@@ -117,8 +125,7 @@ def get_recent_expenses():
             cat_access_filter = build_category_access_filter(managed_dept_ids, managed_cat_ids, managed_subcat_ids)
 
             if cat_access_filter is not None:
-                recent_query = Expense.query.join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-                    .join(Category, Subcategory.category_id == Category.id)\
+                recent_query = Expense.query.join(Category, Expense.category_id == Category.id)\
                     .filter(cat_access_filter)
 
                 # HR users have a dedicated welfare dashboard; exclude welfare
@@ -166,7 +173,7 @@ def get_recent_expenses():
                 'amount_ils': expense.amount_ils,
                 'exchange_rate': expense.exchange_rate,
                 'description': expense.description,
-                'date': expense.date.isoformat() if expense.date else None,
+                'date': expense.date,
                 'status': expense.status,
                 'subcategory': expense.subcategory.name if expense.subcategory else None,
                 'category': expense.subcategory.category.name if expense.subcategory and expense.subcategory.category else None,
@@ -198,8 +205,7 @@ def get_pending_count():
             cat_access_filter = build_category_access_filter(managed_dept_ids, managed_cat_ids, managed_subcat_ids)
 
             if cat_access_filter is not None:
-                count_query = Expense.query.join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-                    .join(Category, Subcategory.category_id == Category.id)\
+                count_query = Expense.query.join(Category, Expense.category_id == Category.id)\
                     .filter(
                         Expense.status == 'pending',
                         cat_access_filter
@@ -246,8 +252,7 @@ def get_pending_approvals():
             managed_dept_ids, managed_cat_ids, managed_subcat_ids = get_manager_access(current_user)
             cat_access_filter = build_category_access_filter(managed_dept_ids, managed_cat_ids, managed_subcat_ids)
             if cat_access_filter is not None:
-                pending_query = base_query.join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-                    .join(Category, Subcategory.category_id == Category.id)\
+                pending_query = base_query.join(Category, Expense.category_id == Category.id)\
                     .filter(
                         Expense.status == 'pending',
                         cat_access_filter
@@ -271,12 +276,10 @@ def get_pending_approvals():
         # 1. Calculate department budget usage
         dept_budget_usage = {}
         dept_usage_query = db.session.query(
-            Category.department_id,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('used')
-        ).join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-         .join(Category, Subcategory.category_id == Category.id)\
-         .filter(Expense.status == 'approved')\
-         .group_by(Category.department_id).all()
+            Expense.department_id,
+            func.sum(Expense.amount_ils).label('used')
+        ).filter(Expense.status == 'approved')\
+         .group_by(Expense.department_id).all()
 
         for dept_id, used in dept_usage_query:
             dept_budget_usage[dept_id] = float(used) if used else 0.0
@@ -284,11 +287,10 @@ def get_pending_approvals():
         # 2. Calculate category budget usage
         cat_budget_usage = {}
         cat_usage_query = db.session.query(
-            Subcategory.category_id,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('used')
-        ).join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-         .filter(Expense.status == 'approved')\
-         .group_by(Subcategory.category_id).all()
+            Expense.category_id,
+            func.sum(Expense.amount_ils).label('used')
+        ).filter(Expense.status == 'approved')\
+         .group_by(Expense.category_id).all()
 
         for cat_id, used in cat_usage_query:
             cat_budget_usage[cat_id] = float(used) if used else 0.0
@@ -297,7 +299,7 @@ def get_pending_approvals():
         subcat_budget_usage = {}
         subcat_usage_query = db.session.query(
             Expense.subcategory_id,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('used')
+            func.sum(Expense.amount_ils).label('used')
         ).filter(Expense.status == 'approved')\
          .group_by(Expense.subcategory_id).all()
 
@@ -323,7 +325,7 @@ def get_pending_approvals():
                 'exchange_rate': expense.exchange_rate,
                 'description': expense.description,
                 'reason': expense.reason,
-                'date': expense.date.isoformat() if expense.date else None,
+                'date': expense.date,
                 'status': expense.status,
                 'type': expense.type,
                 'payment_method': expense.payment_method,
@@ -356,7 +358,7 @@ def _calculate_budget_impact_optimized(expense, dept_budget_usage, cat_budget_us
     """Calculate budget impact for an expense using pre-calculated budget usage data"""
     try:
         budget_impact = {}
-        expense_amount = expense.amount_ils if expense.amount_ils else expense.amount
+        expense_amount = expense.amount_ils
 
         # Calculate Department Budget Impact - use the budget's department (subcategory->category->department)
         if expense.subcategory and expense.subcategory.category and expense.subcategory.category.department:
@@ -441,18 +443,16 @@ def _calculate_budget_impact(expense):
         budget_impact = {}
 
         # Get expense amount in ILS
-        expense_amount = expense.amount_ils if expense.amount_ils else expense.amount
+        expense_amount = expense.amount_ils
 
         # Calculate Department Budget Impact - use the budget's department (subcategory->category->department)
         if expense.subcategory and expense.subcategory.category and expense.subcategory.category.department:
             department = expense.subcategory.category.department
 
             # Calculate used budget (approved expenses in current period)
-            dept_used = db.session.query(func.sum(func.coalesce(Expense.amount_ils, Expense.amount)))\
-                .join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-                .join(Category, Subcategory.category_id == Category.id)\
+            dept_used = db.session.query(func.sum(Expense.amount_ils))\
                 .filter(
-                    Category.department_id == department.id,
+                    Expense.department_id == department.id,
                     Expense.status == 'approved'
                 ).scalar() or 0.0
 
@@ -478,10 +478,9 @@ def _calculate_budget_impact(expense):
             category = expense.subcategory.category
 
             # Calculate used budget (approved expenses in this category)
-            cat_used = db.session.query(func.sum(func.coalesce(Expense.amount_ils, Expense.amount)))\
-                .join(Subcategory)\
+            cat_used = db.session.query(func.sum(Expense.amount_ils))\
                 .filter(
-                    Subcategory.category_id == category.id,
+                    Expense.category_id == category.id,
                     Expense.status == 'approved'
                 ).scalar() or 0.0
 
@@ -507,7 +506,7 @@ def _calculate_budget_impact(expense):
             subcategory = expense.subcategory
 
             # Calculate used budget (approved expenses in this subcategory)
-            subcat_used = db.session.query(func.sum(func.coalesce(Expense.amount_ils, Expense.amount)))\
+            subcat_used = db.session.query(func.sum(Expense.amount_ils))\
                 .filter(
                     Expense.subcategory_id == subcategory.id,
                     Expense.status == 'approved'
@@ -548,7 +547,7 @@ def get_expense_stats():
         # Get expenses by month
         monthly_data = db.session.query(
             func.date_trunc('month', Expense.date).label('month'),
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('total')
+            func.sum(Expense.amount_ils).label('total')
         ).filter(
             Expense.user_id == current_user.id,
             Expense.status == 'approved',
@@ -564,8 +563,8 @@ def get_expense_stats():
         # Get expenses by category
         category_data = db.session.query(
             Category.name,
-            func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('total')
-        ).join(Subcategory).join(Expense).filter(
+            func.sum(Expense.amount_ils).label('total')
+        ).join(Expense, Expense.category_id == Category.id).filter(
             Expense.user_id == current_user.id,
             Expense.status == 'approved',
             Expense.date >= six_months_ago
@@ -598,10 +597,10 @@ def get_departments():
     """Get all departments for form dropdown (filtered by current budget year)"""
     try:
         # Get current budget year
-        current_year = BudgetYear.query.filter_by(is_current=True).first()
+        current_year_id = get_current_year_id()
 
-        if current_year:
-            departments = Department.query.filter_by(year_id=current_year.id).all()
+        if current_year_id:
+            departments = Department.query.filter_by(year_id=current_year_id).all()
         else:
             departments = Department.query.all()
 
@@ -629,13 +628,14 @@ def get_categories():
         # Get budget year - use parameter if provided, otherwise fall back to current year
         if budget_year_param:
             target_year = BudgetYear.query.filter_by(year=budget_year_param).first()
+            target_year_id = target_year.id if target_year else None
         else:
-            target_year = BudgetYear.query.filter_by(is_current=True).first()
+            target_year_id = get_current_year_id()
 
         # Base query - always filter by target budget year
         base_query = Category.query.join(Department)
-        if target_year:
-            base_query = base_query.filter(Department.year_id == target_year.id)
+        if target_year_id:
+            base_query = base_query.filter(Department.year_id == target_year_id)
 
         # Admin users can see all categories if 'all' param is true
         if all_categories and current_user.is_admin:
@@ -645,11 +645,11 @@ def get_categories():
         elif current_user.department_id:
             # Get the user's department in the target budget year
             user_dept = Department.query.get(current_user.department_id)
-            if user_dept and target_year:
-                # Find matching home department in target year by name
+            if user_dept and target_year_id:
+                # Find the home department's lineage in the target year
                 target_year_dept = Department.query.filter_by(
-                    name=user_dept.name,
-                    year_id=target_year.id
+                    lineage_id=user_dept.lineage_id,
+                    year_id=target_year_id
                 ).first()
 
                 if current_user.is_manager:
@@ -658,45 +658,24 @@ def get_categories():
                     if target_year_dept:
                         accessible_dept_ids.add(target_year_dept.id)
 
-                    # Resolve managed departments to target budget year by name
-                    for managed_dept in current_user.managed_departments:
-                        dept_in_target_year = Department.query.filter_by(
-                            name=managed_dept.name,
-                            year_id=target_year.id
-                        ).first()
-                        if dept_in_target_year:
-                            accessible_dept_ids.add(dept_in_target_year.id)
-
-                    # Resolve directly managed categories to target budget year
+                    # Resolve managed departments to target budget year by lineage
+                    dept_lineages = {d.lineage_id for d in current_user.managed_departments}
+                    if dept_lineages:
+                        accessible_dept_ids.update(dept_id for (dept_id,) in db.session.query(Department.id).filter(
+                            Department.lineage_id.in_(dept_lineages),
+                            Department.year_id == target_year_id
+                        ))
+
+                    # Resolve directly managed categories, and the categories of
+                    # managed subcategories, to target budget year by lineage
+                    cat_lineages = {c.lineage_id for c in current_user.managed_categories}
+                    cat_lineages.update(s.category.lineage_id for s in current_user.managed_subcategories if s.category)
                     direct_cat_ids = set()
-                    for managed_cat in current_user.managed_categories:
-                        if managed_cat.department:
-                            dept_in_target_year = Department.query.filter_by(
-                                name=managed_cat.department.name,
-                                year_id=target_year.id
-                            ).first()
-                            if dept_in_target_year:
-                                cat = Category.query.filter_by(
-                                    name=managed_cat.name,
-                                    department_id=dept_in_target_year.id
-                                ).first()
-                                if cat:
-                                    direct_cat_ids.add(cat.id)
-
-                    # Resolve directly managed subcategories to target budget year
-                    for managed_sub in current_user.managed_subcategories:
-                        if managed_sub.category and managed_sub.category.department:
-                            dept_in_target_year = Department.query.filter_by(
-                                name=managed_sub.category.department.name,
-                                year_id=target_year.id
-                            ).first()
-                            if dept_in_target_year:
-                                cat = Category.query.filter_by(
-                                    name=managed_sub.category.name,
-                                    department_id=dept_in_target_year.id
-                                ).first()
-                                if cat:
-                                    direct_cat_ids.add(cat.id)
+                    if cat_lineages:
+                        direct_cat_ids.update(cat_id for (cat_id,) in db.session.query(Category.id).join(Department).filter(
+                            Category.lineage_id.in_(cat_lineages),
+                            Department.year_id == target_year_id
+                        ))
 
                     # Build combined filter
                     conditions = []
@@ -758,10 +737,10 @@ def get_subcategories():
             subcategories = Subcategory.query.filter_by(category_id=category_id).all()
         else:
             # Filter by current budget year when getting all subcategories
-            current_year = BudgetYear.query.filter_by(is_current=True).first()
-            if current_year:
+            current_year_id = get_current_year_id()
+            if current_year_id:
                 subcategories = Subcategory.query.join(Category).join(Department).filter(
-                    Department.year_id == current_year.id
+                    Department.year_id == current_year_id
                 ).all()
             else:
                 subcategories = Subcategory.query.all()
@@ -878,90 +857,60 @@ def list_expenses():
         search = request.args.get('search', None, type=str)
         sort_by = request.args.get('sort_by', 'id', type=str)  # Default to insertion order (newest first)
         sort_order = request.args.get('sort_order', 'desc', type=str)
+        include_archived = request.args.get('include_archived', '').lower() == 'true'
+        ExpenseSource = expense_source(include_archived)
+
+        # fields= picks attributes, include= the related objects to expand
+        try:
+            shape = USER_EXPENSE_SHAPE.select(request.args.get('fields'), request.args.get('include'))
+        except FieldSelectionError as e:
+            return jsonify({'error': str(e)}), 400
 
         # Build query
-        query = Expense.query.filter_by(user_id=current_user.id)
+        query = select(ExpenseSource.id).where(ExpenseSource.user_id == current_user.id)
 
         # Apply filters
         if status:
-            query = query.filter_by(status=status)
+            query = query.filter(ExpenseSource.status == status)
 
         if subcategory_id:
-            query = query.filter_by(subcategory_id=subcategory_id)
+            query = query.filter(ExpenseSource.subcategory_id == subcategory_id)
         elif category_id:
-            query = query.join(Subcategory).filter(Subcategory.category_id == category_id)
+            query = query.filter(ExpenseSource.category_id == category_id)
 
         if start_date:
             try:
-                query = query.filter(Expense.date >= datetime.fromisoformat(start_date))
+                query = query.filter(ExpenseSource.date >= datetime.fromisoformat(start_date))
             except ValueError:
                 return jsonify({'error': 'Invalid start_date format. Use ISO format (YYYY-MM-DD)'}), 400
 
         if end_date:
             try:
-                query = query.filter(Expense.date <= datetime.fromisoformat(end_date))
+                query = query.filter(ExpenseSource.date <= datetime.fromisoformat(end_date))
             except ValueError:
                 return jsonify({'error': 'Invalid end_date format. Use ISO format (YYYY-MM-DD)'}), 400
 
         if search:
             query = query.filter(
-                (Expense.description.ilike(f'%{search}%')) |
-                (Expense.reason.ilike(f'%{search}%'))
+                (ExpenseSource.description.ilike(f'%{search}%')) |
+                (ExpenseSource.reason.ilike(f'%{search}%'))
             )
 
         # Apply sorting
         if sort_by == 'id':
-            query = query.order_by(Expense.id.desc() if sort_order == 'desc' else Expense.id.asc())
+            query = query.order_by(ExpenseSource.id.desc() if sort_order == 'desc' else ExpenseSource.id.asc())
         elif sort_by == 'date':
-            query = query.order_by(Expense.date.desc() if sort_order == 'desc' else Expense.date.asc())
+            query = query.order_by(ExpenseSource.date.desc() if sort_order == 'desc' else ExpenseSource.date.asc())
         elif sort_by == 'amount':
-            query = query.order_by(Expense.amount.desc() if sort_order == 'desc' else Expense.amount.asc())
+            query = query.order_by(ExpenseSource.amount.desc() if sort_order == 'desc' else ExpenseSource.amount.asc())
         elif sort_by == 'status':
-            query = query.order_by(Expense.status.desc() if sort_order == 'desc' else Expense.status.asc())
+            query = query.order_by(ExpenseSource.status.desc() if sort_order == 'desc' else ExpenseSource.status.asc())
         else:
-            query = query.order_by(Expense.id.desc())
-
-        # Add eager loading to avoid N+1 queries
-        query = query.options(
-            joinedload(Expense.subcategory).joinedload(Subcategory.category),
-            joinedload(Expense.supplier)
-        )
+            query = query.order_by(ExpenseSource.id.desc())
 
-        # Paginate
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
-
-        expense_list = []
-        for expense in pagination.items:
-            expense_list.append({
-                'id': expense.id,
-                'amount': expense.amount,
-                'currency': expense.currency,
-                'amount_ils': expense.amount_ils,
-                'exchange_rate': expense.exchange_rate,
-                'description': expense.description,
-                'reason': expense.reason,
-                'date': expense.date.isoformat() if expense.date else None,
-                'status': expense.status,
-                'type': expense.type,
-                'payment_method': expense.payment_method,
-                'subcategory': {
-                    'id': expense.subcategory.id,
-                    'name': expense.subcategory.name
-                } if expense.subcategory else None,
-                'category': {
-                    'id': expense.subcategory.category.id,
-                    'name': expense.subcategory.category.name
-                } if expense.subcategory and expense.subcategory.category else None,
-                'supplier': {
-                    'id': expense.supplier.id,
-                    'name': expense.supplier.name
-                } if expense.supplier else None,
-                'invoice_filename': expense.invoice_filename,
-                'receipt_filename': expense.receipt_filename,
-                'quote_filename': expense.quote_filename,
-                'submit_date': expense.submit_date.isoformat() if expense.submit_date else None,
-                'invoice_date': expense.invoice_date.isoformat() if expense.invoice_date else None
-            })
+        # Paginate, selecting only the columns the response needs
+        pagination = shape.paginate(query, page, per_page, source=ExpenseSource)
+        expense_list = pagination.items
 
         return jsonify({
             'expenses': expense_list,
@@ -984,7 +933,8 @@ def list_expenses():
 def get_expense_details(expense_id):
     """Get detailed information about a specific expense"""
     try:
-        expense = Expense.query.get(expense_id)
+        # Expenses of archived years are shown too, read-only
+        expense = get_expense(expense_id, include_archived=True)
 
         if not expense:
             return jsonify({'error': 'Expense not found'}), 404
@@ -1006,7 +956,7 @@ def get_expense_details(expense_id):
             'exchange_rate': expense.exchange_rate,
             'description': expense.description,
             'reason': expense.reason,
-            'date': expense.date.isoformat() if expense.date else None,
+            'date': expense.date,
             'status': expense.status,
             'type': expense.type,
             'payment_method': expense.payment_method,
@@ -1041,10 +991,12 @@ def get_expense_details(expense_id):
             'invoice_filename': expense.invoice_filename,
             'receipt_filename': expense.receipt_filename,
             'quote_filename': expense.quote_filename,
+            'attachments': serialize_attachments(expense),
             'rejection_reason': expense.rejection_reason,
+            'is_archived': is_year_archived(expense.budget_year_id),
             'budget_impact': budget_impact,
-            'submit_date': expense.submit_date.isoformat() if expense.submit_date else None,
-            'created_at': expense.submit_date.isoformat() if expense.submit_date else None
+            'submit_date': expense.submit_date,
+            'created_at': expense.submit_date
         }
 
         return jsonify({'expense': expense_data}), 200
@@ -1150,6 +1102,11 @@ def submit_expense():
             if field not in data or not data[field]:
                 return jsonify({'error': f'Missing required field: {field}'}), 400
 
+        # Archived budget years are read-only
+        path = get_subcategory_paths([int(data['subcategory_id'])]).get(int(data['subcategory_id']))
+        if path and is_year_archived(path.year_id):
+            return jsonify({'error': 'Budget year is archived'}), 400
+
         # Create expense
         expense = Expense(
             amount=float(data['amount']),
@@ -1169,18 +1126,7 @@ def submit_expense():
         )
 
         # Calculate ILS equivalent
-        try:
-            if expense.currency == 'ILS':
-                expense.amount_ils = expense.amount
-                expense.exchange_rate = 1.0
-            else:
-                rate = get_exchange_rate(expense.currency, expense.date.date() if hasattr(expense.date, 'date') else expense.date)
-                expense.exchange_rate = rate
-                expense.amount_ils = round(expense.amount * rate, 2)
-        except Exception as e:
-            logging.warning(f"Failed to get exchange rate for {expense.currency}: {e}. Using amount as-is.")
-            expense.amount_ils = expense.amount
-            expense.exchange_rate = 1.0
+        expense.amount_ils, expense.exchange_rate = convert_to_ils(expense.amount, expense.currency, expense.date)
 
         # Set payment_status to 'Pending attention' for bank transfer payment method
         if data.get('payment_method') in ('transfer', 'bank_transfer'):
@@ -1193,33 +1139,40 @@ def submit_expense():
             expense.paid_by_id = current_user.id
             expense.payment_status = 'paid'
 
-        # Handle file uploads - use configured UPLOAD_FOLDER for consistency with download route
-        upload_folder = current_app.config.get('UPLOAD_FOLDER')
-        if not upload_folder:
+        # Handle file uploads - stored via services.file_storage, same as the download route
+        if not current_app.config.get('UPLOAD_FOLDER'):
             logging.error("UPLOAD_FOLDER is not configured in app.config")
             return jsonify({'error': 'Server configuration error'}), 500
-        os.makedirs(upload_folder, exist_ok=True)
-
-        if 'invoice' in request.files:
-            file = request.files['invoice']
-            if file and file.filename:
-                filename = secure_filename(f"{current_user.id}_{datetime.now().timestamp()}_{file.filename}")
-                file.save(os.path.join(upload_folder, filename))
-                expense.invoice_filename = filename
-
-        if 'receipt' in request.files:
-            file = request.files['receipt']
-            if file and file.filename:
-                filename = secure_filename(f"{current_user.id}_{datetime.now().timestamp()}_{file.filename}")
-                file.save(os.path.join(upload_folder, filename))
-                expense.receipt_filename = filename
-
-        if 'quote' in request.files:
-            file = request.files['quote']
-            if file and file.filename:
-                filename = secure_filename(f"{current_user.id}_{datetime.now().timestamp()}_{file.filename}")
-                file.save(os.path.join(upload_folder, filename))
-                expense.quote_filename = filename
+
+        # Each field may carry several files; all are kept as attachments.
+        # <kind>_hash references a document the client already uploaded (e.g.
+        # for OCR) so it does not have to be sent again. Every hash is checked
+        # before any upload is written.
+        kinds = ('invoice', 'receipt', 'quote')
+        hashes = {kind: [h for h in data.getlist(f'{kind}_hash') if h] for kind in kinds}
+        attachable = attachable_hashes(current_user, [h for kind in kinds for h in hashes[kind]])
+        blobs = {}
+        for kind in kinds:
+            for content_hash in hashes[kind]:
+                blob = get_blob(content_hash) if content_hash.lower() in attachable else None
+                if not blob:
+                    return jsonify({'error': f'Unknown {kind} document hash: {content_hash}'}), 400
+                blobs[content_hash] = blob
+
+        for kind in kinds:
+            uploads = [f for f in request.files.getlist(kind) if f and f.filename]
+            hash_names = data.getlist(f'{kind}_hash_filename')
+            for i, file in enumerate(uploads):
+                suffix = f"_{i}" if i else ""
+                filename = secure_filename(f"{current_user.id}_{datetime.now().timestamp()}{suffix}_{file.filename}")
+                add_attachment(expense, kind, file, filename)
+            for i, content_hash in enumerate(hashes[kind], start=len(uploads)):
+                blob = blobs[content_hash]
+                original = hash_names[i - len(uploads)] if i - len(uploads) < len(hash_names) else ''
+                original = original or f"{kind}{mimetypes.guess_extension(blob.mime_type or '') or ''}"
+                suffix = f"_{i}" if i else ""
+                filename = secure_filename(f"{current_user.id}_{datetime.now().timestamp()}{suffix}_{original}")
+                attach_blob(expense, kind, blob, filename)
 
         db.session.add(expense)
         db.session.commit()
@@ -1261,18 +1214,10 @@ def submit_expense():
         # Send email to accounting system for every expense submission
         try:
             attachments = []
-            if expense.invoice_filename:
-                invoice_path = os.path.join(upload_folder, expense.invoice_filename)
-                if os.path.exists(invoice_path):
-                    attachments.append(invoice_path)
-            if expense.receipt_filename:
-                receipt_path = os.path.join(upload_folder, expense.receipt_filename)
-                if os.path.exists(receipt_path):
-                    attachments.append(receipt_path)
-            if expense.quote_filename:
-                quote_path = os.path.join(upload_folder, expense.quote_filename)
-                if os.path.exists(quote_path):
-                    attachments.append(quote_path)
+            for attachment in expense.attachments:
+                attachment_path = resolve_path(attachment.stored_name)
+                if attachment_path:
+                    attachments.append((attachment_path, attachment.stored_name))
 
             accounting_template = """
             <html>
@@ -1315,7 +1260,8 @@ def submit_expense():
         return jsonify({
             'message': 'Expense submitted successfully',
             'expense_id': expense.id,
-            'status': expense.status
+            'status': expense.status,
+            'duplicate_warnings': duplicate_warnings(expense, current_user)
         }), 201
 
     except ValueError as e:
@@ -1327,6 +1273,98 @@ def submit_expense():
         return jsonify({'error': 'Failed to submit expense'}), 500
 
 
+@api_v1.route('/expenses/attachments/check', methods=['POST'])
+@login_required
+def check_attachment_hashes():
+    """Tell the client which documents (by sha256) are already stored.
+
+    A hash reported as stored can be sent to /expenses/submit as <kind>_hash
+    instead of uploading the file again; that is only offered for documents
+    the caller uploaded recently or can already see on an expense.
+    `expense_ids` lists the expenses the caller can view that the same
+    document is already attached to.
+    """
+    try:
+        data = request.get_json() or {}
+        hashes = [h.lower() for h in data.get('hashes', []) if isinstance(h, str) and h]
+        if not hashes:
+            return jsonify({'error': 'hashes is required'}), 400
+        if len(hashes) > 50:
+            return jsonify({'error': 'At most 50 hashes per request'}), 400
+
+        attachable = attachable_hashes(current_user, hashes)
+        stored = {h for (h,) in db.session.query(StoredBlob.content_hash)
+                  .filter(StoredBlob.content_hash.in_(attachable))}
+        matches = find_attachments_by_hash(hashes)
+
+        return jsonify({
+            'results': {
+                h: {
+                    'stored': h in stored,
+                    'expense_ids': visible_expense_ids(current_user, matches.get(h, []))
+                } for h in hashes
+            }
+        }), 200
+
+    except Exception as e:
+        logging.error(f"Error checking attachment hashes: {str(e)}")
+        return jsonify({'error': 'Failed to check attachments'}), 500
+
+
+@api_v1.route('/expenses/attachments/upload-url', methods=['POST'])
+@login_required
+def create_attachment_upload():
+    """Presigned POST for uploading a document straight to object storage.
+
+    The client hashes the file first. If the document is already stored the
+    response says so and nothing needs uploading; with the local-disk backend
+    `direct_upload` is false and the client sends the file with the form.
+    After a direct upload, /expenses/attachments/confirm registers it and the
+    hash can be submitted as <kind>_hash.
+    """
+    try:
+        data = request.get_json() or {}
+        content_hash = data.get('content_hash', '')
+        content_type = data.get('content_type') or 'application/octet-stream'
+        if not re.fullmatch(r'[0-9a-fA-F]{64}', content_hash):
+            return jsonify({'error': 'content_hash must be a sha256 hex digest'}), 400
+
+        # Skipping the upload is only offered for documents the caller may
+        # attach by hash; anyone else proves they have the bytes by sending them
+        reuse = content_hash.lower() in attachable_hashes(current_user, [content_hash])
+        return jsonify(start_direct_upload(content_hash, content_type, reuse_stored=reuse)), 200
+
+    except Exception as e:
+        logging.error(f"Error creating upload URL: {str(e)}")
+        return jsonify({'error': 'Failed to create upload URL'}), 500
+
+
+@api_v1.route('/expenses/attachments/confirm', methods=['POST'])
+@login_required
+def confirm_attachment_upload():
+    """Verify a direct upload against its hash and store it for submit."""
+    try:
+        data = request.get_json() or {}
+        content_hash = data.get('content_hash', '')
+        if not re.fullmatch(r'[0-9a-fA-F]{64}', content_hash):
+            return jsonify({'error': 'content_hash must be a sha256 hex digest'}), 400
+
+        try:
+            blob = finish_direct_upload(data.get('upload_key'), content_hash, data.get('content_type'))
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({'error': str(e)}), 400
+        record_upload(current_user.id, blob.content_hash)
+        db.session.commit()
+
+        return jsonify({'stored': True, 'content_hash': blob.content_hash, 'size': blob.size}), 200
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error confirming upload: {str(e)}")
+        return jsonify({'error': 'Failed to confirm upload'}), 500
+
+
 @api_v1.route('/exchange-rate', methods=['GET'])
 @login_required
 def get_exchange_rate_endpoint():
@@ -1353,7 +1391,7 @@ def get_exchange_rate_endpoint():
 
         result = {
             'currency': currency,
-            'date': target_date.isoformat(),
+            'date': target_date,
             'rate': rate
         }
         if amount is not None:
@@ -1366,10 +1404,37 @@ def get_exchange_rate_endpoint():
         return jsonify({'error': 'Failed to get exchange rate'}), 500
 
 
+def _report_scope(source=Expense):
+    """select() of the expense ids the current user may report on."""
+    if current_user.is_admin:
+        return select(source.id)
+    if current_user.is_manager:
+        # Managers see expenses from managed departments + cross-dept categories
+        managed_dept_ids, managed_cat_ids, managed_subcat_ids = get_manager_access(current_user)
+        cat_access_filter = build_category_access_filter(managed_dept_ids, managed_cat_ids, managed_subcat_ids)
+        if cat_access_filter is not None:
+            scope = select(source.id).join(Category, source.category_id == Category.id)\
+                .where(cat_access_filter)
+            # HR users: exclude welfare from other departments (handled via HR dashboard)
+            if current_user.is_hr:
+                scope = scope.where(or_(
+                    Category.is_welfare == False,
+                    Category.department_id == current_user.department_id
+                ))
+            return scope
+    # Regular users see only their expenses
+    return select(source.id).where(source.user_id == current_user.id)
+
+
 @api_v1.route('/expenses/report', methods=['GET'])
 @login_required
 def get_expense_report():
-    """Get expense report with filters"""
+    """Get expense report with filters.
+
+    group_by=dim,... returns a pivot computed in SQL (see
+    services/expense_report.py) instead of the expense list; page= returns
+    one page of the list, e.g. to drill into a pivot cell.
+    """
     try:
         # Get filter parameters
         start_date = request.args.get('start_date')
@@ -1378,88 +1443,103 @@ def get_expense_report():
         department_id = request.args.get('department_id')
         category_id = request.args.get('category_id')
         user_id = request.args.get('user_id')
-        
-        # Build query based on user role
-        if current_user.is_admin:
-            query = Expense.query
-        elif current_user.is_manager:
-            # Managers see expenses from managed departments + cross-dept categories
-            managed_dept_ids, managed_cat_ids, managed_subcat_ids = get_manager_access(current_user)
-            cat_access_filter = build_category_access_filter(managed_dept_ids, managed_cat_ids, managed_subcat_ids)
-            if cat_access_filter is not None:
-                query = Expense.query.join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-                    .join(Category, Subcategory.category_id == Category.id)\
-                    .filter(cat_access_filter)
-                # HR users: exclude welfare from other departments (handled via HR dashboard)
-                if current_user.is_hr:
-                    query = query.filter(or_(
-                        Category.is_welfare == False,
-                        Category.department_id == current_user.department_id
-                    ))
-            else:
-                query = Expense.query.filter_by(user_id=current_user.id)
-        else:
-            # Regular users see only their expenses
-            query = Expense.query.filter_by(user_id=current_user.id)
+        # Drill-down filters, matching the pivot dimensions
+        subcategory_id = request.args.get('subcategory_id')
+        supplier_id = request.args.get('supplier_id')
+        currency = request.args.get('currency')
+        month = request.args.get('month')
+        include_archived = request.args.get('include_archived', '').lower() == 'true'
+        ExpenseSource = expense_source(include_archived)
+
+        query = _report_scope(ExpenseSource)
 
         # Apply filters
         if start_date:
-            query = query.filter(Expense.date >= datetime.strptime(start_date, '%Y-%m-%d'))
+            query = query.where(ExpenseSource.date >= datetime.strptime(start_date, '%Y-%m-%d'))
         if end_date:
-            query = query.filter(Expense.date <= datetime.strptime(end_date, '%Y-%m-%d'))
+            query = query.where(ExpenseSource.date <= datetime.strptime(end_date, '%Y-%m-%d'))
         if status and status != 'all':
-            query = query.filter(Expense.status == status)
+            query = query.where(ExpenseSource.status == status)
         if department_id and current_user.is_admin:
-            query = query.join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-                .join(Category, Subcategory.category_id == Category.id)\
-                .filter(Category.department_id == int(department_id))
+            query = query.where(ExpenseSource.department_id == int(department_id))
         if category_id:
-            if not (department_id and current_user.is_admin) and not current_user.is_manager:
-                query = query.join(Subcategory, Expense.subcategory_id == Subcategory.id)
-            query = query.filter(Subcategory.category_id == int(category_id))
+            query = query.where(ExpenseSource.category_id == int(category_id))
         if user_id and (current_user.is_admin or current_user.is_manager):
-            query = query.filter(Expense.user_id == int(user_id))
-        
-        expenses = query.order_by(Expense.id.desc()).all()
-        
-        # Build response
-        report_data = []
-        total_amount = 0
-        
-        for exp in expenses:
-            report_data.append({
-                'id': exp.id,
-                'date': exp.date.strftime('%Y-%m-%d') if exp.date else '',
-                'description': exp.description or '',
-                'amount': exp.amount,
-                'currency': exp.currency,
-                'amount_ils': exp.amount_ils,
-                'exchange_rate': exp.exchange_rate,
-                'status': exp.status,
-                'type': exp.type,
-                'category': exp.subcategory.category.name if exp.subcategory and exp.subcategory.category else '',
-                'subcategory': exp.subcategory.name if exp.subcategory else '',
-                'supplier': exp.supplier.name if exp.supplier else '',
-                'user': f"{exp.submitter.first_name} {exp.submitter.last_name}" if exp.submitter else '',
-                'department': exp.subcategory.category.department.name if exp.subcategory and exp.subcategory.category and exp.subcategory.category.department else '',
-                'payment_method': exp.payment_method or '',
-                'reason': exp.reason or ''
-            })
-            if exp.status == 'approved':
-                total_amount += (exp.amount_ils if exp.amount_ils else exp.amount)
-        
-        return jsonify({
+            query = query.where(ExpenseSource.user_id == int(user_id))
+        if subcategory_id:
+            query = query.where(ExpenseSource.subcategory_id == int(subcategory_id))
+        if supplier_id:
+            query = query.where(ExpenseSource.supplier_id == int(supplier_id))
+        if currency:
+            query = query.where(ExpenseSource.currency == currency)
+        if month:
+            try:
+                month_start = datetime.strptime(month, '%Y-%m')
+            except ValueError:
+                return jsonify({'error': 'Invalid month format. Use YYYY-MM'}), 400
+            next_month = (month_start + timedelta(days=32)).replace(day=1)
+            query = query.where(ExpenseSource.date >= month_start, ExpenseSource.date < next_month)
+
+        filters_applied = {
+            'start_date': start_date,
+            'end_date': end_date,
+            'status': status,
+            'department_id': department_id,
+            'category_id': category_id
+        }
+
+        group_by = request.args.get('group_by')
+        if group_by:
+            try:
+                report = run_report(
+                    query,
+                    parse_names(group_by, DIMENSIONS, 'dimensions'),
+                    parse_names(request.args.get('measures'), MEASURES, 'measures'),
+                    request.args.get('totals', 'rollup'),
+                    source=ExpenseSource,
+                )
+            except ReportError as e:
+                return jsonify({'error': str(e)}), 400
+            report['filters_applied'] = filters_applied
+            return jsonify(report), 200
+
+        try:
+            shape = REPORT_EXPENSE_SHAPE.select(request.args.get('fields'))
+        except FieldSelectionError as e:
+            return jsonify({'error': str(e)}), 400
+
+        total_amount = db.session.execute(
+            query.with_only_columns(func.sum(ExpenseSource.amount_ils)).where(ExpenseSource.status == 'approved')
+        ).scalar() or 0
+        query = query.order_by(ExpenseSource.id.desc())
+
+        if 'page' in request.args:
+            page = request.args.get('page', 1, type=int)
+            per_page = min(request.args.get('per_page', 50, type=int), 500)
+            pagination = shape.paginate(query, page, per_page, source=ExpenseSource)
+            report_data = pagination.items
+            total_count = pagination.total
+        else:
+            report_data = shape.serialize(db.session.execute(shape.project(query, ExpenseSource)).mappings())
+            pagination = None
+            total_count = len(report_data)
+
+        response = {
             'expenses': report_data,
-            'total_count': len(report_data),
+            'total_count': total_count,
             'total_approved_amount': round(total_amount, 2),
-            'filters_applied': {
-                'start_date': start_date,
-                'end_date': end_date,
-                'status': status,
-                'department_id': department_id,
-                'category_id': category_id
+            'filters_applied': filters_applied
+        }
+        if pagination is not None:
+            response['pagination'] = {
+                'page': pagination.page,
+                'per_page': pagination.per_page,
+                'total': pagination.total,
+                'pages': pagination.pages,
+                'has_next': pagination.has_next,
+                'has_prev': pagination.has_prev
             }
-        }), 200
+        return jsonify(response), 200
         
     except Exception as e:
         logging.error(f"Error generating expense report: {str(e)}", exc_info=True)
@@ -1514,8 +1594,7 @@ def export_expenses():
             managed_dept_ids, managed_cat_ids, managed_subcat_ids = get_manager_access(current_user)
             cat_access_filter = build_category_access_filter(managed_dept_ids, managed_cat_ids, managed_subcat_ids)
             if cat_access_filter is not None:
-                export_query = db.session.query(Expense).join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-                    .join(Category, Subcategory.category_id == Category.id)\
+                export_query = db.session.query(Expense).join(Category, Expense.category_id == Category.id)\
                     .filter(cat_access_filter)
                 # HR users: exclude welfare from other departments (handled via HR dashboard)
                 if current_user.is_hr:
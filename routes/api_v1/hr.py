@@ -2,6 +2,7 @@ from flask import jsonify, request
 from flask_login import login_required, current_user
 from models import db, Department, Category, Subcategory, Expense, BudgetYear
 from services.manager_access import get_manager_access
+from services.budget_years import get_current_year_id
 from sqlalchemy import func
 from . import api_v1
 import logging
@@ -24,13 +25,13 @@ def get_welfare_overview():
         # Determine budget year
         year_id = request.args.get('year_id', type=int)
         if not year_id:
-            current_year = BudgetYear.query.filter_by(is_current=True).first()
-            if not current_year:
+            year_id = get_current_year_id()
+            if not year_id:
                 # Fallback: use the actual current year
                 now_year = datetime.now().year
                 current_year = BudgetYear.query.filter_by(year=now_year).first()
-            if current_year:
-                year_id = current_year.id
+                if current_year:
+                    year_id = current_year.id
 
         # Get all departments for this year
         dept_query = Department.query
@@ -89,16 +90,18 @@ def get_welfare_overview():
 
         welfare_cat_ids = [c.id for c in welfare_categories]
 
+        # Lets Postgres prune the spending sums to that year's partition
+        expense_year_filter = [Expense.budget_year_id == year_id] if year_id else []
+
         # Calculate category spending (for welfare categories only)
         cat_spending = {}
         if welfare_cat_ids:
             cat_query = db.session.query(
-                Subcategory.category_id,
-                func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('spent')
-            ).join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-             .filter(Subcategory.category_id.in_(welfare_cat_ids))\
+                Expense.category_id,
+                func.sum(Expense.amount_ils).label('spent')
+            ).filter(Expense.category_id.in_(welfare_cat_ids), *expense_year_filter)\
              .filter(Expense.status == 'approved')\
-             .group_by(Subcategory.category_id).all()
+             .group_by(Expense.category_id).all()
 
             for cat_id, spent in cat_query:
                 cat_spending[cat_id] = float(spent) if spent else 0.0
@@ -115,10 +118,11 @@ def get_welfare_overview():
             if welfare_subcat_ids:
                 subcat_query = db.session.query(
                     Expense.subcategory_id,
-                    func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('spent')
+                    func.sum(Expense.amount_ils).label('spent')
                 ).filter(
                     Expense.subcategory_id.in_(welfare_subcat_ids),
-                    Expense.status == 'approved'
+                    Expense.status == 'approved',
+                    *expense_year_filter
                 ).group_by(Expense.subcategory_id).all()
 
                 for subcat_id, spent in subcat_query:
@@ -313,9 +317,9 @@ def get_hr_departments():
         if year_id:
             query = query.filter_by(year_id=year_id)
         else:
-            current_year = BudgetYear.query.filter_by(is_current=True).first()
-            if current_year:
-                query = query.filter_by(year_id=current_year.id)
+            current_year_id = get_current_year_id()
+            if current_year_id:
+                query = query.filter_by(year_id=current_year_id)
 
         departments = query.order_by(Department.name).all()
 
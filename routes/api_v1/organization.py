@@ -1,9 +1,13 @@
 from flask import jsonify, request
 from flask_login import login_required, current_user
-from models import db, Department, Category, Subcategory, Expense, BudgetYear, User, manager_departments
-from services.manager_access import get_manager_access, build_category_access_filter
+from models import db, Department, Category, Subcategory, Expense, BudgetYear
+from services.manager_access import get_manager_access, build_category_access_filter, expand_department_lineage
 from services.exchange_rate import get_exchange_rate
-from sqlalchemy import func, case, or_
+from services.year_rollover import roll_over_structure, migrate_users_to_year as migrate_users_to_year_set_based, describe_rollover
+from services.budget_years import get_current_year_id, invalidate_current_year
+from services.expense_partitions import ensure_expense_partition
+from services.year_archive import ArchiveError, archive_year as archive_budget_year, restore_year as restore_budget_year
+from sqlalchemy import func, case
 from . import api_v1
 import logging
 from datetime import datetime, date
@@ -30,7 +34,9 @@ def get_budget_years():
                 'name': y.name or str(y.year),
                 'is_active': y.is_active,
                 'is_current': y.year == current_year,  # Calculate based on actual current year
-                'created_at': y.created_at.isoformat() if y.created_at else None
+                'is_archived': y.is_archived,
+                'archived_at': y.archived_at,
+                'created_at': y.created_at
             } for y in years]
         }), 200
     except Exception as e:
@@ -65,6 +71,8 @@ def create_budget_year():
         )
         
         db.session.add(budget_year)
+        db.session.flush()
+        ensure_expense_partition(budget_year.id)
         db.session.commit()
         
         logging.info(f"Budget year {year_num} created by {current_user.username}")
@@ -98,6 +106,9 @@ def update_budget_year(year_id):
             return jsonify({'error': 'Budget year not found'}), 404
         
         data = request.get_json()
+
+        if budget_year.is_archived and (data.get('is_active') or data.get('is_current')):
+            return jsonify({'error': 'Budget year is archived; restore it first'}), 400
         
         if 'name' in data:
             budget_year.name = data['name']
@@ -109,6 +120,7 @@ def update_budget_year(year_id):
             budget_year.is_current = True
         
         db.session.commit()
+        invalidate_current_year()
         
         logging.info(f"Budget year {year_id} updated by {current_user.username}")
         
@@ -141,112 +153,25 @@ def copy_structure_from_year(year_id, source_id):
         
         if not target_year or not source_year:
             return jsonify({'error': 'Budget year not found'}), 404
-        
-        # Get source departments
-        source_depts = Department.query.filter_by(year_id=source_id).all()
-
-        # Track source dept ID -> new dept ID for manager assignment copying
-        dept_id_map = {}
-        skipped_depts = []
-
-        for src_dept in source_depts:
-            # Skip if department with same name already exists in target year
-            existing = Department.query.filter_by(name=src_dept.name, year_id=year_id).first()
-            if existing:
-                dept_id_map[src_dept.id] = existing.id
-                skipped_depts.append(src_dept.name)
-                continue
-
-            # Create new department
-            new_dept = Department(
-                name=src_dept.name,
-                budget=0.0,  # Reset budget for new year
-                currency=src_dept.currency,
-                year_id=year_id
-            )
-            db.session.add(new_dept)
-            db.session.flush()  # Get the new dept ID
-            dept_id_map[src_dept.id] = new_dept.id
-
-            # Copy categories
-            for src_cat in src_dept.categories:
-                new_cat = Category(
-                    name=src_cat.name,
-                    budget=0.0,
-                    is_welfare=src_cat.is_welfare,
-                    department_id=new_dept.id
-                )
-                db.session.add(new_cat)
-                db.session.flush()
-
-                # Copy subcategories
-                for src_sub in src_cat.subcategories:
-                    new_sub = Subcategory(
-                        name=src_sub.name,
-                        budget=0.0,
-                        category_id=new_cat.id
-                    )
-                    db.session.add(new_sub)
-
-        # Copy manager-department assignments to new year's departments
-        managers_copied = 0
-        for src_dept_id, new_dept_id in dept_id_map.items():
-            if src_dept_id == new_dept_id:
-                continue  # Skip already-existing departments
-            # Get managers of source department
-            src_managers = db.session.query(manager_departments.c.user_id).filter(
-                manager_departments.c.department_id == src_dept_id
-            ).all()
-            for (user_id,) in src_managers:
-                # Check if assignment already exists
-                exists = db.session.query(manager_departments).filter(
-                    manager_departments.c.user_id == user_id,
-                    manager_departments.c.department_id == new_dept_id
-                ).first()
-                if not exists:
-                    db.session.execute(manager_departments.insert().values(
-                        user_id=user_id, department_id=new_dept_id
-                    ))
-                    managers_copied += 1
-
-        # Optionally migrate user department assignments to the new year
-        migrate_users = request.get_json() and request.get_json().get('migrate_users', False)
-        users_migrated = 0
-        if migrate_users:
-            users_with_dept = User.query.filter(User.department_id.isnot(None)).all()
-            for user in users_with_dept:
-                if user.department_id in dept_id_map:
-                    new_dept_id = dept_id_map[user.department_id]
-                    if new_dept_id != user.department_id:
-                        user.department_id = new_dept_id
-                        users_migrated += 1
-                else:
-                    # User's department wasn't in source year - try matching by name
-                    old_dept = Department.query.get(user.department_id)
-                    if old_dept:
-                        target_dept = Department.query.filter_by(
-                            name=old_dept.name, year_id=year_id
-                        ).first()
-                        if target_dept and target_dept.id != user.department_id:
-                            user.department_id = target_dept.id
-                            users_migrated += 1
-
-        db.session.commit()
-
-        logging.info(f"Structure copied from year {source_id} to {year_id} by {current_user.username}. "
-                     f"Managers copied: {managers_copied}, Users migrated: {users_migrated}, "
-                     f"Skipped existing depts: {skipped_depts}")
+        if target_year.is_archived:
+            return jsonify({'error': 'Target budget year is archived; restore it first'}), 400
+        
+        data = request.get_json(silent=True) or {}
+        result = roll_over_structure(
+            source_year_id=source_id,
+            target_year_id=year_id,
+            migrate_users=bool(data.get('migrate_users', False)),
+            dry_run=bool(data.get('dry_run', False)),
+        )
 
-        msg = f'Structure copied successfully from {source_year.name} to {target_year.name}'
-        if skipped_depts:
-            msg += f'. Skipped {len(skipped_depts)} existing department(s): {", ".join(skipped_depts)}'
-        if managers_copied:
-            msg += f'. {managers_copied} manager assignment(s) copied.'
-        if users_migrated:
-            msg += f' {users_migrated} user(s) migrated to new year.'
+        logging.info(f"Structure {'dry-run ' if result['dry_run'] else ''}copied from year {source_id} to {year_id} "
+                     f"by {current_user.username}. Departments created: {len(result['departments_created'])}, "
+                     f"Managers copied: {result['managers_copied']}, Users migrated: {result['users_migrated']}, "
+                     f"Skipped existing depts: {result['departments_skipped']}")
 
         return jsonify({
-            'message': msg
+            'message': describe_rollover(result, source_year.name, target_year.name),
+            **result
         }), 200
     except Exception as e:
         db.session.rollback()
@@ -269,42 +194,22 @@ def migrate_users_to_year(year_id):
         target_year = BudgetYear.query.get(year_id)
         if not target_year:
             return jsonify({'error': 'Budget year not found'}), 404
+        if target_year.is_archived:
+            return jsonify({'error': 'Target budget year is archived; restore it first'}), 400
 
-        # Get all departments in the target year, indexed by name
-        target_depts = Department.query.filter_by(year_id=year_id).all()
-        target_dept_by_name = {d.name: d for d in target_depts}
-
-        users_migrated = 0
-        users_skipped = []
-        users_with_dept = User.query.filter(User.department_id.isnot(None)).all()
-
-        for user in users_with_dept:
-            current_dept = Department.query.get(user.department_id)
-            if not current_dept:
-                continue
-            # Already pointing to a department in the target year
-            if current_dept.year_id == year_id:
-                continue
-            # Find matching department by name in target year
-            target_dept = target_dept_by_name.get(current_dept.name)
-            if target_dept:
-                user.department_id = target_dept.id
-                users_migrated += 1
-            else:
-                users_skipped.append({
-                    'user': user.username,
-                    'department': current_dept.name
-                })
-
-        db.session.commit()
+        data = request.get_json(silent=True) or {}
+        result = migrate_users_to_year_set_based(year_id, dry_run=bool(data.get('dry_run', False)))
+        users_migrated = result['users_migrated']
+        users_skipped = result['users_skipped']
 
-        logging.info(f"User migration to year {year_id}: {users_migrated} migrated, "
-                     f"{len(users_skipped)} skipped by {current_user.username}")
+        logging.info(f"User migration to year {year_id}{' (dry run)' if result['dry_run'] else ''}: "
+                     f"{users_migrated} migrated, {len(users_skipped)} skipped by {current_user.username}")
 
         return jsonify({
-            'message': f'{users_migrated} user(s) migrated to {target_year.name}',
+            'message': f"{users_migrated} user(s) {'would be ' if result['dry_run'] else ''}migrated to {target_year.name}",
             'migrated': users_migrated,
-            'skipped': users_skipped
+            'skipped': users_skipped,
+            'dry_run': result['dry_run']
         }), 200
 
     except Exception as e:
@@ -313,6 +218,52 @@ def migrate_users_to_year(year_id):
         return jsonify({'error': 'Failed to migrate users'}), 500
 
 
+@api_v1.route('/organization/years/<int:year_id>/archive', methods=['POST'])
+@login_required
+def archive_year(year_id):
+    """Close a budget year and move its expenses to the archive tier"""
+    try:
+        if not current_user.is_admin:
+            return jsonify({'error': 'Not authorized'}), 403
+        if not BudgetYear.query.get(year_id):
+            return jsonify({'error': 'Budget year not found'}), 404
+
+        result = archive_budget_year(year_id)
+        logging.info(f"Budget year {result['year']} archived by {current_user.username}: "
+                     f"{result['expenses_moved']} expense(s) moved")
+        return jsonify({'message': f"Budget year {result['year']} archived", **result}), 200
+    except ArchiveError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error archiving budget year {year_id}: {str(e)}")
+        return jsonify({'error': 'Failed to archive budget year'}), 500
+
+
+@api_v1.route('/organization/years/<int:year_id>/restore', methods=['POST'])
+@login_required
+def restore_year(year_id):
+    """Move an archived budget year's expenses back into the active table"""
+    try:
+        if not current_user.is_admin:
+            return jsonify({'error': 'Not authorized'}), 403
+        if not BudgetYear.query.get(year_id):
+            return jsonify({'error': 'Budget year not found'}), 404
+
+        result = restore_budget_year(year_id)
+        logging.info(f"Budget year {result['year']} restored by {current_user.username}: "
+                     f"{result['expenses_moved']} expense(s) moved")
+        return jsonify({'message': f"Budget year {result['year']} restored", **result}), 200
+    except ArchiveError as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error restoring budget year {year_id}: {str(e)}")
+        return jsonify({'error': 'Failed to restore budget year'}), 500
+
+
 @api_v1.route('/organization/structure', methods=['GET'])
 @login_required
 def get_organization_structure():
@@ -327,16 +278,19 @@ def get_organization_structure():
         all_years = request.args.get('all_years', '').lower() == 'true'
 
         query = Department.query
+        view_year_id = None
         if all_years:
             # Skip year filtering - return departments from all years
             pass
         elif year_id:
-            query = query.filter_by(year_id=year_id)
+            view_year_id = year_id
         else:
             # Default to current year or all if no current year set
-            current_year = BudgetYear.query.filter_by(is_current=True).first()
-            if current_year:
-                query = query.filter_by(year_id=current_year.id)
+            view_year_id = get_current_year_id()
+        if view_year_id:
+            query = query.filter_by(year_id=view_year_id)
+        # Lets Postgres prune the spending sums to that year's partition
+        expense_year_filter = [Expense.budget_year_id == view_year_id] if view_year_id else []
         
         # Access-level tracking for category/subcategory filtering
         _full_access_dept_ids = set()
@@ -350,9 +304,7 @@ def get_organization_structure():
             _is_filtered_manager = True
 
             # Get explicit access assignments
-            full_access_depts = list(current_user.managed_departments)
-            full_access_dept_ids = [d.id for d in full_access_depts]
-            full_access_dept_names = [d.name for d in full_access_depts]
+            full_access_dept_ids = [d.id for d in current_user.managed_departments]
             _managed_cat_ids = set(c.id for c in current_user.managed_categories)
             _managed_subcat_ids = set(s.id for s in current_user.managed_subcategories)
 
@@ -366,16 +318,9 @@ def get_organization_structure():
             if not full_access_dept_ids and not _managed_cat_ids and not _managed_subcat_ids:
                 if current_user.department_id:
                     full_access_dept_ids.append(current_user.department_id)
-                    home_dept = Department.query.get(current_user.department_id)
-                    if home_dept and home_dept.name not in full_access_dept_names:
-                        full_access_dept_names.append(home_dept.name)
-
-            # Expand full access departments by name across budget years
-            if full_access_dept_names:
-                all_matching = Department.query.filter(Department.name.in_(full_access_dept_names)).all()
-                full_access_dept_ids = list(set(d.id for d in all_matching))
 
-            _full_access_dept_ids = set(full_access_dept_ids)
+            # Expand full access departments by lineage across budget years
+            _full_access_dept_ids = set(expand_department_lineage(full_access_dept_ids))
 
             # Find departments containing managed categories
             cat_dept_ids = set()
@@ -402,17 +347,8 @@ def get_organization_structure():
                 logging.warning(f"Manager {current_user.username} has no visible departments")
                 return jsonify({'structure': [], 'view_only': True}), 200
 
-            # Build filter conditions with name-based cross-year matching
-            visible_depts = Department.query.filter(Department.id.in_(all_visible_dept_ids)).all()
-            visible_dept_names = list(set(d.name for d in visible_depts))
-
-            conditions = []
-            if all_visible_dept_ids:
-                conditions.append(Department.id.in_(all_visible_dept_ids))
-            if visible_dept_names:
-                conditions.append(Department.name.in_(visible_dept_names))
-
-            query = query.filter(or_(*conditions))
+            # Show the same departments in whichever year is being viewed
+            query = query.filter(Department.id.in_(expand_department_lineage(all_visible_dept_ids)))
 
         departments = query.order_by(Department.name).all()
 
@@ -424,13 +360,11 @@ def get_organization_structure():
         dept_spending = {}
         if dept_ids:
             dept_query = db.session.query(
-                Category.department_id,
-                func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('spent')
-            ).join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-             .join(Category, Subcategory.category_id == Category.id)\
-             .filter(Category.department_id.in_(dept_ids))\
+                Expense.department_id,
+                func.sum(Expense.amount_ils).label('spent')
+            ).filter(Expense.department_id.in_(dept_ids), *expense_year_filter)\
              .filter(Expense.status == 'approved')\
-             .group_by(Category.department_id).all()
+             .group_by(Expense.department_id).all()
 
             for dept_id, spent in dept_query:
                 dept_spending[dept_id] = float(spent) if spent else 0.0
@@ -439,13 +373,11 @@ def get_organization_structure():
         cat_spending = {}
         if dept_ids:
             cat_query = db.session.query(
-                Subcategory.category_id,
-                func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('spent')
-            ).join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-             .join(Category, Subcategory.category_id == Category.id)\
-             .filter(Category.department_id.in_(dept_ids))\
+                Expense.category_id,
+                func.sum(Expense.amount_ils).label('spent')
+            ).filter(Expense.department_id.in_(dept_ids), *expense_year_filter)\
              .filter(Expense.status == 'approved')\
-             .group_by(Subcategory.category_id).all()
+             .group_by(Expense.category_id).all()
 
             for cat_id, spent in cat_query:
                 cat_spending[cat_id] = float(spent) if spent else 0.0
@@ -455,10 +387,8 @@ def get_organization_structure():
         if dept_ids:
             subcat_query = db.session.query(
                 Expense.subcategory_id,
-                func.sum(func.coalesce(Expense.amount_ils, Expense.amount)).label('spent')
-            ).join(Subcategory, Expense.subcategory_id == Subcategory.id)\
-             .join(Category, Subcategory.category_id == Category.id)\
-             .filter(Category.department_id.in_(dept_ids))\
+                func.sum(Expense.amount_ils).label('spent')
+            ).filter(Expense.department_id.in_(dept_ids), *expense_year_filter)\
              .filter(Expense.status == 'approved')\
              .group_by(Expense.subcategory_id).all()
 
@@ -488,7 +418,7 @@ def get_organization_structure():
                 subcats_by_cat[sub.category_id] = []
             subcats_by_cat[sub.category_id].append(sub)
 
-        # Spent totals were summed as ILS via coalesce(amount_ils, amount).
+        # Spent totals were summed as ILS (amount_ils).
         # Convert them back to each department's budget currency so the
         # displayed "Expenses" value matches the budget's currency label.
         today = date.today()
@@ -589,8 +519,7 @@ def create_department():
         # Get year_id from request or use current year
         year_id = data.get('year_id')
         if not year_id:
-            current_year = BudgetYear.query.filter_by(is_current=True).first()
-            year_id = current_year.id if current_year else None
+            year_id = get_current_year_id()
 
         # Check for duplicate department name within the same year
         existing = Department.query.filter_by(name=data['name'], year_id=year_id).first()
@@ -0,0 +1,850 @@
+"""Non-API routes: health probes, Azure AD callback, file downloads, legacy
+accounting actions, OCR endpoints and the React catch-all."""
+from flask import Blueprint, current_app, request, redirect, flash, send_file, jsonify, session, send_from_directory
+from flask_login import login_user, login_required, current_user
+from datetime import datetime
+import os
+import mimetypes
+from werkzeug.utils import secure_filename
+from utils.email_sender import send_email, EXPENSE_PAYMENT_NOTIFICATION_TEMPLATE, PASSWORD_CHANGE_CONFIRMATION_TEMPLATE
+import logging
+from io import BytesIO
+from models import db, Department, User, Expense
+from services.document_processor import get_document_processor
+from services.grow_webhook import handle_grow_webhook
+from services.health import get_readiness_report
+from services.file_storage import resolve_path, download_url, store_received
+from services.uploads import receive_upload
+from services.ocr_preprocess import is_pdf, extract_pdf_pages
+from services.ocr_limiter import get_ocr_limiter, OcrBusy
+from services.storage_backends import get_storage
+from services.file_serving import serve_stored_file
+from services.thumbnails import get_thumbnail
+from services.attachments import find_attachment, attachment_expense, can_view_expense, record_upload
+import requests
+from functools import wraps
+
+web = Blueprint('web', __name__)
+
+ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif'}
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+def format_currency(value, currency='ILS'):
+    """Format a numeric value as currency string."""
+    if isinstance(value, (int, float)):
+        if currency == 'USD':
+            return f"${value:,.2f}"
+        else:
+            return f"₪{value:,.2f}"
+    return value
+
+# --- Health probes ---
+
+@web.route('/health')
+def health_check():
+    """Liveness probe for Render: no I/O, answers as long as the worker is serving."""
+    return jsonify({'status': 'alive'}), 200
+
+@web.route('/health/ready')
+def readiness_check():
+    """Readiness probe: cached, timeout-bounded DB / upload folder / SMTP checks."""
+    report, status_code = get_readiness_report(current_app)
+    return jsonify(report), status_code
+
+# --- Grow payment webhook (mali workshop post-payment emails) ---
+
+@web.route('/api/grow-webhook', methods=['POST'])
+def grow_webhook():
+    status, sent = handle_grow_webhook(
+        body=request.get_json(silent=True),
+        webhook_key=os.environ.get('GROW_WEBHOOK_KEY'),
+        mail_from=os.environ.get('MAIL_FROM'),
+        notify_to=os.environ.get('SALE_NOTIFY_TO'),
+    )
+    return jsonify({'sent': sent}), status
+
+# --- Azure AD Authentication ---
+
+def _build_msal_app(cache=None):
+    import msal  # Only needed for the Azure AD login flow
+
+    return msal.ConfidentialClientApplication(
+        current_app.config['AZURE_AD_CLIENT_ID'],
+        authority=current_app.config['AZURE_AD_AUTHORITY'],
+        client_credential=current_app.config['AZURE_AD_CLIENT_SECRET'],
+        token_cache=cache
+    )
+
+@web.route('/auth/callback')
+def auth_callback():
+    if not session.get("flow"):
+        logging.error("No flow found in session")
+        return redirect('/login')
+
+    try:
+        logging.info(f"Auth callback received. Args: {request.args}")
+
+        result = _build_msal_app().acquire_token_by_auth_code_flow(
+            session.get("flow"),
+            request.args,
+            scopes=['https://graph.microsoft.com/User.Read']
+        )
+        logging.info("Token acquired successfully")
+
+        if "error" in result:
+            error_msg = f"Error during login: {result.get('error_description', 'Unknown error')}"
+            logging.error(error_msg)
+            flash(error_msg)
+            return redirect('/login')
+
+        graph_response = requests.get(
+            'https://graph.microsoft.com/v1.0/me',
+            headers={'Authorization': f"Bearer {result['access_token']}"}
+        )
+        logging.info(f"Graph API response status: {graph_response.status_code}")
+
+        if not graph_response.ok:
+            logging.error(f"Graph API error: {graph_response.text}")
+            flash('Could not retrieve user information')
+            return redirect('/login')
+
+        graph_data = graph_response.json()
+        logging.info("User info retrieved from Graph API")
+
+        email = graph_data.get('mail')
+        if not email:
+            email = graph_data.get('userPrincipalName')
+            logging.info(f"Using userPrincipalName as email: {email}")
+
+        if not email:
+            logging.error(f"No email found in graph data: {graph_data}")
+            flash('Could not retrieve email from Microsoft account')
+            return redirect('/login')
+
+        user = User.query.filter_by(email=email).first()
+
+        if not user:
+            logging.info(f"Creating new user for email: {email}")
+            default_dept = Department.query.first()
+
+            user = User(
+                username=email.split('@')[0],
+                email=email,
+                first_name=graph_data.get('givenName', ''),
+                last_name=graph_data.get('surname', ''),
+                department_id=default_dept.id if default_dept else None,
+                status='active'
+            )
+            db.session.add(user)
+            db.session.commit()
+            logging.info(f"New user created with ID: {user.id}")
+        else:
+            user.first_name = graph_data.get('givenName', user.first_name)
+            user.last_name = graph_data.get('surname', user.last_name)
+            db.session.commit()
+
+        if user.status == 'inactive':
+            logging.warning(f"Inactive user attempted login: {email}")
+            flash('Your account is inactive. Please contact your administrator.')
+            return redirect('/login')
+
+        login_user(user)
+        session['token_cache'] = result.get('token_cache')
+        logging.info(f"User {email} logged in successfully")
+
+        return redirect('/dashboard')
+
+    except Exception as e:
+        logging.error(f"Error in auth callback: {str(e)}", exc_info=True)
+        flash('An error occurred during login. Please try again.')
+        return redirect('/login')
+
+# --- File Download ---
+
+def _can_view_expense(expense):
+    return can_view_expense(current_user, expense)
+
+@web.route('/download/<filename>')
+@login_required
+def download_file(filename):
+    is_preview_request = request.headers.get('Sec-Fetch-Dest') == 'iframe'
+
+    def return_error(message, status_code=404):
+        if is_preview_request:
+            error_html = f'''
+            <!DOCTYPE html>
+            <html>
+            <head>
+                <style>
+                    body {{
+                        display: flex;
+                        flex-direction: column;
+                        align-items: center;
+                        justify-content: center;
+                        height: 100vh;
+                        margin: 0;
+                        font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif;
+                        background: #f8fafc;
+                        color: #475569;
+                    }}
+                    .error-icon {{
+                        font-size: 4rem;
+                        color: #94a3b8;
+                        margin-bottom: 1rem;
+                    }}
+                    .error-message {{
+                        font-size: 1.125rem;
+                        text-align: center;
+                        max-width: 400px;
+                        padding: 0 1rem;
+                    }}
+                </style>
+            </head>
+            <body>
+                <div class="error-icon">📄</div>
+                <p class="error-message">{message}</p>
+            </body>
+            </html>
+            '''
+            return error_html, status_code, {'Content-Type': 'text/html'}
+        else:
+            return jsonify({'error': message}), status_code
+
+    try:
+        if not filename or filename == 'None' or filename == '':
+            logging.warning("Download attempt with empty or 'None' filename")
+            return return_error('No file associated with this record or filename is invalid.')
+
+        if '..' in filename or filename.startswith('/'):
+            logging.warning(f"Malicious filename attempt: {filename}")
+            return return_error('Invalid filename.')
+
+        upload_folder = current_app.config.get('UPLOAD_FOLDER')
+        if not upload_folder:
+            logging.error("UPLOAD_FOLDER is not configured in current_app.config")
+            return return_error('Server configuration error: Upload directory not set.', 500)
+
+        logging.info(f"[File Download] Request for '{filename}' by user {current_user.id} ({current_user.username})")
+
+        # Single probe of the unique stored_name index; authorize before
+        # touching storage (which may be a remote bucket)
+        attachment = find_attachment(filename)
+        expense = attachment_expense(attachment) if attachment else None
+
+        if not expense:
+            logging.warning(f"[File Download] No database record found for {filename}.")
+            return return_error('File record not found in database.', 404)
+
+        if _can_view_expense(expense):
+            # Deduplicated files are stored under their content hash, so the
+            # type and name come from the attachment rather than the path
+            mimetype = attachment.mime_type or mimetypes.guess_type(filename)[0]
+
+            if get_storage().is_remote:
+                logging.info(f"[File Download] Redirecting to presigned URL: {filename}")
+                return redirect(download_url(filename, mimetype))
+
+            abs_upload_folder = os.path.abspath(upload_folder)
+            filepath = resolve_path(filename)
+
+            if not filepath or not os.path.isfile(filepath):
+                if not os.path.isdir(abs_upload_folder):
+                    logging.error(f"[File Download] CRITICAL: Upload folder does not exist: {abs_upload_folder}")
+                    return return_error('Server configuration error: Upload directory does not exist.', 500)
+
+                # The metadata index answers this without listing the upload folder
+                logging.error(f"[File Download] File not found: {filename} (resolved to {filepath})")
+
+                error_msg = f'File not found: {filename}. The file may have been deleted or moved.'
+                if is_preview_request:
+                    error_msg = f'Unable to preview file: {filename}\n\nThe file may have been deleted, moved, or there may be a server configuration issue.\n\nPlease contact your administrator if this problem persists.'
+                return return_error(error_msg)
+
+            if not os.path.abspath(filepath).startswith(abs_upload_folder + os.sep):
+                logging.warning(f"Path traversal attempt: {filename} resolved to {filepath}")
+                return return_error('Invalid filename or path.')
+
+            try:
+                logging.info(f"[File Download] Sending file: {filename}")
+                return serve_stored_file(filepath, filename, mimetype=mimetype, etag=attachment.content_hash)
+            except Exception as e:
+                logging.error(f"Error sending file {filename}: {str(e)}")
+                return return_error('Error loading file. Please try again.', 500)
+
+        logging.warning(f"[File Download] Unauthorized access attempt to file {filename} by user {current_user.id}")
+        return return_error('Unauthorized access', 403)
+
+    except Exception as e:
+        logging.error(f"Unexpected error in download_file: {str(e)}", exc_info=True)
+        return return_error('Error loading file. Please try again.', 500)
+
+@web.route('/download/<filename>/thumb')
+@login_required
+def download_thumbnail(filename):
+    """Small JPEG preview of a document, for list views."""
+    try:
+        attachment = find_attachment(filename)
+        expense = attachment_expense(attachment) if attachment else None
+        if not expense:
+            return jsonify({'error': 'File not found'}), 404
+        if not _can_view_expense(expense):
+            return jsonify({'error': 'Unauthorized access'}), 403
+
+        filepath = resolve_path(filename)
+        if not filepath or not os.path.isfile(filepath):
+            return jsonify({'error': 'File not found'}), 404
+
+        mimetype = attachment.mime_type or mimetypes.guess_type(filename)[0]
+        thumb_path = get_thumbnail(filepath, attachment.content_hash, mimetype)
+        if not thumb_path:
+            return jsonify({'error': 'Preview not available'}), 404
+
+        response = send_file(thumb_path, mimetype='image/jpeg', conditional=True,
+                             etag=f"{attachment.content_hash}-{current_app.config['THUMBNAIL_SIZE']}"
+                             if attachment.content_hash else True,
+                             max_age=current_app.config['FILE_CACHE_MAX_AGE'])
+        response.cache_control.private = True
+        response.cache_control.public = False
+        return response
+
+    except Exception as e:
+        logging.error(f"Error serving thumbnail for {filename}: {str(e)}")
+        return jsonify({'error': 'Error loading preview'}), 500
+
+# --- Excel Export ---
+
+@web.route('/export_accounting_excel')
+@login_required
+def export_accounting_excel():
+    month_filter = request.args.get('month', 'all')
+
+    query = Expense.query.filter_by(status='approved')
+
+    if month_filter != 'all':
+        year, month = month_filter.split('-')
+        start_date = datetime(int(year), int(month), 1)
+        if int(month) == 12:
+            end_date = datetime(int(year) + 1, 1, 1)
+        else:
+            end_date = datetime(int(year), int(month) + 1, 1)
+        query = query.filter(Expense.date >= start_date, Expense.date < end_date)
+
+    expenses = query.all()
+
+    data = []
+    for expense in expenses:
+        data.append({
+            'Date Submitted': expense.date.strftime('%d/%m/%Y'),
+            'Employee': expense.submitter.username,
+            'Department': expense.subcategory.category.department.name if expense.subcategory and expense.subcategory.category and expense.subcategory.category.department else '',
+            'Description': expense.description,
+            'Reason': expense.reason,
+            'Type': expense.type,
+            'Amount': expense.amount,
+            'Handled By': expense.handler.username if expense.handler else '-',
+            'Date Handled': expense.handled_at.strftime('%d/%m/%Y') if expense.handled_at else '-',
+            'Credit Card Last 4 Digits': expense.credit_card.last_four_digits if expense.credit_card else '-',
+            'Payment Method': expense.payment_method,
+            'Supplier Name': expense.supplier.name if expense.supplier else '-',
+            'Supplier Email': expense.supplier.email if expense.supplier else '-',
+            'Supplier Phone': expense.supplier.phone if expense.supplier else '-',
+            'Supplier Address': expense.supplier.address if expense.supplier else '-',
+            'Tax ID': expense.supplier.tax_id if expense.supplier else '-',
+            'Bank Name': expense.supplier.bank_name if expense.supplier else '-',
+            'Bank Account': expense.supplier.bank_account_number if expense.supplier else '-',
+            'Bank Branch': expense.supplier.bank_branch if expense.supplier else '-',
+            'Bank SWIFT': expense.supplier.bank_swift if expense.supplier else '-',
+            'IBAN': expense.supplier.iban if expense.supplier else '-',
+            'Supplier Notes': expense.supplier.notes if expense.supplier else '-',
+            'Supplier Status': expense.supplier.status if expense.supplier else '-',
+            'Date of Invoice': expense.invoice_date.strftime('%d/%m/%Y') if expense.invoice_date else '-',
+            'Payment Due Date': 'Start of month' if expense.payment_due_date == 'start_of_month' else 'End of month',
+            'Payment Status': 'Paid' if expense.is_paid else 'Pending Payment',
+            'External Accounting Entry': 'Yes' if expense.external_accounting_entry else 'No',
+            'External Accounting Entry By': expense.external_accounting_entry_by.username if expense.external_accounting_entry_by else '-',
+            'External Accounting Entry Date': expense.external_accounting_entry_at.strftime('%d/%m/%Y %H:%M') if expense.external_accounting_entry_at else '-'
+        })
+
+    import pandas as pd  # Heavy import, only needed for Excel exports
+
+    df = pd.DataFrame(data)
+
+    output = BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, sheet_name='Expenses', index=False)
+        worksheet = writer.sheets['Expenses']
+        for idx, col in enumerate(df.columns):
+            series = df[col]
+            max_len = max(
+                series.astype(str).map(len).max(),
+                len(str(series.name))
+            ) + 1
+            worksheet.set_column(idx, idx, max_len)
+
+    output.seek(0)
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=f'accounting_export_{datetime.now().strftime("%Y%m%d")}.xlsx'
+    )
+
+# --- Expense Payment Status ---
+
+@web.route('/mark_expense_paid/<int:expense_id>', methods=['POST'])
+@login_required
+def mark_expense_paid(expense_id):
+    if not current_user.is_accounting and not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    expense = Expense.query.get_or_404(expense_id)
+    if expense.status != 'approved':
+        return jsonify({'error': 'Only approved expenses can be marked as paid'}), 400
+
+    expense.is_paid = True
+    expense.paid_by_id = current_user.id
+    expense.paid_at = datetime.utcnow()
+    expense.payment_status = 'paid'
+    db.session.commit()
+
+    try:
+        submitter = User.query.get(expense.user_id)
+        if submitter and submitter.email:
+            payment_method_map = {
+                'credit': 'Credit Card',
+                'transfer': 'Bank Transfer',
+                'bank_transfer': 'Bank Transfer',
+                'standing_order': 'Standing Order',
+                'check': 'Check'
+            }
+            payment_method_display = payment_method_map.get(expense.payment_method, expense.payment_method or 'Unknown')
+
+            send_email(
+                subject="Your Expense Has Been Paid",
+                recipient=submitter.email,
+                template=EXPENSE_PAYMENT_NOTIFICATION_TEMPLATE,
+                amount=format_currency(expense.amount, expense.currency),
+                description=expense.description,
+                date=expense.date.strftime('%d/%m/%Y'),
+                payment_method=payment_method_display,
+                expense=expense,
+                paid_by=current_user.username,
+                paid_date=datetime.now().strftime('%d/%m/%Y')
+            )
+            logging.info(f"Payment notification sent to {submitter.email} for expense {expense.id}")
+    except Exception as e:
+        logging.error(f"Failed to send payment notification: {str(e)}")
+
+    return jsonify({'success': True})
+
+@web.route('/mark_expense_unpaid/<int:expense_id>', methods=['POST'])
+@login_required
+def mark_expense_unpaid(expense_id):
+    if not current_user.is_accounting and not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    expense = Expense.query.get_or_404(expense_id)
+    if not expense.is_paid:
+        return jsonify({'error': 'Expense is already marked as unpaid'}), 400
+
+    expense.is_paid = False
+    expense.paid_by_id = None
+    expense.paid_at = None
+    expense.payment_status = 'pending_payment'
+    db.session.commit()
+
+    return jsonify({'success': True})
+
+@web.route('/mark_expense_pending_payment/<int:expense_id>', methods=['POST'])
+@login_required
+def mark_expense_pending_payment(expense_id):
+    if not current_user.is_accounting and not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    expense = Expense.query.get_or_404(expense_id)
+    if expense.is_paid:
+        return jsonify({'error': 'Already paid'}), 400
+
+    expense.payment_status = 'pending_payment'
+    db.session.commit()
+    return jsonify({'success': True})
+
+@web.route('/mark_expense_external_accounting/<int:expense_id>', methods=['POST'])
+@login_required
+def mark_expense_external_accounting(expense_id):
+    if not current_user.is_accounting and not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    expense = Expense.query.get_or_404(expense_id)
+    if expense.status != 'approved':
+        return jsonify({'error': 'Only approved expenses can be marked as entered in external accounting'}), 400
+
+    expense.external_accounting_entry = True
+    expense.external_accounting_entry_by_id = current_user.id
+    expense.external_accounting_entry_at = datetime.utcnow()
+    db.session.commit()
+
+    return jsonify({'success': True})
+
+@web.route('/unmark_expense_external_accounting/<int:expense_id>', methods=['POST'])
+@login_required
+def unmark_expense_external_accounting(expense_id):
+    if not current_user.is_accounting and not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    expense = Expense.query.get_or_404(expense_id)
+    if not expense.external_accounting_entry:
+        return jsonify({'error': 'Expense is not marked as entered in external accounting'}), 400
+
+    expense.external_accounting_entry = False
+    expense.external_accounting_entry_by_id = None
+    expense.external_accounting_entry_at = None
+    db.session.commit()
+
+    return jsonify({'success': True})
+
+# --- Admin Password Reset ---
+
+@web.route('/admin/users/<int:user_id>/reset_password', methods=['POST'])
+@login_required
+def reset_user_password(user_id):
+    if not current_user.is_admin:
+        return jsonify({'error': 'Access denied'}), 403
+
+    try:
+        user = User.query.get_or_404(user_id)
+
+        if user.id == current_user.id:
+            return jsonify({'error': 'Cannot reset your own password through this route. Please use the change password page.'}), 400
+
+        user.password = '123456'
+        db.session.commit()
+
+        logging.info(f"Admin {current_user.username} reset password for user {user.username}")
+
+        try:
+            send_email(
+                subject="Password Change Confirmation",
+                recipient=user.email,
+                template=PASSWORD_CHANGE_CONFIRMATION_TEMPLATE,
+                user=user
+            )
+        except Exception as e:
+            logging.error(f"Failed to send password change notification email: {str(e)}")
+
+        return jsonify({
+            'success': True,
+            'message': f'Password for user {user.username} has been reset to 123456'
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error resetting password: {str(e)}")
+        return jsonify({'error': f'Error resetting password: {str(e)}'}), 500
+
+# --- Document OCR Processing ---
+
+def _ocr_admission(view):
+    """Run an OCR view under the OCR limiter; shed load with 429 when it is full."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            with get_ocr_limiter().slot(current_user.id):
+                return view(*args, **kwargs)
+        except OcrBusy as e:
+            response = jsonify({
+                'error': 'Document processing is busy, please try again shortly.',
+                'reason': e.reason,
+                'retry_after': e.retry_after
+            })
+            response.status_code = 429
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+    return wrapper
+
+def _ocr_upload(file):
+    """OCR an upload from memory and keep it so submit_expense can reference it by hash."""
+    upload = receive_upload(file)
+    try:
+        extracted = get_document_processor().process_document(upload.read_bytes(),
+                                                              content_hash=upload.content_hash)
+        blob = store_received(upload)
+        record_upload(current_user.id, blob.content_hash)
+        db.session.commit()
+    finally:
+        upload.close()
+    return extracted, blob
+
+@web.route('/api/expense/process-expense', methods=['POST'])
+@login_required
+@_ocr_admission
+def process_expense_document():
+    """Process invoice/expense document and extract data using OCR"""
+    logging.info("=== INVOICE OCR PROCESSING START ===")
+    if 'document' not in request.files:
+        return jsonify({'error': 'No document provided'}), 400
+
+    file = request.files['document']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    if file and allowed_file(file.filename):
+        try:
+            filename = secure_filename(file.filename)
+            extracted_data, blob = _ocr_upload(file)
+
+            if extracted_data.get('processing_status') == 'skipped_no_service':
+                return jsonify({
+                    'success': False,
+                    'warning': 'OCR service not configured',
+                    'message': 'Document uploaded but OCR is not available. Please enter data manually.',
+                    'extracted_data': {'amount': None, 'purchase_date': None},
+                    'filename': filename,
+                    'content_hash': blob.content_hash
+                })
+
+            return jsonify({
+                'success': True,
+                'extracted_data': extracted_data,
+                'filename': filename,
+                'content_hash': blob.content_hash
+            })
+
+        except Exception as e:
+            logging.error(f"Invoice OCR: Exception occurred: {str(e)}")
+            import traceback
+            logging.error(f"Invoice OCR: Traceback: {traceback.format_exc()}")
+            return jsonify({'error': str(e)}), 500
+
+    return jsonify({'error': 'Invalid file type'}), 400
+
+@web.route('/api/expense/process-receipt', methods=['POST'])
+@login_required
+@_ocr_admission
+def process_receipt_document():
+    """Process receipt document and extract data using OCR"""
+    logging.info("=== RECEIPT OCR PROCESSING START ===")
+    if 'document' not in request.files:
+        return jsonify({'error': 'No document provided'}), 400
+
+    file = request.files['document']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    if file and allowed_file(file.filename):
+        try:
+            filename = secure_filename(file.filename)
+            receipt_data, blob = _ocr_upload(file)
+
+            if receipt_data.get('processing_status') == 'skipped_no_service':
+                return jsonify({
+                    'success': False,
+                    'warning': 'OCR service not configured',
+                    'message': 'Document uploaded but OCR is not available. Please enter data manually.',
+                    'extracted_data': {'amount': None, 'purchase_date': None},
+                    'filename': filename,
+                    'content_hash': blob.content_hash
+                })
+
+            return jsonify({
+                'success': True,
+                'extracted_data': receipt_data,
+                'filename': filename,
+                'content_hash': blob.content_hash
+            })
+        except Exception as e:
+            logging.error(f"Receipt OCR: Exception occurred: {str(e)}")
+            import traceback
+            logging.error(f"Receipt OCR: Traceback: {traceback.format_exc()}")
+            return jsonify({'error': str(e)}), 500
+
+    return jsonify({'error': 'Invalid file type'}), 400
+
+@web.route('/api/expense/process-quote', methods=['POST'])
+@login_required
+@_ocr_admission
+def process_quote_document():
+    """Process quote document and extract data using OCR"""
+    logging.info("=== QUOTE OCR PROCESSING START ===")
+    if 'document' not in request.files:
+        return jsonify({'error': 'No document provided'}), 400
+
+    file = request.files['document']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    if file and allowed_file(file.filename):
+        try:
+            filename = secure_filename(file.filename)
+            quote_data, blob = _ocr_upload(file)
+
+            if quote_data.get('processing_status') == 'skipped_no_service':
+                return jsonify({
+                    'success': False,
+                    'warning': 'OCR service not configured',
+                    'message': 'Document uploaded but OCR is not available. Please enter data manually.',
+                    'extracted_data': {'amount': None, 'purchase_date': None},
+                    'filename': filename,
+                    'content_hash': blob.content_hash
+                })
+
+            return jsonify({
+                'success': True,
+                'extracted_data': quote_data,
+                'filename': filename,
+                'content_hash': blob.content_hash
+            })
+        except Exception as e:
+            logging.error(f"Quote OCR: Exception occurred: {str(e)}")
+            import traceback
+            logging.error(f"Quote OCR: Traceback: {traceback.format_exc()}")
+            return jsonify({'error': str(e)}), 500
+
+    return jsonify({'error': 'Invalid file type'}), 400
+
+@web.route('/api/expense/process-document', methods=['POST'])
+@login_required
+@_ocr_admission
+def process_document():
+    if 'document' not in request.files:
+        return jsonify({'error': 'No document provided'}), 400
+
+    file = request.files['document']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    if file and allowed_file(file.filename):
+        try:
+            filename = secure_filename(file.filename)
+            extracted_data, blob = _ocr_upload(file)
+
+            return jsonify({
+                'success': True,
+                'extracted_data': extracted_data,
+                'filename': filename,
+                'content_hash': blob.content_hash
+            })
+
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+
+    return jsonify({'error': 'Invalid file type'}), 400
+
+@web.route('/api/expense/process-batch', methods=['POST'])
+@login_required
+@_ocr_admission
+def process_batch_document():
+    """Split one upload holding several receipts/invoices into per-document drafts.
+
+    One analysis call covers the whole file. For PDFs, each detected document's
+    pages are stored as their own file, so the client can create one expense
+    per document by submitting its content_hash as <kind>_hash, with no
+    further uploads.
+    """
+    logging.info("=== BATCH OCR PROCESSING START ===")
+    if 'document' not in request.files:
+        return jsonify({'error': 'No document provided'}), 400
+
+    file = request.files['document']
+    if file.filename == '':
+        return jsonify({'error': 'No selected file'}), 400
+
+    kind = request.form.get('kind', 'receipt')
+    if kind not in ('receipt', 'invoice', 'quote'):
+        return jsonify({'error': 'kind must be receipt, invoice or quote'}), 400
+
+    if file and allowed_file(file.filename):
+        try:
+            filename = secure_filename(file.filename)
+            upload = receive_upload(file)
+            try:
+                data = upload.read_bytes()
+                batch = get_document_processor().process_batch(
+                    data, content_hash=upload.content_hash, doc_type=f'prebuilt-{kind}')
+                blob = store_received(upload)
+                record_upload(current_user.id, blob.content_hash)
+
+                split = is_pdf(data) and len(batch['documents']) > 1
+                stem = os.path.splitext(filename)[0]
+                drafts = []
+                for doc in batch['documents']:
+                    draft = dict(doc, content_hash=blob.content_hash, filename=filename)
+                    if split and doc['first_page']:
+                        part_name = f"{stem}_p{doc['first_page']}-{doc['last_page']}.pdf"
+                        part = receive_upload(BytesIO(extract_pdf_pages(data, doc['first_page'], doc['last_page'])),
+                                              filename=part_name, mimetype='application/pdf')
+                        try:
+                            draft['content_hash'] = store_received(part).content_hash
+                            record_upload(current_user.id, draft['content_hash'])
+                            draft['filename'] = part_name
+                        finally:
+                            part.close()
+                    drafts.append(draft)
+                db.session.commit()
+            finally:
+                upload.close()
+
+            if batch.get('processing_status') == 'skipped_no_service':
+                return jsonify({
+                    'success': False,
+                    'warning': 'OCR service not configured',
+                    'message': 'Document uploaded but OCR is not available. Please enter data manually.',
+                    'documents': [],
+                    'filename': filename,
+                    'content_hash': blob.content_hash
+                })
+
+            return jsonify({
+                'success': True,
+                'kind': kind,
+                'page_count': batch.get('page_count'),
+                'documents': drafts,
+                'filename': filename,
+                'content_hash': blob.content_hash
+            })
+
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Batch OCR: Exception occurred: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+    return jsonify({'error': 'Invalid file type'}), 400
+
+# --- Serve React Frontend ---
+
+@web.route('/', defaults={'path': ''})
+@web.route('/<path:path>')
+def serve_react(path=''):
+    """Serve the React app for all non-API routes"""
+    # Skip paths handled by other routes (API, static, download, etc.)
+    if path.startswith('api/') or path.startswith('static/') or \
+       path.startswith('auth/') or path.startswith('download/') or \
+       path.startswith('uploads/') or path == 'health' or path.startswith('health/') or \
+       path.startswith('mark_expense_') or path.startswith('unmark_expense_') or \
+       path.startswith('export_') or path.startswith('admin/users/'):
+        # Let Flask handle these with their specific route handlers
+        return current_app.send_static_file('404.html') if os.path.exists(os.path.join(current_app.static_folder, '404.html')) else ('Not Found', 404)
+
+    frontend_dist = os.path.join(current_app.config.get('BASE_DIR', current_app.root_path), 'frontend', 'dist')
+
+    if not os.path.exists(frontend_dist):
+        logging.warning("Frontend dist folder not found. Please run 'npm run build' in the frontend directory.")
+        return jsonify({
+            'error': 'Frontend not built',
+            'message': 'Please run npm run build in the frontend directory'
+        }), 503
+
+    # Serve static assets (JS, CSS, images with extensions)
+    if path and '.' in path.split('/')[-1]:
+        file_path = os.path.join(frontend_dist, path)
+        if os.path.isfile(file_path):
+            return send_from_directory(frontend_dist, path)
+
+    # For all other paths, serve index.html (React Router handles routing)
+    try:
+        return send_from_directory(frontend_dist, 'index.html')
+    except Exception as e:
+        logging.error(f"Error serving index.html: {str(e)}")
+        return f"Error loading application: {str(e)}", 500
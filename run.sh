@@ -33,6 +33,9 @@ echo "⚙️ Configuring environment variables..."
 export FLASK_APP=app.py
 export FLASK_ENV=development
 
+# Create tables and seed defaults (no longer done on import)
+flask init-db
+
 # Start Flask application
 echo "🌟 Starting Flask application..."
 echo "Access the application at https://localhost:5000"
@@ -0,0 +1,227 @@
+"""Expense attachments on top of services.file_storage.
+
+Every uploaded document gets an ExpenseAttachment row, looked up by its
+unique stored_name. Expense.<kind>_filename is mirrored to the latest file
+of each kind so existing clients, exports and email templates keep working.
+content_hash is indexed so a document already attached elsewhere can be found
+before and after submit. Only expenses the caller can view are named in
+those lookups, and a document can be attached by hash only by a user who
+uploaded it recently (BlobUpload) or can view an expense that has it.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from flask import current_app
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, BlobUpload, Expense, ExpenseAttachment, StoredFile, StoredBlob
+from services.file_storage import save_upload, link_blob, delete_file
+from services.year_archive import expense_source, get_expense
+
+logger = logging.getLogger(__name__)
+
+ATTACHMENT_KINDS = ('quote', 'invoice', 'receipt')
+
+
+def add_attachment(expense: Expense, kind: str, file, stored_name: str) -> ExpenseAttachment:
+    """Store an uploaded file and attach it to the expense (caller commits)."""
+    return _attach(expense, kind, save_upload(file, stored_name))
+
+
+def attach_blob(expense: Expense, kind: str, blob: StoredBlob, stored_name: str) -> ExpenseAttachment:
+    """Attach an already stored document by its blob, without a new upload (caller commits)."""
+    return _attach(expense, kind, link_blob(blob, stored_name))
+
+
+def _attach(expense: Expense, kind: str, stored: StoredFile) -> ExpenseAttachment:
+    stored_name = stored.name
+    attachment = ExpenseAttachment(
+        kind=kind,
+        stored_name=stored_name,
+        content_hash=stored.content_hash,
+        size=stored.size,
+        mime_type=stored.mime_type,
+    )
+    expense.attachments.append(attachment)
+    setattr(expense, f'{kind}_filename', stored_name)
+    return attachment
+
+
+def _refresh_legacy_column(expense: Expense, kind: str) -> None:
+    remaining = [a for a in expense.attachments if a.kind == kind]
+    setattr(expense, f'{kind}_filename', remaining[-1].stored_name if remaining else None)
+
+
+def remove_attachment(expense: Expense, attachment: ExpenseAttachment) -> None:
+    delete_file(attachment.stored_name)
+    expense.attachments.remove(attachment)
+    _refresh_legacy_column(expense, attachment.kind)
+
+
+def remove_attachments(expense: Expense, kind: str) -> None:
+    """Remove every attachment of a kind, including a legacy-only file."""
+    legacy_name = getattr(expense, f'{kind}_filename')
+    for attachment in [a for a in expense.attachments if a.kind == kind]:
+        remove_attachment(expense, attachment)
+    if legacy_name and not any(a.stored_name == legacy_name for a in expense.attachments):
+        delete_file(legacy_name)
+    setattr(expense, f'{kind}_filename', None)
+
+
+def find_attachment(stored_name: str) -> Optional[ExpenseAttachment]:
+    """Single probe of the unique stored_name index."""
+    return ExpenseAttachment.query.filter_by(stored_name=stored_name).first()
+
+
+def find_attachments_by_hash(hashes: Iterable[str],
+                             exclude_expense_id: Optional[int] = None) -> Dict[str, List[ExpenseAttachment]]:
+    """Earlier attachments with the given content hashes, oldest first."""
+    hashes = {h.lower() for h in hashes if h}
+    if not hashes:
+        return {}
+    query = ExpenseAttachment.query.filter(ExpenseAttachment.content_hash.in_(hashes))
+    if exclude_expense_id is not None:
+        query = query.filter(ExpenseAttachment.expense_id != exclude_expense_id)
+    matches: Dict[str, List[ExpenseAttachment]] = {}
+    for attachment in query.order_by(ExpenseAttachment.id):
+        matches.setdefault(attachment.content_hash, []).append(attachment)
+    return matches
+
+
+def attachment_expense(attachment: ExpenseAttachment) -> Optional[Expense]:
+    """The expense an attachment belongs to, also when its year is archived
+    (then loaded read-only from expense_archive)."""
+    if attachment.expense is not None:
+        return attachment.expense
+    return get_expense(attachment.expense_id, include_archived=True)
+
+
+def can_view_expense(user, expense: Expense) -> bool:
+    return (
+        user.is_admin or
+        user.is_manager or
+        user.is_accounting or
+        expense.user_id == user.id
+    )
+
+
+def visible_expense_ids(user, attachments: Iterable[ExpenseAttachment]) -> List[int]:
+    """Ids of the attachments' expenses that `user` may see."""
+    visible = set()
+    for attachment in attachments:
+        expense = attachment_expense(attachment)
+        if expense is not None and can_view_expense(user, expense):
+            visible.add(attachment.expense_id)
+    return sorted(visible)
+
+
+def record_upload(user_id: int, content_hash: str) -> None:
+    """Note that the user sent this document's bytes (caller commits)."""
+    content_hash = content_hash.lower()
+    touched = db.session.execute(
+        update(BlobUpload)
+        .where(BlobUpload.user_id == user_id, BlobUpload.content_hash == content_hash)
+        .values(uploaded_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not touched:
+        try:
+            with db.session.begin_nested():
+                db.session.add(BlobUpload(user_id=user_id, content_hash=content_hash))
+        except IntegrityError:
+            # A concurrent request of the same user recorded it first
+            pass
+
+
+def attachable_hashes(user, hashes: Iterable[str]) -> Set[str]:
+    """The hashes `user` may attach by reference instead of uploading:
+    documents they uploaded within BLOB_GC_GRACE_HOURS, or that are attached
+    to an expense they can view."""
+    hashes = {h.lower() for h in hashes if h}
+    if not hashes:
+        return set()
+    cutoff = datetime.utcnow() - timedelta(hours=current_app.config['BLOB_GC_GRACE_HOURS'])
+    allowed = set(db.session.execute(
+        select(BlobUpload.content_hash).where(
+            BlobUpload.user_id == user.id,
+            BlobUpload.content_hash.in_(hashes),
+            BlobUpload.uploaded_at >= cutoff,
+        )
+    ).scalars())
+    for content_hash, attachments in find_attachments_by_hash(hashes - allowed).items():
+        if visible_expense_ids(user, attachments):
+            allowed.add(content_hash)
+    return allowed
+
+
+def duplicate_warnings(expense: Expense, user) -> List[dict]:
+    """One warning per attachment whose document is already on another
+    expense; only expenses `user` can view are named."""
+    matches = find_attachments_by_hash((a.content_hash for a in expense.attachments), expense.id)
+    warnings = []
+    for attachment in expense.attachments:
+        earlier = matches.get(attachment.content_hash)
+        if not earlier:
+            continue
+        expense_ids = visible_expense_ids(user, earlier)
+        warnings.append({
+            'kind': attachment.kind,
+            'filename': attachment.stored_name,
+            'expense_ids': expense_ids,
+            'message': (f"This {attachment.kind} was already submitted on expense "
+                        + ', '.join(f"#{i}" for i in expense_ids)) if expense_ids
+                       else f"This {attachment.kind} was already submitted on another expense"
+        })
+    return warnings
+
+
+def delete_orphaned_attachments(dry_run: bool = False) -> int:
+    """Remove attachments whose expense is in neither expense nor expense_archive.
+
+    Once expense is partitioned, expense_attachment.expense_id has no
+    foreign key, and only ORM deletes cascade to attachments. Rows left
+    behind by Core or raw SQL deletes are removed here. Their stored files
+    drop a blob reference, so `flask storage-gc` can reclaim the bytes.
+    """
+    source = expense_source(include_archived=True)
+    orphaned = ExpenseAttachment.query.filter(
+        ~select(source.id).where(source.id == ExpenseAttachment.expense_id).exists()
+    )
+    if dry_run:
+        return orphaned.count()
+    attachments = orphaned.all()
+    for attachment in attachments:
+        delete_file(attachment.stored_name)
+        db.session.delete(attachment)
+    db.session.commit()
+    if attachments:
+        logger.warning(f"Deleted {len(attachments)} attachment(s) of expenses that no longer exist")
+    return len(attachments)
+
+
+def serialize_attachments(expense: Expense) -> List[dict]:
+    return [{
+        'id': a.id,
+        'kind': a.kind,
+        'filename': a.stored_name,
+        'size': a.size,
+        'mime_type': a.mime_type,
+        'created_at': a.created_at
+    } for a in expense.attachments]
+
+
+def sync_attachment_metadata() -> int:
+    """Copy size/mime/hash from stored_file onto attachments missing them."""
+    result = db.session.execute(
+        update(ExpenseAttachment)
+        .where(ExpenseAttachment.stored_name == StoredFile.name)
+        .where(ExpenseAttachment.content_hash.is_(None))
+        .values(content_hash=StoredFile.content_hash,
+                size=StoredFile.size,
+                mime_type=StoredFile.mime_type)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
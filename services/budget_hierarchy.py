@@ -0,0 +1,159 @@
+"""Per-budget-year index of the Department > Category > Subcategory tree.
+
+Moving expenses between budget years matches subcategories by lineage
+(falling back to their name path for rows that were never rolled over).
+Rather than walking the tree with a query per node, each year's
+hierarchy is loaded with one joined query and kept in a per-process cache.
+Structure changes made through the ORM invalidate the cache via mapper
+events; set-based changes call invalidate_hierarchy() explicitly, and other
+workers pick changes up within HIERARCHY_TTL_SECONDS.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from models import db, BudgetYear, Department, Category, Subcategory
+
+logger = logging.getLogger(__name__)
+
+HIERARCHY_TTL_SECONDS = 120
+
+SubcategoryPath = namedtuple('SubcategoryPath', [
+    'subcategory_id', 'subcategory_name',
+    'category_id', 'category_name',
+    'department_id', 'department_name',
+    'year_id',
+    'subcategory_lineage_id', 'category_lineage_id',
+])
+
+
+def format_path(path: SubcategoryPath) -> str:
+    return f"{path.department_name} > {path.category_name} > {path.subcategory_name}"
+
+
+def assign_subcategory(expense, path: SubcategoryPath) -> None:
+    """Point an expense at a subcategory, filling its denormalized placement
+    from the already-loaded path instead of a lookup at flush time."""
+    expense.subcategory_id = path.subcategory_id
+    expense.category_id = path.category_id
+    expense.department_id = path.department_id
+    expense.budget_year_id = path.year_id
+
+
+class YearHierarchy:
+    """Lineage, name-path and id lookups for every subcategory in one budget year."""
+
+    def __init__(self, year_id: Optional[int], paths: List[SubcategoryPath]):
+        self.year_id = year_id
+        # Ordered by department, category, subcategory name
+        self.paths = paths
+        self.by_id: Dict[int, SubcategoryPath] = {p.subcategory_id: p for p in paths}
+        self.by_name_path: Dict[Tuple[str, str, str], int] = {}
+        self.by_category_path: Dict[Tuple[str, str], List[SubcategoryPath]] = {}
+        self.by_lineage: Dict[int, SubcategoryPath] = {}
+        self.by_category_lineage: Dict[int, List[SubcategoryPath]] = {}
+        for p in paths:
+            # Keep the first id if names are duplicated, as .first() did
+            self.by_name_path.setdefault((p.department_name, p.category_name, p.subcategory_name), p.subcategory_id)
+            self.by_category_path.setdefault((p.department_name, p.category_name), []).append(p)
+            self.by_lineage.setdefault(p.subcategory_lineage_id, p)
+            self.by_category_lineage.setdefault(p.category_lineage_id, []).append(p)
+
+    def find_exact(self, department_name: str, category_name: str, subcategory_name: str) -> Optional[SubcategoryPath]:
+        sub_id = self.by_name_path.get((department_name, category_name, subcategory_name))
+        return self.by_id[sub_id] if sub_id is not None else None
+
+    def find_match(self, source: SubcategoryPath) -> Optional[SubcategoryPath]:
+        """The source subcategory's lineage in this year, else its name path."""
+        return self.by_lineage.get(source.subcategory_lineage_id) or self.find_exact(
+            source.department_name, source.category_name, source.subcategory_name
+        )
+
+    def suggestions_for(self, source: SubcategoryPath, limit: int = 20) -> List[SubcategoryPath]:
+        """Subcategories of the source's category in this year, else the whole year."""
+        same_category = (self.by_category_lineage.get(source.category_lineage_id)
+                         or self.by_category_path.get((source.department_name, source.category_name)))
+        return (same_category or self.paths)[:limit]
+
+
+_lock = threading.Lock()
+_cache: Dict[Optional[int], Tuple[float, YearHierarchy]] = {}
+
+
+def _path_query():
+    return db.session.query(
+        Subcategory.id, Subcategory.name,
+        Category.id, Category.name,
+        Department.id, Department.name,
+        Department.year_id,
+        Subcategory.lineage_id, Category.lineage_id,
+    ).join(Category, Subcategory.category_id == Category.id) \
+     .join(Department, Category.department_id == Department.id)
+
+
+def get_year_hierarchy(year_id: Optional[int]) -> YearHierarchy:
+    """Return the (cached) hierarchy index for a budget year."""
+    entry = _cache.get(year_id)
+    if entry and time.monotonic() - entry[0] < HIERARCHY_TTL_SECONDS:
+        return entry[1]
+
+    rows = _path_query().filter(Department.year_id == year_id) \
+        .order_by(Department.name, Category.name, Subcategory.name).all()
+    hierarchy = YearHierarchy(year_id, [SubcategoryPath(*row) for row in rows])
+    with _lock:
+        _cache[year_id] = (time.monotonic(), hierarchy)
+    return hierarchy
+
+
+def get_subcategory_paths(subcategory_ids: Iterable[int]) -> Dict[int, SubcategoryPath]:
+    """Full paths for specific subcategories (any year) in one query."""
+    ids = set(subcategory_ids)
+    if not ids:
+        return {}
+    rows = _path_query().filter(Subcategory.id.in_(ids)).all()
+    return {row[0]: SubcategoryPath(*row) for row in rows}
+
+
+def get_year_summaries(year_ids: Iterable[Optional[int]]) -> Dict[int, BudgetYear]:
+    ids = {y for y in year_ids if y is not None}
+    if not ids:
+        return {}
+    return {y.id: y for y in BudgetYear.query.filter(BudgetYear.id.in_(ids)).all()}
+
+
+def invalidate_hierarchy(year_id: Optional[int] = None) -> None:
+    """Drop one year's cached hierarchy, or all of them."""
+    with _lock:
+        if year_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(year_id, None)
+
+
+def _note_structure_change(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info['budget_hierarchy_dirty'] = True
+
+
+def _invalidate_after_commit(session):
+    # Invalidate only once the change is visible to other sessions; clearing
+    # at flush time would let a concurrent request re-cache the old tree
+    if session.info.pop('budget_hierarchy_dirty', False):
+        invalidate_hierarchy()
+
+
+def _discard_after_rollback(session):
+    session.info.pop('budget_hierarchy_dirty', None)
+
+
+for _model in (Department, Category, Subcategory):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _note_structure_change)
+event.listen(Session, 'after_commit', _invalidate_after_commit)
+event.listen(Session, 'after_rollback', _discard_after_rollback)
@@ -0,0 +1,43 @@
+"""Cached lookup of the current BudgetYear.
+
+Almost every form/filter endpoint scopes its queries to the current budget
+year, which changes a handful of times a year. The id is cached per process
+for a short TTL; the worker that flips `is_current` invalidates its own copy
+immediately and other workers pick the change up within the TTL.
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+from models import BudgetYear
+
+logger = logging.getLogger(__name__)
+
+CURRENT_YEAR_TTL_SECONDS = 60
+
+_lock = threading.Lock()
+_current_year_id: Optional[int] = None
+_loaded_at = 0.0
+
+
+def get_current_year_id() -> Optional[int]:
+    """Return the id of the BudgetYear flagged is_current, or None."""
+    global _current_year_id, _loaded_at
+    if _loaded_at and time.monotonic() - _loaded_at < CURRENT_YEAR_TTL_SECONDS:
+        return _current_year_id
+
+    with _lock:
+        if _loaded_at and time.monotonic() - _loaded_at < CURRENT_YEAR_TTL_SECONDS:
+            return _current_year_id
+        row = BudgetYear.query.with_entities(BudgetYear.id).filter_by(is_current=True).first()
+        _current_year_id = row.id if row else None
+        _loaded_at = time.monotonic()
+        return _current_year_id
+
+
+def invalidate_current_year() -> None:
+    """Drop the cached id; call after changing which year is current."""
+    global _loaded_at
+    with _lock:
+        _loaded_at = 0.0
@@ -0,0 +1,73 @@
+"""gzip/brotli compression of responses.
+
+An after_request hook compresses successful responses whose mimetype is in
+COMPRESS_MIMETYPES and whose body is at least COMPRESS_MIN_SIZE bytes,
+using brotli when the client accepts it and the brotli package is
+installed, gzip otherwise. Files sent with send_file (direct passthrough)
+and streamed responses are left alone: documents are already compressed
+and the thumbnails are JPEGs.
+"""
+import gzip
+import logging
+from typing import Optional
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - gzip only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+def compress(data: bytes, encoding: str) -> Optional[bytes]:
+    """Compress with 'br' or 'gzip'; None if that encoding is unavailable."""
+    if encoding == 'br':
+        if brotli is None:
+            return None
+        return brotli.compress(data, quality=current_app.config['COMPRESS_BR_QUALITY'])
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=current_app.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+    return None
+
+
+def _negotiate() -> Optional[str]:
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    config = current_app.config
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in config['COMPRESS_MIMETYPES']):
+        return response
+
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate()
+    if encoding is None:
+        return response
+
+    response.set_data(compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    # The compressed body is a different representation of the same content
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_compression(app) -> None:
+    if app.config.get('COMPRESS_ENABLED', True):
+        app.after_request(compress_response)
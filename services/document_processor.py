@@ -1,13 +1,17 @@
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
 import os
 import hashlib
 import logging
+import threading
+import time
+from collections import OrderedDict
 from functools import lru_cache
-from dotenv import load_dotenv
 from datetime import datetime
 
-load_dotenv()
+from services.ocr_preprocess import prepare_for_ocr
+
+# Extracted results kept per process (documents are re-OCR'd on upload retries)
+RESULT_CACHE_SIZE = 128
+
 
 class DocumentProcessor:
     def __init__(self):
@@ -21,6 +25,10 @@ class DocumentProcessor:
             self.document_analysis_client = None
         else:
             try:
+                # The Azure SDK is slow to import; load it only once OCR is used
+                from azure.ai.formrecognizer import DocumentAnalysisClient
+                from azure.core.credentials import AzureKeyCredential
+
                 self.document_analysis_client = DocumentAnalysisClient(
                     endpoint=endpoint, 
                     credential=AzureKeyCredential(key)
@@ -32,6 +40,10 @@ class DocumentProcessor:
                 logging.error(f"Failed to initialize Azure Form Recognizer: {e}")
                 self.document_analysis_client = None
         
+        # Extracted results by content hash, oldest first
+        self._results = OrderedDict()
+        self._results_lock = threading.Lock()
+
         # Mapping of document types to their field names for amount and date
         self.field_mappings = {
             "prebuilt-invoice": {
@@ -137,33 +149,61 @@ class DocumentProcessor:
 
         return None
     
-    def _calculate_file_hash(self, file_path):
-        """Calculate a hash for the file to use as a cache key"""
-        hash_md5 = hashlib.md5()
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    
-    # Cache the document processing results to avoid redundant API calls
-    @lru_cache(maxsize=128)
-    def _process_document_with_cache(self, file_hash, doc_type):
-        """Process document with caching based on file hash"""
-        # This is a placeholder function that will be used with the cache decorator
-        # The actual implementation is in process_document
-        pass
-
-    def process_document(self, document_path):
+    def _extract_fields(self, doc, fields):
+        """Amount, purchase date (ISO string) and currency of one analyzed document."""
+        logging.info(f"DocumentProcessor: Document fields: {list(doc.fields.keys())}")
+
+        # Extract date
+        date_field = doc.fields.get(fields["date"])
+        date_value = date_field.value if date_field else None
+        logging.info(f"DocumentProcessor: Date field ({fields['date']}): {date_value}")
+
+        # Extract amount and convert to float
+        amount_field = doc.fields.get(fields["amount"])
+        amount_value = self._extract_amount(amount_field.value if amount_field else None)
+        logging.info(f"DocumentProcessor: Amount field ({fields['amount']}): {amount_value}")
+
+        # Extract currency from DocumentField
+        currency_value = self._extract_currency(amount_field if amount_field else None)
+        logging.info(f"DocumentProcessor: Currency: {currency_value}")
+
+        # Convert date to ISO format string for JSON serialization
+        date_str = None
+        if date_value:
+            if hasattr(date_value, 'isoformat'):
+                date_str = date_value.isoformat()
+            else:
+                date_str = str(date_value)
+
+        return {
+            "purchase_date": date_str,
+            "amount": amount_value,
+            "currency": currency_value
+        }
+
+    def _cache_result(self, file_hash, result):
+        with self._results_lock:
+            self._results[file_hash] = result
+            while len(self._results) > RESULT_CACHE_SIZE:
+                self._results.popitem(last=False)
+
+    def process_document(self, document, content_hash=None):
         """
         Process any supported document type and extract amount and purchase date
         
         Args:
-            document_path (str): Path to the document file
+            document (bytes or str): Document contents, or a path to the document file
+            content_hash (str): sha256 of the contents if the caller already has it
             
         Returns:
             dict: Extracted document information with amount and purchase date
         """
-        logging.info(f"DocumentProcessor: Starting to process {document_path}")
+        if isinstance(document, str):
+            logging.info(f"DocumentProcessor: Starting to process {document}")
+            with open(document, "rb") as f:
+                document = f.read()
+        else:
+            logging.info(f"DocumentProcessor: Starting to process {len(document)} byte document")
         
         # Check if Azure Form Recognizer is available
         if self.document_analysis_client is None:
@@ -178,67 +218,48 @@ class DocumentProcessor:
             }
             
         try:
-            # Calculate file hash for caching
-            file_hash = self._calculate_file_hash(document_path)
+            # The content hash is the cache key; uploads arrive with it precomputed
+            file_hash = content_hash or hashlib.sha256(document).hexdigest()
             logging.info(f"DocumentProcessor: File hash: {file_hash}")
-            
-            # Try each document type until we get valid results
+
+            cached_result = self._results.get(file_hash)
+            if cached_result:
+                logging.info("DocumentProcessor: Using cached result")
+                return cached_result
+
+            document, prep = prepare_for_ocr(document)
+            logging.info(
+                f"DocumentProcessor: Pre-processing ({prep['action']}) "
+                f"{prep['original_bytes']} -> {prep['bytes']} bytes "
+                f"(saved {prep['original_bytes'] - prep['bytes']}) in {prep['preprocess_ms']}ms"
+            )
+
+            # Try each document type until we get valid results; every attempt
+            # sends the same in-memory bytes
             for doc_type, fields in self.field_mappings.items():
                 try:
                     logging.info(f"DocumentProcessor: Trying doc_type: {doc_type}")
-                    
-                    # Check if we have this result cached
-                    cache_key = f"{file_hash}_{doc_type}"
-                    cached_result = getattr(self, f"_cached_{cache_key}", None)
-                    
-                    if cached_result:
-                        logging.info(f"DocumentProcessor: Using cached result for {doc_type}")
-                        return cached_result
-                    
-                    with open(document_path, "rb") as f:
-                        poller = self.document_analysis_client.begin_analyze_document(
-                            doc_type, document=f
-                        )
+
+                    analyze_start = time.perf_counter()
+                    poller = self.document_analysis_client.begin_analyze_document(
+                        doc_type, document=document
+                    )
                     result = poller.result()
+                    logging.info(
+                        f"DocumentProcessor: {doc_type} analyzed {prep['bytes']} bytes "
+                        f"({prep['action']}) in {(time.perf_counter() - analyze_start) * 1000:.0f}ms"
+                    )
                     logging.info(f"DocumentProcessor: Azure returned {len(result.documents) if result.documents else 0} documents")
 
                     # If we got any documents, process them
                     if result.documents:
-                        doc = result.documents[0]
-                        logging.info(f"DocumentProcessor: Document fields: {list(doc.fields.keys())}")
-                        
-                        # Extract date
-                        date_field = doc.fields.get(fields["date"])
-                        date_value = date_field.value if date_field else None
-                        logging.info(f"DocumentProcessor: Date field ({fields['date']}): {date_value}")
-                        
-                        # Extract amount and convert to float
-                        amount_field = doc.fields.get(fields["amount"])
-                        amount_value = self._extract_amount(amount_field.value if amount_field else None)
-                        logging.info(f"DocumentProcessor: Amount field ({fields['amount']}): {amount_value}")
-
-                        # Extract currency from DocumentField
-                        currency_value = self._extract_currency(amount_field if amount_field else None)
-                        logging.info(f"DocumentProcessor: Currency: {currency_value}")
+                        result = self._extract_fields(result.documents[0], fields)
 
                         # If we found either date or amount, return the results
-                        if date_value or amount_value:
-                            # Convert date to ISO format string for JSON serialization
-                            date_str = None
-                            if date_value:
-                                if hasattr(date_value, 'isoformat'):
-                                    date_str = date_value.isoformat()
-                                else:
-                                    date_str = str(date_value)
-
-                            result = {
-                                "purchase_date": date_str,
-                                "amount": amount_value,
-                                "currency": currency_value
-                            }
+                        if result["purchase_date"] or result["amount"]:
                             logging.info(f"DocumentProcessor: Success! Returning: {result}")
                             # Cache the result
-                            setattr(self, f"_cached_{cache_key}", result)
+                            self._cache_result(file_hash, result)
                             return result
                         else:
                             logging.info(f"DocumentProcessor: No date or amount found for {doc_type}")
@@ -257,3 +278,73 @@ class DocumentProcessor:
         except Exception as e:
             logging.error(f"DocumentProcessor: Fatal error: {str(e)}")
             raise Exception(f"Error processing document: {str(e)}")
+
+    def process_batch(self, document, content_hash=None, doc_type="prebuilt-receipt"):
+        """
+        Extract every document found in one file (e.g. a scan of several receipts)
+        with a single analysis call
+
+        Args:
+            document (bytes): File contents
+            content_hash (str): sha256 of the contents if the caller already has it
+            doc_type (str): Model to run, one of field_mappings
+
+        Returns:
+            dict: {'documents': [...]} with 1-based page ranges, amount, purchase
+            date, currency and confidence per detected document
+        """
+        if self.document_analysis_client is None:
+            logging.warning("Batch processing skipped: Azure Form Recognizer not configured")
+            return {'documents': [], 'processing_status': 'skipped_no_service'}
+
+        fields = self.field_mappings[doc_type]
+        file_hash = content_hash or hashlib.sha256(document).hexdigest()
+        cache_key = f"{file_hash}:batch:{doc_type}"
+        cached_result = self._results.get(cache_key)
+        if cached_result:
+            logging.info("DocumentProcessor: Using cached batch result")
+            return cached_result
+
+        try:
+            # Every page is needed, so PDFs are not trimmed here
+            payload, prep = prepare_for_ocr(document, whole_document=True)
+            analyze_start = time.perf_counter()
+            poller = self.document_analysis_client.begin_analyze_document(doc_type, document=payload)
+            result = poller.result()
+            logging.info(
+                f"DocumentProcessor: batch {doc_type} analyzed {prep['bytes']} bytes "
+                f"({prep['action']}) in {(time.perf_counter() - analyze_start) * 1000:.0f}ms, "
+                f"{len(result.documents or [])} documents"
+            )
+
+            documents = []
+            for index, doc in enumerate(result.documents or []):
+                pages = sorted({region.page_number for region in (doc.bounding_regions or [])})
+                documents.append({
+                    "index": index,
+                    "first_page": pages[0] if pages else None,
+                    "last_page": pages[-1] if pages else None,
+                    "confidence": doc.confidence,
+                    **self._extract_fields(doc, fields)
+                })
+
+            batch = {
+                "documents": documents,
+                "page_count": len(result.pages or [])
+            }
+            self._cache_result(cache_key, batch)
+            return batch
+
+        except Exception as e:
+            logging.error(f"DocumentProcessor: Batch error: {str(e)}")
+            raise Exception(f"Error processing document: {str(e)}")
+
+
+@lru_cache(maxsize=1)
+def get_document_processor():
+    """Return the shared DocumentProcessor, creating it on first OCR request.
+
+    Sharing one instance also lets its per-file result cache survive across
+    requests instead of being thrown away with a fresh processor each time.
+    """
+    return DocumentProcessor()
@@ -1,7 +1,8 @@
 import logging
 import requests
-from datetime import date, timedelta
-from models import db, ExchangeRateCache
+from datetime import date, datetime, timedelta
+from typing import Tuple
+from models import db, Expense, ExchangeRateCache
 
 logger = logging.getLogger(__name__)
 
@@ -57,6 +58,67 @@ def get_exchange_rate(currency: str, target_date: date) -> float:
     return rate
 
 
+def _rate_or_fallback(currency: str, on_date: date) -> float:
+    try:
+        return get_exchange_rate(currency, on_date)
+    except Exception as e:
+        logger.warning(f"Failed to get exchange rate for {currency}: {e}. Using amount as-is.")
+        return 1.0
+
+
+def convert_to_ils(amount: float, currency: str, on_date) -> Tuple[float, float]:
+    """Return (amount_ils, rate) for an expense amount.
+
+    If no rate can be found the amount is kept as-is with a rate of 1.0,
+    so amount_ils is never left empty.
+    """
+    if currency == 'ILS':
+        return amount, 1.0
+    if isinstance(on_date, datetime):
+        on_date = on_date.date()
+    rate = _rate_or_fallback(currency, on_date)
+    return round(amount * rate, 2), rate
+
+
+def backfill_amount_ils(batch_size: int = 500, dry_run: bool = False) -> dict:
+    """Fill amount_ils/exchange_rate on expenses that predate multi-currency.
+
+    Works through the rows in id order, one batch per commit. Each distinct
+    (currency, date) pair in a batch is resolved once via get_exchange_rate,
+    which caches historical rates in exchange_rate_cache.
+    """
+    stats = {'updated': 0, 'converted': 0, 'rates_resolved': 0}
+    last_id = 0
+    while True:
+        batch = Expense.query.filter(Expense.amount_ils.is_(None), Expense.id > last_id) \
+            .order_by(Expense.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+
+        # Resolve rates before touching the batch: get_exchange_rate commits
+        # whenever it caches a new rate
+        pairs = {(e.currency, e.date.date()) for e in batch if e.currency != 'ILS'}
+        rates = {pair: _rate_or_fallback(*pair) for pair in pairs}
+        stats['rates_resolved'] += len(rates)
+
+        for expense in batch:
+            if expense.currency == 'ILS':
+                expense.amount_ils, expense.exchange_rate = expense.amount, 1.0
+            else:
+                rate = rates[(expense.currency, expense.date.date())]
+                expense.amount_ils, expense.exchange_rate = round(expense.amount * rate, 2), rate
+                stats['converted'] += 1
+            stats['updated'] += 1
+
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        logger.info(f"amount_ils backfill: {stats['updated']} expense(s) through id {last_id}")
+    return stats
+
+
 def _fetch_from_boi(currency: str, target_date: date) -> float | None:
     """Fetch exchange rate from Bank of Israel SDMX API."""
     try:
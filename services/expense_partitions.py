@@ -0,0 +1,98 @@
+"""Budget-year partitions of the expense table.
+
+On Postgres, migration l2m3n4o5p6q7 turns `expense` into a table LIST
+partitioned on budget_year_id: one partition per budget year
+(expense_y<year id>) plus a DEFAULT partition, expense_default, for
+expenses whose department has no year. Queries that filter on
+Expense.budget_year_id only touch that year's partition.
+
+The parent has no primary key: Postgres requires it to include the
+partition key, which may be NULL. Every partition instead gets its own
+PRIMARY KEY (id), which does not stop two partitions (or expense and
+expense_archive) from holding the same id. Uniqueness across the table
+therefore rests only on every id coming from the single expense_id_seq;
+never insert expenses with explicit ids.
+
+For the same reason expense_attachment.expense_id has no foreign key.
+Deleting an expense through the ORM still cascades to its attachments;
+attachments orphaned by Core or raw SQL deletes are removed by
+`flask storage-gc` (services.attachments.delete_orphaned_attachments).
+"""
+import json
+import logging
+from typing import List
+
+from sqlalchemy import text
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION = 'expense_default'
+
+
+def partition_name(year_id: int) -> str:
+    return f'expense_y{int(year_id)}'
+
+
+def is_partitioned() -> bool:
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('expense')
+        )
+    """)).scalar()
+
+
+def ensure_expense_partition(year_id: int) -> bool:
+    """Create the partition for a budget year if it is missing.
+
+    Runs in the caller's transaction, so a year and its partition are
+    committed together. Returns True if a partition was created.
+    """
+    if not is_partitioned():
+        if db.session.get_bind().dialect.name == 'postgresql':
+            logger.warning(f"expense is not partitioned, so budget year {year_id} gets no partition; "
+                           f"partition it with `flask db stamp k1l2m3n4o5p6 && flask db upgrade`")
+        return False
+    name = partition_name(year_id)
+    if db.session.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {'name': name}).scalar():
+        return False
+    # The DEFAULT partition is checked for rows of this year, which would
+    # otherwise belong to the new partition
+    db.session.execute(text(
+        f"CREATE TABLE {name} PARTITION OF expense FOR VALUES IN ({int(year_id)})"
+    ))
+    db.session.execute(text(f"ALTER TABLE {name} ADD PRIMARY KEY (id)"))
+    logger.info(f"Created expense partition {name}")
+    return True
+
+
+def ensure_all_partitions() -> List[str]:
+    """Create missing partitions for every budget year."""
+    year_ids = db.session.execute(text("SELECT id FROM budget_year ORDER BY id")).scalars().all()
+    return [partition_name(year_id) for year_id in year_ids if ensure_expense_partition(year_id)]
+
+
+def scanned_partitions(query) -> List[str]:
+    """Partitions an ORM query reads, from its EXPLAIN plan.
+
+    Used to confirm partition pruning for the year-scoped endpoints.
+    """
+    statement = query.statement.compile(db.session.get_bind(), compile_kwargs={'literal_binds': True})
+    plan = db.session.execute(text(f"EXPLAIN (FORMAT JSON) {statement}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    found = []
+
+    def walk(node):
+        relation = node.get('Relation Name')
+        is_partition = relation == DEFAULT_PARTITION or (relation or '').startswith('expense_y')
+        if is_partition and relation not in found:
+            found.append(relation)
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return found
@@ -0,0 +1,164 @@
+"""Grouped expense reports computed in SQL.
+
+run_report() aggregates the expenses of a scope select() (the caller's
+access and filter conditions) by up to four dimensions in one GROUP BY
+GROUPING SETS statement, so detail rows, subtotals and the grand total come
+back together. Results are compact: rows are arrays in `dimensions +
+measures` order and dimension ids are resolved once in `labels`.
+Postgres only (GROUPING SETS, to_char).
+"""
+import logging
+from collections import namedtuple
+from itertools import combinations
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import func, literal_column, tuple_
+from sqlalchemy.orm import aliased
+
+from models import db, Category, Department, Expense, Subcategory, Supplier, User
+
+logger = logging.getLogger(__name__)
+
+MAX_DIMENSIONS = 4
+# totals=all groups by every subset of the dimensions: 2**n grouping sets
+MAX_CUBE_DIMENSIONS = 3
+
+# key: the grouped value; label: shown for it, grouped alongside; join: the
+# (alias, foreign key) the label comes from. Constants are inlined with
+# literal_column so the SELECT and GROUP BY expressions are textually identical.
+Dimension = namedtuple('Dimension', ['key', 'label', 'join'])
+
+_department = aliased(Department, name='report_department')
+_category = aliased(Category, name='report_category')
+_subcategory = aliased(Subcategory, name='report_subcategory')
+_user = aliased(User, name='report_user')
+_supplier = aliased(Supplier, name='report_supplier')
+
+
+def _dimensions(source) -> Dict[str, Dimension]:
+    return {
+        'department': Dimension(source.department_id, _department.name, (_department, source.department_id)),
+        'category': Dimension(source.category_id, _category.name, (_category, source.category_id)),
+        'subcategory': Dimension(source.subcategory_id, _subcategory.name, (_subcategory, source.subcategory_id)),
+        'user': Dimension(source.user_id, func.concat_ws(literal_column("' '"), _user.first_name, _user.last_name),
+                          (_user, source.user_id)),
+        'supplier': Dimension(source.supplier_id, _supplier.name, (_supplier, source.supplier_id)),
+        'month': Dimension(func.to_char(source.date, literal_column("'YYYY-MM'")), None, None),
+        'currency': Dimension(source.currency, None, None),
+        'status': Dimension(source.status, None, None),
+    }
+
+
+def _measures(source) -> dict:
+    return {
+        'count': func.count(source.id),
+        'sum_ils': func.sum(source.amount_ils),
+        'avg_ils': func.avg(source.amount_ils),
+    }
+
+
+DIMENSIONS = _dimensions(Expense)
+MEASURES = _measures(Expense)
+
+TOTALS = ('rollup', 'all', 'none')
+
+
+class ReportError(ValueError):
+    """The requested dimensions, measures or totals are not supported."""
+
+
+def parse_names(value: Optional[str], allowed: Dict, kind: str) -> List[str]:
+    names = [name.strip() for name in (value or '').split(',') if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ReportError(f"Unknown {kind}: {', '.join(unknown)}. Available: {', '.join(allowed)}")
+    if len(set(names)) != len(names):
+        raise ReportError(f"Duplicate {kind}")
+    return names
+
+
+def _grouping_sets(dimensions: Sequence[str], totals: str) -> List[tuple]:
+    if totals == 'none':
+        return [tuple(dimensions)]
+    if totals == 'rollup':
+        return [tuple(dimensions[:n]) for n in range(len(dimensions), -1, -1)]
+    return [subset for n in range(len(dimensions), -1, -1) for subset in combinations(dimensions, n)]
+
+
+def _number(value):
+    return round(float(value), 2) if value is not None else None
+
+
+def run_report(scope, dimensions: Sequence[str], measures: Sequence[str], totals: str = 'rollup',
+               source=Expense) -> dict:
+    """Aggregate the expenses selected by `scope`, a select() over `source`
+    (Expense, or expense_source(True) to include archived years) carrying the
+    caller's access and filter conditions."""
+    if not dimensions:
+        raise ReportError('At least one dimension is required')
+    if len(dimensions) > MAX_DIMENSIONS:
+        raise ReportError(f'At most {MAX_DIMENSIONS} dimensions')
+    if totals not in TOTALS:
+        raise ReportError(f"totals must be one of: {', '.join(TOTALS)}")
+    if totals == 'all' and len(dimensions) > MAX_CUBE_DIMENSIONS:
+        raise ReportError(f'totals=all supports at most {MAX_CUBE_DIMENSIONS} dimensions')
+    measures = list(measures) or ['count', 'sum_ils']
+    dimension_map = DIMENSIONS if source is Expense else _dimensions(source)
+    measure_map = MEASURES if source is Expense else _measures(source)
+
+    statement = scope
+    for name in dimensions:
+        join = dimension_map[name].join
+        if join is not None:
+            target, foreign_key = join
+            statement = statement.outerjoin(target, foreign_key == target.id)
+
+    def group_columns(names):
+        columns = []
+        for name in names:
+            dimension = dimension_map[name]
+            columns.append(dimension.key)
+            if dimension.label is not None:
+                columns.append(dimension.label)
+        return columns
+
+    keys = [dimension_map[name].key for name in dimensions]
+    columns = [dimension_map[name].key.label(name) for name in dimensions]
+    columns += [dimension_map[name].label.label(f'{name}__label')
+                for name in dimensions if dimension_map[name].label is not None]
+    columns += [measure_map[name].label(name) for name in measures]
+    # Bit i (from the left) is set when dimension i is rolled up in the row
+    columns.append(func.grouping(*keys).label('grouping_id'))
+
+    sets = _grouping_sets(list(dimensions), totals)
+    statement = statement.with_only_columns(*columns).group_by(
+        func.grouping_sets(*[tuple_(*group_columns(s)) for s in sets])
+    )
+
+    width = len(dimensions)
+    set_by_mask = {}
+    for s in sets:
+        mask = sum(1 << (width - 1 - i) for i, name in enumerate(dimensions) if name not in s)
+        set_by_mask[mask] = s
+
+    result = {
+        'dimensions': list(dimensions),
+        'measures': measures,
+        'rows': [],
+        'subtotals': {','.join(s): [] for s in sets if 0 < len(s) < width},
+        'total': None,
+        'labels': {name: {} for name in dimensions if dimension_map[name].label is not None},
+    }
+    for row in db.session.execute(statement).mappings():
+        grouped = set_by_mask[row['grouping_id']]
+        values = [_number(row[m]) if m != 'count' else row[m] for m in measures]
+        for name in grouped:
+            if name in result['labels'] and row[name] is not None:
+                result['labels'][name][row[name]] = row[f'{name}__label']
+        if len(grouped) == width:
+            result['rows'].append([row[name] for name in dimensions] + values)
+        elif grouped:
+            result['subtotals'][','.join(grouped)].append([row[name] for name in grouped] + values)
+        else:
+            result['total'] = values
+    return result
@@ -0,0 +1,460 @@
+"""Column-projected serializers for the expense list endpoints.
+
+A response shape is declared once as nested Fields and Groups, each reading
+columns of the expense or of a related row (submitter, supplier, ...).
+ExpenseShape.paginate() turns a filtered select() into one that selects
+exactly those columns, outer-joining only the related tables the shape
+uses, and builds the response dicts from the returned row mappings. Nothing
+is loaded into the session: no identity map, no relationship loading and no
+unused columns (supplier bank details, notes) per row.
+
+Clients narrow a shape with the fields= and include= query parameters
+(ExpenseShape.select()); only the chosen columns are selected and only the
+joins they need are made.
+
+`flask benchmark-serializers` compares a page built this way with the same
+page built from fully hydrated ORM objects.
+"""
+import logging
+import time
+import tracemalloc
+from statistics import median
+from typing import Callable, Dict, List, Optional, Union
+
+from flask_sqlalchemy.pagination import SelectPagination
+from sqlalchemy import func, select
+from sqlalchemy.orm import aliased
+
+from models import db, BudgetYear, Category, CreditCard, Department, Expense, Subcategory, Supplier, User
+from services.thumbnails import thumbnail_url
+
+logger = logging.getLogger(__name__)
+
+EXPENSE = 'expense'
+
+# Join name -> (model, parent join, foreign key column on the parent)
+_JOINS = {
+    'submitter': (User, EXPENSE, 'user_id'),
+    'submitter_department': (Department, 'submitter', 'department_id'),
+    'handler': (User, EXPENSE, 'manager_id'),
+    'paid_by': (User, EXPENSE, 'paid_by_id'),
+    'external_accounting_entry_by': (User, EXPENSE, 'external_accounting_entry_by_id'),
+    'subcategory': (Subcategory, EXPENSE, 'subcategory_id'),
+    'subcategory_category': (Category, 'subcategory', 'category_id'),
+    'subcategory_department': (Department, 'subcategory_category', 'department_id'),
+    'category': (Category, EXPENSE, 'category_id'),
+    'department': (Department, EXPENSE, 'department_id'),
+    'budget_year': (BudgetYear, EXPENSE, 'budget_year_id'),
+    'supplier': (Supplier, EXPENSE, 'supplier_id'),
+    'credit_card': (CreditCard, EXPENSE, 'credit_card_id'),
+}
+
+
+class Field:
+    """A response value read from one or more columns.
+
+    The columns belong to `join` (default: the enclosing Group's join, or
+    the expense itself); `fmt` receives their values and returns the value
+    to serialize. Without it the single column is returned as-is.
+    """
+
+    def __init__(self, *columns: str, join: Optional[str] = None, fmt: Optional[Callable] = None):
+        self.columns = columns
+        self.join = join
+        self.fmt = fmt
+
+
+class Group:
+    """A nested object read from a join; None when the join found no row."""
+
+    def __init__(self, join: str, fields: Dict[str, Union[Field, 'Group']]):
+        self.join = join
+        self.fields = fields
+
+
+def full_name(first_name, last_name):
+    return f"{first_name} {last_name}".strip()
+
+
+def _thumbnail_urls(quote_filename, invoice_filename, receipt_filename):
+    # Same result as services.thumbnails.thumbnail_urls() for an Expense
+    filenames = (('quote', quote_filename), ('invoice', invoice_filename), ('receipt', receipt_filename))
+    return {kind: thumbnail_url(filename) for kind, filename in filenames if filename}
+
+
+def _label(join: str, column: str) -> str:
+    return f'{join}__{column}'
+
+
+class _RowPagination(SelectPagination):
+    """SelectPagination over column rows; counts the unprojected select."""
+
+    def _query_items(self) -> list:
+        statement = self._query_args['select'].limit(self.per_page).offset(self._query_offset)
+        return self._query_args['session'].execute(statement).mappings().all()
+
+    def _query_count(self) -> int:
+        # The unprojected select has none of the shape's outer joins
+        sub = self._query_args['count_select'].order_by(None).subquery()
+        return self._query_args['session'].execute(select(func.count()).select_from(sub)).scalar()
+
+
+class FieldSelectionError(ValueError):
+    """fields= or include= names something the endpoint does not serve."""
+
+
+# Narrowed shapes kept per full shape; clients only use a handful
+_MAX_SELECTIONS = 64
+
+
+def _names(value: Optional[str]) -> List[str]:
+    return [name.strip() for name in (value or '').split(',') if name.strip()]
+
+
+class ExpenseShape:
+    """A compiled response shape: the columns and joins it needs, and how to
+    assemble a dict from one row of them."""
+
+    def __init__(self, fields: Dict[str, Union[Field, Group]]):
+        self.fields = fields
+        self._columns: List[tuple] = []
+        self._joins: List[str] = []
+        self._nodes = self._compile(fields, EXPENSE)
+        # Built once: fresh aliases per request would defeat the SQL compilation cache
+        self._aliases = {name: aliased(_JOINS[name][0], name=name) for name in self._joins}
+        self.attributes = [key for key, field in fields.items() if not isinstance(field, Group)]
+        self.relations = [key for key, field in fields.items() if isinstance(field, Group)]
+        self._selections: Dict[tuple, 'ExpenseShape'] = {}
+
+    def _use_join(self, join: str) -> None:
+        if join == EXPENSE or join in self._joins:
+            return
+        self._use_join(_JOINS[join][1])
+        self._joins.append(join)
+
+    def _use_column(self, join: str, column: str) -> str:
+        self._use_join(join)
+        if (join, column) not in self._columns:
+            self._columns.append((join, column))
+        return _label(join, column)
+
+    def _compile(self, fields, default_join: str) -> list:
+        nodes = []
+        for key, field in fields.items():
+            if isinstance(field, Group):
+                id_label = self._use_column(field.join, 'id')
+                nodes.append((key, None, None, id_label, self._compile(field.fields, field.join)))
+            else:
+                join = field.join or default_join
+                labels = [self._use_column(join, column) for column in field.columns]
+                nodes.append((key, labels, field.fmt, None, None))
+        return nodes
+
+    def _join(self, statement, source, joined: Optional[dict]):
+        entities = {EXPENSE: source, **(joined or {})}
+        for name in self._joins:
+            if name in entities:
+                continue
+            _, parent, foreign_key = _JOINS[name]
+            target = self._aliases[name]
+            statement = statement.outerjoin(target, getattr(entities[parent], foreign_key) == target.id)
+            entities[name] = target
+        return statement, entities
+
+    def project(self, statement, source=Expense, joined: Optional[dict] = None):
+        """Select the shape's columns on top of `statement`, a filtered
+        select() over `source`. `joined` maps join names to entities the
+        statement already joins (e.g. {'submitter': User}) so they are
+        reused instead of joined twice."""
+        statement, entities = self._join(statement, source, joined)
+        columns = [getattr(entities[join], column).label(_label(join, column))
+                   for join, column in self._columns]
+        return statement.with_only_columns(*columns)
+
+    def _build(self, nodes, row) -> dict:
+        out = {}
+        for key, labels, fmt, id_label, children in nodes:
+            if children is not None:
+                out[key] = self._build(children, row) if row[id_label] is not None else None
+            elif fmt is not None:
+                out[key] = fmt(*[row[label] for label in labels])
+            else:
+                out[key] = row[labels[0]]
+        return out
+
+    def serialize(self, rows) -> List[dict]:
+        return [self._build(self._nodes, row) for row in rows]
+
+    def select(self, fields: Optional[str] = None, include: Optional[str] = None) -> 'ExpenseShape':
+        """The shape narrowed by the comma-separated fields= and include=
+        query parameters.
+
+        fields= picks attributes and include= picks related objects (Groups)
+        to expand. With neither the whole shape is served; fields= alone
+        expands no related objects and include= alone keeps every attribute.
+        `id` is always served. Raises FieldSelectionError for unknown names.
+        """
+        field_names, include_names = _names(fields), _names(include)
+        if not field_names and not include_names:
+            return self
+
+        unknown = [name for name in field_names if name not in self.attributes]
+        if unknown:
+            raise FieldSelectionError(f"Unknown fields: {', '.join(unknown)}. "
+                                      f"Available: {', '.join(self.attributes)}")
+        unknown = [name for name in include_names if name not in self.relations]
+        if unknown:
+            raise FieldSelectionError(f"Unknown include: {', '.join(unknown)}. "
+                                      f"Available: {', '.join(self.relations)}")
+
+        wanted = set(field_names or self.attributes) | set(include_names) | {'id'}
+        key = tuple(sorted(wanted))
+        shape = self._selections.get(key)
+        if shape is None:
+            if len(self._selections) >= _MAX_SELECTIONS:
+                self._selections.clear()
+            shape = ExpenseShape({k: v for k, v in self.fields.items() if k in wanted})
+            self._selections[key] = shape
+        return shape
+
+    def paginate(self, statement, page: int, per_page: int, source=Expense,
+                 joined: Optional[dict] = None, total: Optional[int] = None) -> SelectPagination:
+        """Paginate a filtered, ordered select(); .items are response dicts.
+        Pass `total` when the caller already counted the select to skip the
+        COUNT query."""
+        pagination = _RowPagination(
+            select=self.project(statement, source, joined), count_select=statement,
+            session=db.session(), page=page, per_page=per_page, error_out=False,
+            count=total is None,
+        )
+        if total is not None:
+            pagination.total = total
+        pagination.items = self.serialize(pagination.items)
+        return pagination
+
+    def benchmark(self, per_page: int = 25, repeat: int = 20) -> dict:
+        """Median time and peak memory of serializing the newest page of
+        expenses, projected vs. from hydrated ORM objects of the same joins."""
+        ids = db.session.execute(
+            select(Expense.id).order_by(Expense.id.desc()).limit(per_page)
+        ).scalars().all()
+        base = select(Expense.id).where(Expense.id.in_(ids)).order_by(Expense.id.desc())
+
+        def projected():
+            return self.serialize(db.session.execute(self.project(base)).mappings().all())
+
+        orm_statement, entities = self._join(base, Expense, None)
+        names = [EXPENSE] + self._joins
+        orm_statement = orm_statement.with_only_columns(*[entities[name] for name in names])
+
+        def hydrated():
+            result = []
+            for row in db.session.execute(orm_statement).all():
+                objects = dict(zip(names, row))
+                values = {_label(join, column): getattr(objects[join], column) if objects[join] is not None else None
+                          for join, column in self._columns}
+                result.append(self._build(self._nodes, values))
+            db.session.expunge_all()
+            return result
+
+        report = {'rows': len(ids), 'repeat': repeat}
+        for name, run in (('orm', hydrated), ('projected', projected)):
+            run()  # warm up statement caches
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - started)
+            # Memory is measured in separate runs; tracing slows everything down
+            peaks = []
+            tracemalloc.start()
+            for _ in range(repeat):
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+                run()
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+            tracemalloc.stop()
+            report[name] = {'ms_per_page': round(median(timings) * 1000, 3),
+                            'peak_kib': round(median(peaks) / 1024, 1)}
+        return report
+
+
+# /expenses (the current user's own)
+USER_EXPENSE_SHAPE = ExpenseShape({
+    'id': Field('id'),
+    'amount': Field('amount'),
+    'currency': Field('currency'),
+    'amount_ils': Field('amount_ils'),
+    'exchange_rate': Field('exchange_rate'),
+    'description': Field('description'),
+    'reason': Field('reason'),
+    'date': Field('date'),
+    'status': Field('status'),
+    'type': Field('type'),
+    'payment_method': Field('payment_method'),
+    'subcategory': Group('subcategory', {
+        'id': Field('id'),
+        'name': Field('name'),
+    }),
+    'category': Group('category', {
+        'id': Field('id'),
+        'name': Field('name'),
+    }),
+    'supplier': Group('supplier', {
+        'id': Field('id'),
+        'name': Field('name'),
+    }),
+    'invoice_filename': Field('invoice_filename'),
+    'receipt_filename': Field('receipt_filename'),
+    'quote_filename': Field('quote_filename'),
+    'submit_date': Field('submit_date'),
+    'invoice_date': Field('invoice_date'),
+})
+
+# /admin/expenses and /manager/expenses
+EXPENSE_LIST_SHAPE = ExpenseShape({
+    'id': Field('id'),
+    'amount': Field('amount'),
+    'currency': Field('currency'),
+    'amount_ils': Field('amount_ils'),
+    'exchange_rate': Field('exchange_rate'),
+    'description': Field('description'),
+    'reason': Field('reason'),
+    'date': Field('date'),
+    'invoice_date': Field('invoice_date'),
+    'status': Field('status'),
+    'type': Field('type'),
+    'payment_method': Field('payment_method'),
+    'payment_status': Field('payment_status'),
+    'rejection_reason': Field('rejection_reason'),
+    'credit_card_id': Field('credit_card_id'),
+    'credit_card': Group('credit_card', {
+        'id': Field('id'),
+        'name': Field('description', 'last_four_digits',
+                      fmt=lambda description, last_four: description or f"Card *{last_four}"),
+        'last_four_digits': Field('last_four_digits'),
+    }),
+    'user': Group('submitter', {
+        'id': Field('id'),
+        'username': Field('username'),
+        'name': Field('first_name', 'last_name', fmt=full_name),
+        'department': Field('name', join='department'),
+        'department_id': Field('department_id', join=EXPENSE),
+    }),
+    'subcategory': Group('subcategory', {
+        'id': Field('id'),
+        'name': Field('name'),
+    }),
+    'category': Group('category', {
+        'id': Field('id'),
+        'name': Field('name'),
+    }),
+    'supplier': Group('supplier', {
+        'id': Field('id'),
+        'name': Field('name'),
+    }),
+    'budget_year': Group('budget_year', {
+        'id': Field('id'),
+        'year': Field('year'),
+        'name': Field('name'),
+    }),
+    'handler': Group('handler', {
+        'id': Field('id'),
+        'name': Field('first_name', 'last_name', fmt=full_name),
+    }),
+    'handled_at': Field('handled_at'),
+    'has_invoice': Field('invoice_filename', fmt=bool),
+    'has_receipt': Field('receipt_filename', fmt=bool),
+    'has_quote': Field('quote_filename', fmt=bool),
+    'invoice_filename': Field('invoice_filename'),
+    'receipt_filename': Field('receipt_filename'),
+    'quote_filename': Field('quote_filename'),
+    'thumbnail_urls': Field('quote_filename', 'invoice_filename', 'receipt_filename', fmt=_thumbnail_urls),
+    'submit_date': Field('submit_date'),
+})
+
+# /accounting/expenses
+ACCOUNTING_EXPENSE_SHAPE = ExpenseShape({
+    'id': Field('id'),
+    'date': Field('date'),
+    'description': Field('description'),
+    'reason': Field('reason'),
+    'amount': Field('amount'),
+    'currency': Field('currency'),
+    'amount_ils': Field('amount_ils'),
+    'payment_method': Field('payment_method'),
+    'payment_due_date': Field('payment_due_date'),
+    'payment_status': Field('payment_status'),
+    'is_paid': Field('is_paid'),
+    'paid_by': Field('username', join='paid_by'),
+    'paid_at': Field('paid_at'),
+    'invoice_date': Field('invoice_date'),
+    'type': Field('type'),
+    'external_accounting_entry': Field('external_accounting_entry'),
+    'external_accounting_entry_by': Field('username', join='external_accounting_entry_by'),
+    'external_accounting_entry_at': Field('external_accounting_entry_at'),
+    'supplier': Group('supplier', {
+        'name': Field('name'),
+        'email': Field('email'),
+        'phone': Field('phone'),
+        'address': Field('address'),
+        'tax_id': Field('tax_id'),
+        'bank_name': Field('bank_name'),
+        'bank_account_number': Field('bank_account_number'),
+        'bank_branch': Field('bank_branch'),
+        'bank_swift': Field('bank_swift'),
+        'notes': Field('notes'),
+        'status': Field('status'),
+    }),
+    'credit_card': Group('credit_card', {
+        'description': Field('description'),
+        'last_four_digits': Field('last_four_digits'),
+    }),
+    'submitter': Group('submitter', {
+        'username': Field('username'),
+        'department': Field('name', join='submitter_department'),
+    }),
+    'handler': Group('handler', {
+        'username': Field('username'),
+    }),
+    'handled_at': Field('handled_at'),
+    'category': Field('name', join='category'),
+    'subcategory': Field('name', join='subcategory'),
+    'quote_filename': Field('quote_filename'),
+    'invoice_filename': Field('invoice_filename'),
+    'receipt_filename': Field('receipt_filename'),
+    'thumbnail_urls': Field('quote_filename', 'invoice_filename', 'receipt_filename', fmt=_thumbnail_urls),
+})
+
+
+def _or_blank(value):
+    return value or ''
+
+
+# /expenses/report: flat rows, blanks instead of nulls, names read through the subcategory
+REPORT_EXPENSE_SHAPE = ExpenseShape({
+    'id': Field('id'),
+    'date': Field('date', fmt=lambda value: value.strftime('%Y-%m-%d') if value else ''),
+    'description': Field('description', fmt=_or_blank),
+    'amount': Field('amount'),
+    'currency': Field('currency'),
+    'amount_ils': Field('amount_ils'),
+    'exchange_rate': Field('exchange_rate'),
+    'status': Field('status'),
+    'type': Field('type'),
+    'category': Field('name', join='subcategory_category', fmt=_or_blank),
+    'subcategory': Field('name', join='subcategory', fmt=_or_blank),
+    'supplier': Field('name', join='supplier', fmt=_or_blank),
+    'user': Field('id', 'first_name', 'last_name', join='submitter',
+                  fmt=lambda id, first_name, last_name: f"{first_name} {last_name}" if id is not None else ''),
+    'department': Field('name', join='subcategory_department', fmt=_or_blank),
+    'payment_method': Field('payment_method', fmt=_or_blank),
+    'reason': Field('reason', fmt=_or_blank),
+})
+
+SHAPES = {
+    'user-expenses': USER_EXPENSE_SHAPE,
+    'expense-list': EXPENSE_LIST_SHAPE,
+    'accounting': ACCOUNTING_EXPENSE_SHAPE,
+    'report': REPORT_EXPENSE_SHAPE,
+}
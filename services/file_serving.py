@@ -0,0 +1,137 @@
+"""Serving stored uploads after the permission check in download_file.
+
+FILE_SERVING_MODE picks who moves the bytes:
+
+- 'x-accel': nginx in front of gunicorn serves the file from an internal
+  location (X_ACCEL_PREFIX maps to UPLOAD_FOLDER); the worker only sends
+  headers.
+- 'x-sendfile': Apache/lighttpd style, via Flask's USE_X_SENDFILE.
+- '' (default): the worker answers itself with Werkzeug's send_file, which
+  handles Range and If-None-Match/If-Modified-Since and hands the open file
+  to gunicorn's wsgi.file_wrapper, so the body goes out with sendfile(2).
+
+The content hash from stored_file/expense_attachment is the ETag, so a
+re-uploaded document under the same name can never be served stale.
+
+`flask benchmark-file-serving` measures what each mode costs a gthread
+worker: how long a thread stays busy per preview/download when clients read
+the body at a limited rate, and the resulting throughput of a fixed pool.
+"""
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from statistics import median
+from typing import Iterable, Optional
+
+from flask import current_app, request, send_file
+
+from services.file_storage import upload_root
+from services.storage_backends import content_disposition
+
+logger = logging.getLogger(__name__)
+
+
+def _accel_response(path: str, download_name: str, mimetype: Optional[str], etag: Optional[str]):
+    relative = os.path.relpath(path, upload_root()).replace(os.sep, '/')
+    prefix = current_app.config['X_ACCEL_PREFIX'].rstrip('/')
+    response = current_app.response_class(mimetype=mimetype or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = f"{prefix}/{relative}"
+    response.headers['Content-Disposition'] = content_disposition(download_name)
+    if etag:
+        response.set_etag(etag)
+    return response.make_conditional(request)
+
+
+def serve_stored_file(path: str, download_name: str, mimetype: Optional[str] = None,
+                      etag: Optional[str] = None):
+    """Response for an already authorized stored file (absolute path)."""
+    mode = current_app.config.get('FILE_SERVING_MODE', '')
+    if mode == 'x-accel':
+        response = _accel_response(path, download_name, mimetype, etag)
+    else:
+        # send_file emits X-Sendfile itself when USE_X_SENDFILE is set
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            as_attachment=False,
+            download_name=download_name,
+            conditional=True,
+            etag=etag or True,
+            max_age=current_app.config['FILE_CACHE_MAX_AGE'],
+        )
+    # Documents are per-user authorized; only the browser may cache them
+    response.cache_control.private = True
+    response.cache_control.public = False
+    response.cache_control.max_age = current_app.config['FILE_CACHE_MAX_AGE']
+    return response
+
+
+def _serve_once(path: str, etag: str, client_bytes_per_s: Optional[float], if_none_match: bool) -> dict:
+    """Time one request on the calling thread, including writing the body to a throttled client."""
+    headers = {'If-None-Match': f'"{etag}"'} if if_none_match else {}
+    start = time.perf_counter()
+    with current_app.test_request_context('/download/benchmark.pdf', headers=headers):
+        response = serve_stored_file(path, 'benchmark.pdf', mimetype='application/pdf', etag=etag)
+        body = response.get_app_iter(request.environ)
+        sent = 0
+        # The worker thread is held until the client has taken the whole body
+        for chunk in body:
+            sent += len(chunk)
+            if client_bytes_per_s:
+                time.sleep(len(chunk) / client_bytes_per_s)
+        if hasattr(body, 'close'):
+            body.close()
+    return {'busy_s': time.perf_counter() - start, 'bytes': sent, 'status': response.status_code}
+
+
+def benchmark_serving(sizes_kib: Iterable[int] = (32, 2048), concurrency: int = 8, requests: int = 64,
+                      client_kibps: Optional[float] = 2048) -> dict:
+    """Worker time per request and pool throughput for each FILE_SERVING_MODE.
+
+    `concurrency` threads stand in for a gthread pool (workers x threads)
+    serving `requests` concurrent previews of a file of each size. With
+    x-accel the body never passes through the worker; with send_file it does,
+    so a slow client keeps the thread busy for the whole transfer. The
+    revalidation row is send_file answering a browser that already has the
+    file (If-None-Match, 304).
+    """
+    app = current_app._get_current_object()
+    saved = {key: app.config.get(key) for key in ('FILE_SERVING_MODE', 'USE_X_SENDFILE')}
+    variants = {
+        'send_file': ('', False, False),
+        'x-accel': ('x-accel', False, False),
+        'revalidate': ('', False, True),
+    }
+    client_bytes_per_s = client_kibps * 1024 if client_kibps else None
+    os.makedirs(upload_root(), exist_ok=True)
+
+    result = {'concurrency': concurrency, 'requests': requests, 'client_kibps': client_kibps, 'sizes': {}}
+    for size_kib in sizes_kib:
+        with tempfile.NamedTemporaryFile(dir=upload_root(), prefix='.benchmark-', delete=False) as handle:
+            handle.write(os.urandom(size_kib * 1024))
+            path = handle.name
+        try:
+            report = result['sizes'][size_kib] = {}
+            for name, (mode, x_sendfile, revalidate) in variants.items():
+                app.config.update(FILE_SERVING_MODE=mode, USE_X_SENDFILE=x_sendfile)
+
+                def run(_):
+                    with app.app_context():
+                        return _serve_once(path, 'benchmark', client_bytes_per_s, revalidate)
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    runs = list(pool.map(run, range(requests)))
+                wall = time.perf_counter() - start
+                report[name] = {
+                    'busy_ms': round(median(r['busy_s'] for r in runs) * 1000, 2),
+                    'worker_kib': round(median(r['bytes'] for r in runs) / 1024, 1),
+                    'per_s': round(requests / wall, 1),
+                    'status': runs[-1]['status'],
+                }
+        finally:
+            app.config.update(saved)
+            os.remove(path)
+    return result
@@ -0,0 +1,443 @@
+"""Sharded upload storage backed by the stored_file metadata table.
+
+Files keep their public name (the value stored in Expense.*_filename and used
+in /download/<name> URLs) but live on disk under UPLOAD_FOLDER/ab/cd/<name>,
+where ab/cd are the first hex digits of sha256(name). The shard is derived
+from the name alone, so locating a file never requires listing a directory,
+and size/mime/content hash are answered from stored_file without touching
+the disk at all.
+
+New uploads are deduplicated by content: the bytes are hashed while they are
+streamed to disk and stored once as a StoredBlob under blobs/ab/cd/<sha256>.
+Each public name is a StoredFile row pointing at that blob, and the blob's
+ref_count tracks how many names use it.
+
+Bytes are moved by the configured backend (services.storage_backends), so
+the same storage paths work on the local disk and in an S3 bucket. Uploads
+are always received into a local temp file first.
+"""
+import base64
+import hashlib
+import logging
+import re
+import mimetypes
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Iterator, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, BlobUpload, StoredFile, StoredBlob
+from services.storage_backends import get_storage
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+def shard_path(name: str) -> str:
+    """Relative storage path for a public filename, e.g. '3f/a2/<name>'."""
+    digest = hashlib.sha256(name.encode('utf-8')).hexdigest()
+    return os.path.join(digest[:2], digest[2:4], name)
+
+
+def upload_root() -> str:
+    return os.path.abspath(current_app.config['UPLOAD_FOLDER'])
+
+
+def _absolute(storage_path: str) -> str:
+    return os.path.join(upload_root(), storage_path)
+
+
+def _hash_file(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _guess_mime(name: str, fallback: Optional[str] = None) -> Optional[str]:
+    return mimetypes.guess_type(name)[0] or fallback
+
+
+def blob_path(content_hash: str) -> str:
+    """Relative storage path of a blob, e.g. 'blobs/3f/a2/<sha256>'."""
+    return os.path.join('blobs', content_hash[:2], content_hash[2:4], content_hash)
+
+
+def _receive(file) -> Tuple[str, str, int]:
+    """Stream an upload to a unique temp file, hashing it on the way.
+
+    Returns (temp_path, sha256 hex, size). The temp file lives on the upload
+    disk so adopting it as a blob is a rename.
+    """
+    incoming = os.path.join(upload_root(), '.incoming')
+    os.makedirs(incoming, exist_ok=True)
+    temp_path = os.path.join(incoming, uuid.uuid4().hex)
+    sha256 = hashlib.sha256()
+    size = 0
+    stream = getattr(file, 'stream', file)
+    try:
+        with open(temp_path, 'wb') as out:
+            for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    return temp_path, sha256.hexdigest(), size
+
+
+_DIRECT_UPLOAD_KEY = re.compile(r'^incoming/[0-9a-f]{32}$')
+
+
+def _touch_blob(content_hash: str, refs: int) -> bool:
+    """Add `refs` references to an existing blob; False if there is none.
+
+    Done as one UPDATE so concurrent uploads of the same document cannot lose
+    a count, and so a concurrent `storage-gc` waits on the row lock.
+    """
+    result = db.session.execute(
+        update(StoredBlob)
+        .where(StoredBlob.content_hash == content_hash)
+        .values(ref_count=StoredBlob.ref_count + refs, last_referenced_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount > 0
+
+
+def _ensure_blob_row(content_hash: str, size: int, mime_type: Optional[str], refs: int) -> str:
+    """Reference the blob row for a hash, creating it if needed; returns its storage path."""
+    if not _touch_blob(content_hash, refs):
+        try:
+            with db.session.begin_nested():
+                db.session.add(StoredBlob(
+                    content_hash=content_hash,
+                    storage_path=blob_path(content_hash),
+                    size=size,
+                    mime_type=mime_type,
+                    ref_count=refs,
+                ))
+        except IntegrityError:
+            # Another request stored the same document first
+            _touch_blob(content_hash, refs)
+    return blob_path(content_hash)
+
+
+def _adopt_blob(temp_path: str, content_hash: str, size: int, mime_type: Optional[str], refs: int) -> StoredBlob:
+    """Turn a received temp file into the blob for its hash (caller commits)."""
+    storage_path = _ensure_blob_row(content_hash, size, mime_type, refs)
+    storage = get_storage()
+    if storage.exists(storage_path):
+        os.remove(temp_path)
+    else:
+        storage.put(temp_path, storage_path, mime_type)
+    return get_blob(content_hash)
+
+
+def get_blob(content_hash: Optional[str]) -> Optional[StoredBlob]:
+    if not content_hash:
+        return None
+    return StoredBlob.query.filter_by(content_hash=content_hash.lower()).first()
+
+
+def store_received(upload) -> StoredBlob:
+    """Store a document received by services.uploads without naming it (caller commits).
+
+    Used by the OCR endpoints so the client can later attach the same document
+    by hash instead of uploading it again; unreferenced blobs expire through
+    `flask storage-gc`. A document that is already stored is not written again.
+    """
+    blob = get_blob(upload.content_hash)
+    if blob and get_storage().exists(blob.storage_path):
+        _touch_blob(blob.content_hash, 0)
+        return blob
+    temp_path = upload.save_to(os.path.join(upload_root(), '.incoming'))
+    mime_type = upload.mimetype or _guess_mime(upload.filename)
+    return _adopt_blob(temp_path, upload.content_hash, upload.size, mime_type, refs=0)
+
+
+def _release_blob(stored: Optional[StoredFile]) -> bool:
+    """Drop the blob reference held by a blob-backed StoredFile; False if it has none."""
+    if not (stored and stored.content_hash and stored.storage_path == blob_path(stored.content_hash)):
+        return False
+    db.session.execute(
+        update(StoredBlob)
+        .where(StoredBlob.content_hash == stored.content_hash)
+        .where(StoredBlob.ref_count > 0)
+        .values(ref_count=StoredBlob.ref_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    return True
+
+
+def _stored_file_for(name: str) -> StoredFile:
+    """The StoredFile row to (re)point at a blob. A reused name first gives up
+    the reference it held, so the old blob can still be collected."""
+    stored = StoredFile.query.filter_by(name=name).first()
+    if stored is None:
+        return StoredFile(name=name)
+    _release_blob(stored)
+    return stored
+
+
+def link_blob(blob: StoredBlob, name: str) -> StoredFile:
+    """Record `name` as another reference to an already stored blob (caller commits)."""
+    _touch_blob(blob.content_hash, 1)
+    stored = _stored_file_for(name)
+    stored.storage_path = blob.storage_path
+    stored.size = blob.size
+    stored.mime_type = _guess_mime(name, blob.mime_type)
+    stored.content_hash = blob.content_hash
+    db.session.add(stored)
+    return stored
+
+
+def save_upload(file, name: str) -> StoredFile:
+    """Store an uploaded werkzeug FileStorage under `name`, deduplicated by content.
+
+    The StoredFile row is added to the session; the caller commits it along
+    with the expense that references `name`.
+    """
+    temp_path, content_hash, size = _receive(file)
+    mime_type = _guess_mime(name, getattr(file, 'mimetype', None))
+    blob = _adopt_blob(temp_path, content_hash, size, mime_type, refs=1)
+
+    stored = _stored_file_for(name)
+    stored.storage_path = blob.storage_path
+    stored.size = size
+    stored.mime_type = mime_type
+    stored.content_hash = content_hash
+    db.session.add(stored)
+    return stored
+
+
+def get_stored_file(name: str) -> Optional[StoredFile]:
+    return StoredFile.query.filter_by(name=name).first()
+
+
+def resolve_path(name: str) -> Optional[str]:
+    """Local absolute path of a stored file, or None if it is unknown or missing.
+
+    Costs one indexed lookup, plus at most two probes for files that are not
+    indexed yet (moved by an interrupted migration, or still flat). With a
+    remote backend the path is a cached local copy.
+    """
+    storage = get_storage()
+    stored = get_stored_file(name)
+    if stored:
+        return storage.local_path(stored.storage_path)
+    # Sharded but not indexed (e.g. an interrupted migration batch), or still flat
+    for candidate in (shard_path(name), name):
+        path = storage.local_path(candidate)
+        if path:
+            return path
+    return None
+
+
+def download_url(name: str, mime_type: Optional[str] = None) -> Optional[str]:
+    """Short-lived direct URL for a stored file, when the backend offers one."""
+    stored = get_stored_file(name)
+    storage_path = stored.storage_path if stored else shard_path(name)
+    return get_storage().download_url(storage_path, name, mime_type)
+
+
+def delete_file(name: Optional[str]) -> None:
+    """Remove a stored file and its metadata row (caller commits).
+
+    Blob-backed files only drop a reference; the bytes are removed by
+    `flask storage-gc` once nothing points at them.
+    """
+    if not name:
+        return
+    stored = get_stored_file(name)
+    if not _release_blob(stored):
+        storage = get_storage()
+        for storage_path in ([stored.storage_path] if stored else [shard_path(name), name]):
+            try:
+                storage.delete(storage_path)
+            except OSError:
+                pass
+    StoredFile.query.filter_by(name=name).delete()
+
+
+def start_direct_upload(content_hash: str, mime_type: str, reuse_stored: bool = True) -> dict:
+    """Let a client upload a document straight to the bucket.
+
+    Returns {'stored': True} when the document is already stored and
+    `reuse_stored` allows skipping the upload, {'direct_upload': False} when
+    the backend is the local disk, and otherwise a presigned POST to a
+    one-off incoming/ key that must be confirmed with finish_direct_upload().
+    """
+    content_hash = content_hash.lower()
+    if reuse_stored and get_blob(content_hash):
+        return {'stored': True}
+    storage = get_storage()
+    if not storage.is_remote:
+        return {'stored': False, 'direct_upload': False}
+    upload_key = f"incoming/{uuid.uuid4().hex}"
+    checksum = base64.b64encode(bytes.fromhex(content_hash)).decode('ascii')
+    post = storage.presigned_post(upload_key, mime_type, checksum,
+                                  current_app.config['MAX_CONTENT_LENGTH'])
+    return {'stored': False, 'direct_upload': True, 'upload_key': upload_key, 'upload': post}
+
+
+def finish_direct_upload(upload_key: str, content_hash: str, mime_type: Optional[str]) -> StoredBlob:
+    """Verify a directly uploaded object and adopt it as the blob for its hash (caller commits).
+
+    Raises ValueError if the key is not an upload slot or the bytes do not
+    match the announced hash; the object is deleted in that case.
+    """
+    content_hash = content_hash.lower()
+    storage = get_storage()
+    if not storage.is_remote or not _DIRECT_UPLOAD_KEY.match(upload_key or ''):
+        raise ValueError('Invalid upload key')
+
+    head = storage.head(upload_key)
+    if head is None:
+        raise ValueError('Upload not found')
+    checksum = head.get('ChecksumSHA256')
+    if checksum:
+        actual = base64.b64decode(checksum).hex()
+    else:
+        # The store did not record a checksum; hash the bytes ourselves
+        local_copy = storage.local_path(upload_key)
+        actual = _hash_file(local_copy) if local_copy else None
+    if actual != content_hash:
+        storage.delete(upload_key)
+        raise ValueError('Uploaded file does not match its content hash')
+
+    storage_path = _ensure_blob_row(content_hash, head['ContentLength'], mime_type, refs=0)
+    if not storage.exists(storage_path):
+        storage.copy(upload_key, storage_path)
+    storage.delete(upload_key)
+    return get_blob(content_hash)
+
+
+def collect_garbage(grace_hours: float, dry_run: bool = False) -> dict:
+    """Delete blobs nobody references that were last used before the grace period.
+
+    Each blob is deleted with a conditional DELETE and committed on its own, so
+    an upload that re-references it concurrently either wins (the DELETE
+    matches nothing) or waits and stores the bytes again afterwards.
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    candidates = (StoredBlob.query
+                  .filter(StoredBlob.ref_count <= 0, StoredBlob.last_referenced_at < cutoff)
+                  .with_entities(StoredBlob.id, StoredBlob.storage_path, StoredBlob.size)
+                  .all())
+    stats = {'deleted': 0, 'bytes': 0, 'stale_temp': 0, 'expired_uploads': 0}
+    for blob_id, storage_path, size in candidates:
+        if dry_run:
+            stats['deleted'] += 1
+            stats['bytes'] += size or 0
+            continue
+        deleted = (StoredBlob.query
+                   .filter(StoredBlob.id == blob_id, StoredBlob.ref_count <= 0,
+                           StoredBlob.last_referenced_at < cutoff)
+                   .delete(synchronize_session=False))
+        if deleted:
+            get_storage().delete(storage_path)
+            stats['deleted'] += 1
+            stats['bytes'] += size or 0
+        db.session.commit()
+
+    # Upload records past the same grace period no longer let anyone attach by hash
+    expired = BlobUpload.query.filter(BlobUpload.uploaded_at < cutoff)
+    stats['expired_uploads'] = expired.count() if dry_run else expired.delete(synchronize_session=False)
+    db.session.commit()
+
+    # Temp files left behind by requests that failed mid-upload
+    incoming = os.path.join(upload_root(), '.incoming')
+    if os.path.isdir(incoming):
+        with os.scandir(incoming) as entries:
+            for entry in entries:
+                if entry.is_file() and datetime.utcfromtimestamp(entry.stat().st_mtime) < cutoff:
+                    stats['stale_temp'] += 1
+                    if not dry_run:
+                        os.remove(entry.path)
+    logger.info(f"Blob garbage collection {'(dry run) ' if dry_run else ''}finished: {stats}")
+    return stats
+
+
+def _iter_flat_files(root: str) -> Iterator[os.DirEntry]:
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                yield entry
+
+
+def _iter_unindexed_shards(root: str, known: set) -> Iterator[str]:
+    """Files already in shard directories but missing from stored_file."""
+    with os.scandir(root) as top:
+        shard_dirs = [e.path for e in top if e.is_dir() and len(e.name) == 2]
+    for shard_dir in shard_dirs:
+        for dirpath, _dirnames, filenames in os.walk(shard_dir):
+            for name in filenames:
+                if name not in known:
+                    yield name
+
+
+def _index(name: str) -> None:
+    storage_path = shard_path(name)
+    abs_path = _absolute(storage_path)
+    db.session.add(StoredFile(
+        name=name,
+        storage_path=storage_path,
+        size=os.path.getsize(abs_path),
+        mime_type=_guess_mime(name),
+        content_hash=_hash_file(abs_path),
+    ))
+
+
+def migrate_flat_uploads(batch_size: int = 500, dry_run: bool = False) -> dict:
+    """Move files from the flat UPLOAD_FOLDER into shards and index them.
+
+    This reorganizes the local disk only; for the S3 backend, run it before
+    copying UPLOAD_FOLDER into the bucket.
+
+    Moves are renames within the same filesystem, so this is safe to run on
+    the live disk and can be re-run: indexed files are skipped, and files a
+    previous interrupted run moved without indexing are indexed in place.
+    """
+    root = upload_root()
+    known = {name for (name,) in db.session.query(StoredFile.name)}
+    stats = {'moved': 0, 'indexed': 0, 'skipped': 0}
+    pending = 0
+
+    for name in list(_iter_unindexed_shards(root, known)):
+        if not dry_run:
+            _index(name)
+            pending += 1
+        stats['indexed'] += 1
+        known.add(name)
+
+    for entry in _iter_flat_files(root):
+        name = entry.name
+        if name in known:
+            stats['skipped'] += 1
+            continue
+
+        stats['moved'] += 1
+        stats['indexed'] += 1
+        if dry_run:
+            continue
+
+        abs_path = _absolute(shard_path(name))
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        os.replace(entry.path, abs_path)
+        _index(name)
+        pending += 1
+        if pending >= batch_size:
+            db.session.commit()
+            pending = 0
+
+    if not dry_run:
+        db.session.commit()
+    logger.info(f"Upload storage migration {'(dry run) ' if dry_run else ''}finished: {stats}")
+    return stats
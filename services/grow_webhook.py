@@ -6,8 +6,6 @@ import html
 import logging
 import os
 
-import resend
-
 logger = logging.getLogger(__name__)
 
 WATCH_URL = "https://www.mali-barefoot.com/watch.html"
@@ -69,6 +67,9 @@ def _build_sale_email(full_name, payment_sum, payer_email, payer_phone, transact
 
 
 def _send(payload, label, sent):
+    import resend  # Imported on first webhook rather than at worker boot
+
+    resend.api_key = os.environ.get('RESEND_API_KEY')
     try:
         resend.Emails.send(payload)
         sent.append(label)
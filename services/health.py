@@ -0,0 +1,147 @@
+"""Readiness checks for the /health/ready endpoint.
+
+Liveness (/health) must never touch the database: under pool exhaustion a
+probe that checks out a pooled connection blocks for up to pool_timeout and
+Render restarts a perfectly healthy worker. Readiness runs the real
+dependency checks, but on a dedicated single-connection engine with short
+timeouts, and caches the result for a few seconds so a tight probe interval
+does not turn into a steady stream of DB round trips.
+"""
+import logging
+import os
+import smtplib
+import socket
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_cached_report = None
+_cached_at = 0.0
+_probe_engine = None
+
+
+def _get_probe_engine(app):
+    """Lazily create a tiny engine used only by readiness probes.
+
+    It has its own one-connection pool so a probe never competes with
+    request traffic for the main pool, and every wait is bounded by
+    HEALTH_CHECK_TIMEOUT.
+    """
+    global _probe_engine
+    if _probe_engine is None:
+        timeout = app.config['HEALTH_CHECK_TIMEOUT']
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        connect_args = {}
+        if uri.startswith('postgresql'):
+            connect_args = {
+                'connect_timeout': max(1, int(timeout)),
+                'options': f'-c statement_timeout={int(timeout * 1000)}',
+            }
+        _probe_engine = create_engine(
+            uri,
+            poolclass=QueuePool,
+            pool_size=1,
+            max_overflow=0,
+            pool_timeout=timeout,
+            pool_recycle=300,
+            pool_pre_ping=False,
+            connect_args=connect_args,
+        )
+    return _probe_engine
+
+
+def _timed(check, *args):
+    """Run a check and return its result dict with latency in milliseconds."""
+    start = time.perf_counter()
+    try:
+        result = check(*args) or {}
+        result.setdefault('ok', True)
+    except Exception as e:
+        logger.warning(f"Readiness check {check.__name__} failed: {e}")
+        result = {'ok': False, 'error': str(e)}
+    result['latency_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+
+def check_database(app):
+    with _get_probe_engine(app).connect() as conn:
+        conn.execute(text('SELECT 1'))
+    return {'ok': True}
+
+
+def check_upload_folder(app):
+    upload_folder = app.config.get('UPLOAD_FOLDER')
+    if not upload_folder or not os.path.isdir(upload_folder):
+        return {'ok': False, 'error': 'Upload folder does not exist'}
+    # Creating and removing a temp file proves the disk is mounted and writable
+    with tempfile.NamedTemporaryFile(dir=upload_folder, prefix='.health-'):
+        pass
+    return {'ok': True}
+
+
+def check_smtp(app):
+    host = os.getenv('SMTP_SERVER', 'smtp.mailgun.org')
+    port = int(os.getenv('SMTP_PORT', '587'))
+    if not (os.getenv('SMTP_USERNAME') and os.getenv('SMTP_PASSWORD')):
+        return {'ok': True, 'skipped': 'SMTP credentials not configured'}
+    # Only the TCP/SMTP greeting is checked; no login, no mail
+    server = smtplib.SMTP(timeout=app.config['HEALTH_CHECK_TIMEOUT'])
+    try:
+        server.connect(host, port)
+        server.noop()
+    finally:
+        try:
+            server.close()
+        except (OSError, socket.error):
+            pass
+    return {'ok': True}
+
+
+# SMTP outages degrade email notifications but the app can still serve requests
+CRITICAL_CHECKS = ('database', 'upload_folder')
+
+
+def get_readiness_report(app):
+    """Return (report, http_status), reusing a cached report when fresh."""
+    global _cached_report, _cached_at
+    ttl = app.config['HEALTH_CHECK_CACHE_SECONDS']
+
+    now = time.monotonic()
+    if _cached_report is not None and now - _cached_at < ttl:
+        return dict(_cached_report, cached=True), _status_code(_cached_report)
+
+    # Only one thread per worker runs the checks; others wait for its result
+    with _lock:
+        now = time.monotonic()
+        if _cached_report is not None and now - _cached_at < ttl:
+            return dict(_cached_report, cached=True), _status_code(_cached_report)
+
+        checks = {
+            'database': _timed(check_database, app),
+            'upload_folder': _timed(check_upload_folder, app),
+            'smtp': _timed(check_smtp, app),
+        }
+        if not all(checks[name]['ok'] for name in CRITICAL_CHECKS):
+            status = 'unready'
+        elif not all(c['ok'] for c in checks.values()):
+            status = 'degraded'
+        else:
+            status = 'ready'
+
+        _cached_report = {
+            'status': status,
+            'checks': checks,
+            'checked_at': time.time(),
+        }
+        _cached_at = time.monotonic()
+        return dict(_cached_report, cached=False), _status_code(_cached_report)
+
+
+def _status_code(report):
+    return 503 if report['status'] == 'unready' else 200
@@ -0,0 +1,88 @@
+"""Import-time profile of the application.
+
+`flask benchmark-import` imports `app` in fresh interpreters with
+`-X importtime` and reports the median wall time, the largest direct
+imports by cumulative import time, and whether any of the heavy optional
+dependencies that create_app() defers (pandas, msal, resend, the Azure SDK)
+were loaded anyway. With a budget it fails when the import is slower, so it
+can guard startup time in CI or before a deploy.
+"""
+import logging
+import os
+import subprocess
+import sys
+from statistics import median
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Imported where they are used; `import app` should not load them
+DEFERRED_MODULES = ('pandas', 'msal', 'resend', 'azure')
+
+_PROBE = "import time; start = time.perf_counter(); import {module}; print(time.perf_counter() - start)"
+
+
+def _import_once(module: str) -> dict:
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _PROBE.format(module=module)],
+        cwd=PROJECT_ROOT, capture_output=True, text=True, check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr[-2000:]}")
+
+    # "import time: self [us] | cumulative | imported package", nested
+    # packages indented under the one that imported them
+    modules = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return {'seconds': float(completed.stdout.strip().splitlines()[-1]), 'modules': modules}
+
+
+def profile_import(module: str = 'app', repeat: int = 5, top: int = 10) -> dict:
+    """Median import time of `module` over `repeat` fresh interpreters."""
+    runs = [_import_once(module) for _ in range(repeat)]
+    modules = runs[-1]['modules']
+
+    # What `module` imports directly: the entries one level below it, listed
+    # before it and after the previous top-level entry. Their cumulative
+    # times cover everything they pulled in.
+    def depth(name):
+        return (len(name) - len(name.lstrip()) - 1) // 2
+
+    direct = []
+    end = max(i for i, (name, _, _) in enumerate(modules) if depth(name) == 0 and name.strip() == module)
+    for name, _, cumulative in reversed(modules[:end]):
+        if depth(name) == 0:
+            break
+        if depth(name) == 1:
+            direct.append((name.strip(), cumulative))
+    direct.sort(key=lambda item: item[1], reverse=True)
+
+    loaded = {name.strip() for name, _, _ in modules}
+    deferred_loaded = sorted(
+        name for name in loaded
+        if any(name == heavy or name.startswith(heavy + '.') for heavy in DEFERRED_MODULES)
+    )
+    return {
+        'module': module,
+        'repeat': repeat,
+        'ms': round(median(run['seconds'] for run in runs) * 1000, 1),
+        'modules_loaded': len(loaded),
+        'slowest': [{'name': name, 'ms': round(us / 1000, 1)} for name, us in direct[:top]],
+        'deferred_loaded': deferred_loaded,
+    }
+
+
+def over_budget(report: dict, budget_ms: Optional[float]) -> List[str]:
+    """Reasons the profile breaks the startup budget; empty when it does not."""
+    problems = []
+    if budget_ms is not None and report['ms'] > budget_ms:
+        problems.append(f"import {report['module']} took {report['ms']:.1f} ms (budget {budget_ms:.0f} ms)")
+    if report['deferred_loaded']:
+        problems.append(f"deferred modules were imported: {', '.join(report['deferred_loaded'])}")
+    return problems
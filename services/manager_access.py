@@ -1,6 +1,19 @@
 """Helper utilities for manager cross-department category access."""
-from sqlalchemy import or_
-from models import Category, Department, Subcategory
+from sqlalchemy import or_, select
+from sqlalchemy.orm import aliased
+from models import db, Category, Department, Subcategory
+
+
+def expand_department_lineage(dept_ids):
+    """Return the ids of every department (any budget year) that shares a
+    lineage with one of dept_ids, in one indexed query."""
+    if not dept_ids:
+        return []
+    assigned = aliased(Department)
+    lineage_ids = select(assigned.lineage_id).where(assigned.id.in_(list(dept_ids)))
+    return db.session.execute(
+        select(Department.id).where(Department.lineage_id.in_(lineage_ids))
+    ).scalars().all()
 
 
 def get_manager_access(user):
@@ -15,9 +28,9 @@ def get_manager_access(user):
     welfare subcategory would still see every sibling team's subcategories
     (and expenses) whenever the welfare category lived in the home department.
 
-    Full-access departments are expanded by name across all budget years,
-    so a manager assigned to "Engineering" in 2025 also has access to
-    "Engineering" in 2026 (and any other year).
+    Full-access departments are expanded by lineage across all budget years,
+    so a manager assigned to "Engineering" in 2025 also has access to its
+    rolled-over copy in 2026 (and any other year), even if it was renamed.
 
     Returns:
         tuple: (managed_dept_ids, managed_category_ids, managed_subcategory_ids)
@@ -32,15 +45,9 @@ def get_manager_access(user):
             and user.department_id not in managed_dept_ids):
         managed_dept_ids.append(user.department_id)
 
-    # Expand to include all departments with matching names across all budget years.
-    # The manager_departments table links to specific department rows (year-scoped),
-    # but departments sharing a name across years should be treated as the same entity.
-    if managed_dept_ids:
-        assigned_depts = Department.query.filter(Department.id.in_(managed_dept_ids)).all()
-        managed_names = list({d.name for d in assigned_depts})
-        if managed_names:
-            all_matching = Department.query.filter(Department.name.in_(managed_names)).all()
-            managed_dept_ids = list({d.id for d in all_matching})
+    # The manager_departments table links to specific department rows
+    # (year-scoped); the same lineage in other years is the same entity.
+    managed_dept_ids = expand_department_lineage(managed_dept_ids)
 
     return managed_dept_ids, managed_cat_ids, managed_subcat_ids
 
@@ -0,0 +1,222 @@
+"""Admission control for the OCR endpoints.
+
+Each OCR request blocks a gunicorn thread on Azure for seconds, so without a
+limit a burst of uploads takes every thread and starves the rest of the app.
+Three layers, checked in order:
+
+- per user: at most OCR_MAX_PER_USER requests running or queued per worker;
+- per worker: a semaphore of OCR_MAX_CONCURRENT_PER_WORKER running requests,
+  with at most OCR_MAX_QUEUE more waiting up to OCR_QUEUE_TIMEOUT seconds;
+- across workers: a token bucket of OCR_RATE_PER_MINUTE shared through an
+  flock-protected file in /dev/shm (the Azure resource's rate limit).
+
+A request that cannot be admitted raises OcrBusy with a Retry-After estimate,
+which the routes turn into 429. Queue depth and wait times are kept per
+worker and returned by metrics().
+"""
+import logging
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: no shared bucket
+    fcntl = None
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+_BUCKET_FORMAT = 'dd'  # tokens, timestamp
+
+
+class OcrBusy(Exception):
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after))
+
+
+class SharedTokenBucket:
+    """Token bucket whose state lives in a small file shared by all workers."""
+
+    def __init__(self, path: str, rate_per_minute: float, capacity: float):
+        self.path = path
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity
+
+    def _update(self, take: bool):
+        with open(self.path, 'a+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                now = time.time()
+                if len(raw) == struct.calcsize(_BUCKET_FORMAT):
+                    tokens, last = struct.unpack(_BUCKET_FORMAT, raw)
+                    tokens = min(self.capacity, tokens + max(0.0, now - last) * self.rate)
+                else:
+                    tokens = self.capacity
+                wait = 0.0
+                if take:
+                    if tokens >= 1:
+                        tokens -= 1
+                    else:
+                        wait = (1 - tokens) / self.rate
+                f.seek(0)
+                f.truncate()
+                f.write(struct.pack(_BUCKET_FORMAT, tokens, now))
+                return tokens, wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def take(self) -> float:
+        """Take a token; returns 0 on success, otherwise seconds until one is available."""
+        return self._update(take=True)[1]
+
+    def available(self) -> float:
+        return self._update(take=False)[0]
+
+
+class OcrLimiter:
+    def __init__(self, max_concurrent: int, max_queue: int, queue_timeout: float,
+                 max_per_user: int, bucket: SharedTokenBucket = None):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.max_per_user = max_per_user
+        self.bucket = bucket
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._per_user = defaultdict(int)
+        self._queued = 0
+        self._in_flight = 0
+        self._stats = {'admitted': 0, 'rejected_user': 0, 'rejected_queue': 0,
+                       'rejected_timeout': 0, 'rejected_rate': 0}
+        self._avg_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._avg_service_ms = 0.0
+
+    def _retry_after(self) -> int:
+        # Roughly the time for everyone ahead of us to finish
+        per_request = (self._avg_service_ms or 5000) / 1000
+        return math.ceil(per_request * (self._queued + 1) / self.max_concurrent)
+
+    def _reject(self, reason: str, retry_after: int = None):
+        with self._lock:
+            self._stats[f'rejected_{reason}'] += 1
+            retry_after = retry_after if retry_after is not None else self._retry_after()
+        logger.warning(f"OCR request rejected ({reason}), retry after {retry_after}s")
+        raise OcrBusy(reason, retry_after)
+
+    @contextmanager
+    def slot(self, user_id):
+        start = time.monotonic()
+        deadline = start + self.queue_timeout
+
+        with self._lock:
+            over_user_limit = self._per_user[user_id] >= self.max_per_user
+            if not over_user_limit:
+                self._per_user[user_id] += 1
+        if over_user_limit:
+            self._reject('user')
+
+        acquired = False
+        try:
+            if not self._slots.acquire(blocking=False):
+                with self._lock:
+                    queue_full = self._queued >= self.max_queue
+                    if not queue_full:
+                        self._queued += 1
+                if queue_full:
+                    self._reject('queue')
+                try:
+                    acquired = self._slots.acquire(timeout=self.queue_timeout)
+                finally:
+                    with self._lock:
+                        self._queued -= 1
+                if not acquired:
+                    self._reject('timeout')
+            else:
+                acquired = True
+
+            if self.bucket is not None:
+                while True:
+                    wait = self.bucket.take()
+                    if not wait:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        self._reject('rate', retry_after=math.ceil(wait))
+                    time.sleep(wait)
+
+            waited_ms = (time.monotonic() - start) * 1000
+            with self._lock:
+                self._in_flight += 1
+                self._stats['admitted'] += 1
+                self._avg_wait_ms = 0.8 * self._avg_wait_ms + 0.2 * waited_ms
+                self._max_wait_ms = max(self._max_wait_ms, waited_ms)
+
+            service_start = time.monotonic()
+            try:
+                yield
+            finally:
+                service_ms = (time.monotonic() - service_start) * 1000
+                with self._lock:
+                    self._in_flight -= 1
+                    self._avg_service_ms = (service_ms if not self._avg_service_ms
+                                            else 0.8 * self._avg_service_ms + 0.2 * service_ms)
+        finally:
+            if acquired:
+                self._slots.release()
+            with self._lock:
+                self._per_user[user_id] -= 1
+                if not self._per_user[user_id]:
+                    del self._per_user[user_id]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            report = {
+                'pid': os.getpid(),
+                'in_flight': self._in_flight,
+                'queue_depth': self._queued,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'avg_wait_ms': round(self._avg_wait_ms, 1),
+                'max_wait_ms': round(self._max_wait_ms, 1),
+                'avg_service_ms': round(self._avg_service_ms, 1),
+                **self._stats,
+            }
+        if self.bucket is not None:
+            report['shared_tokens_available'] = round(self.bucket.available(), 2)
+        return report
+
+
+def _bucket_path() -> str:
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(directory, 'labos-ocr-token-bucket')
+
+
+def get_ocr_limiter() -> OcrLimiter:
+    """The worker's limiter, created on first use (after fork)."""
+    app = current_app._get_current_object()
+    limiter = app.extensions.get('ocr_limiter')
+    if limiter is None:
+        config = app.config
+        bucket = None
+        if fcntl is not None and config['OCR_RATE_PER_MINUTE'] > 0:
+            bucket = SharedTokenBucket(config.get('OCR_TOKEN_BUCKET_PATH') or _bucket_path(),
+                                       config['OCR_RATE_PER_MINUTE'], config['OCR_BURST'])
+        limiter = app.extensions['ocr_limiter'] = OcrLimiter(
+            max_concurrent=config['OCR_MAX_CONCURRENT_PER_WORKER'],
+            max_queue=config['OCR_MAX_QUEUE'],
+            queue_timeout=config['OCR_QUEUE_TIMEOUT'],
+            max_per_user=config['OCR_MAX_PER_USER'],
+            bucket=bucket,
+        )
+    return limiter
@@ -0,0 +1,114 @@
+"""Shrink documents before they are sent to Azure Form Recognizer.
+
+Phone photos of receipts are often 4-12 MB, far beyond what OCR needs, and
+multi-page PDFs are sent whole although the totals are on one or two pages.
+prepare_for_ocr() returns a smaller payload when it can:
+
+- images are rotated upright from their EXIF orientation, converted to
+  grayscale and downscaled so the longest edge is at most OCR_MAX_IMAGE_EDGE
+  pixels, then re-encoded as JPEG;
+- PDFs longer than OCR_MAX_PDF_PAGES keep only the pages whose text mentions
+  a total (falling back to the first and last pages for scans without a
+  text layer).
+
+The original is kept whenever the result would not be smaller, and any
+failure (including missing Pillow/PyMuPDF) falls back to the original bytes.
+"""
+import io
+import logging
+import os
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+OCR_PREPROCESS = os.environ.get('OCR_PREPROCESS', 'true').lower() == 'true'
+OCR_MAX_IMAGE_EDGE = int(os.environ.get('OCR_MAX_IMAGE_EDGE', '2200'))  # ~200 dpi for an A4 page
+OCR_MAX_PDF_PAGES = int(os.environ.get('OCR_MAX_PDF_PAGES', '3'))
+OCR_JPEG_QUALITY = 85
+
+# Words near the amount on invoices and receipts (English and Hebrew)
+_TOTAL_PATTERN = re.compile(
+    r'\b(total|amount due|balance due|grand total|sum)\b|סה["״]?כ|לתשלום|סך הכל',
+    re.IGNORECASE
+)
+
+
+def is_pdf(data: bytes) -> bool:
+    return data[:5] == b'%PDF-' or data[:4] == b'%PDF'
+
+
+def _shrink_image(data: bytes) -> bytes:
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as img:
+        img.draft('L', (OCR_MAX_IMAGE_EDGE, OCR_MAX_IMAGE_EDGE))  # JPEG: decode at reduced scale
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('L')
+        img.thumbnail((OCR_MAX_IMAGE_EDGE, OCR_MAX_IMAGE_EDGE))
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=OCR_JPEG_QUALITY, optimize=True)
+        return out.getvalue()
+
+
+def select_total_pages(doc, max_pages: int) -> list:
+    """Indexes of the pages most likely to hold the document total."""
+    matches = [i for i in range(doc.page_count) if _TOTAL_PATTERN.search(doc.load_page(i).get_text())]
+    if not matches:
+        # No text layer (a scan) or no keyword: totals are usually on the last page
+        matches = [0, doc.page_count - 1]
+    # Prefer the last matches; a summary page usually follows the line items
+    return sorted(set(matches[-max_pages:]))
+
+
+def _shrink_pdf(data: bytes) -> bytes:
+    import pymupdf
+
+    with pymupdf.open(stream=data, filetype='pdf') as doc:
+        if doc.page_count <= OCR_MAX_PDF_PAGES:
+            return data
+        pages = select_total_pages(doc, OCR_MAX_PDF_PAGES)
+        doc.select(pages)
+        return doc.tobytes(garbage=3, deflate=True)
+
+
+def extract_pdf_pages(data: bytes, first_page: int, last_page: int) -> bytes:
+    """A new PDF holding pages first_page..last_page (1-based, inclusive)."""
+    import pymupdf
+
+    with pymupdf.open(stream=data, filetype='pdf') as doc:
+        doc.select(list(range(first_page - 1, last_page)))
+        return doc.tobytes(garbage=3, deflate=True)
+
+
+def prepare_for_ocr(data: bytes, whole_document: bool = False):
+    """Return (payload, stats) for an OCR request.
+
+    `whole_document` keeps every PDF page (batch extraction needs them all);
+    images are still downscaled.
+    """
+    stats = {'original_bytes': len(data), 'bytes': len(data), 'preprocess_ms': 0.0, 'action': 'none'}
+    if not OCR_PREPROCESS:
+        return data, stats
+
+    start = time.perf_counter()
+    try:
+        if is_pdf(data):
+            if whole_document:
+                return data, stats
+            payload, action = _shrink_pdf(data), 'pdf_pages'
+        else:
+            payload, action = _shrink_image(data), 'image'
+    except ImportError:
+        logger.warning("OCR pre-processing needs Pillow and PyMuPDF; sending documents as-is")
+        return data, stats
+    except Exception as e:
+        logger.warning(f"OCR pre-processing failed, sending original: {e}")
+        return data, stats
+
+    stats['preprocess_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    if len(payload) < len(data):
+        stats['bytes'] = len(payload)
+        stats['action'] = action
+        return payload, stats
+    return data, stats
@@ -0,0 +1,290 @@
+"""Where stored upload bytes live.
+
+services.file_storage decides *what* is stored (names, blobs, reference
+counts); a backend only moves bytes for relative storage paths such as
+'blobs/3f/a2/<sha256>'. STORAGE_BACKEND selects the implementation:
+
+- 'local' (default): files under UPLOAD_FOLDER on the web service's disk.
+- 's3': any S3-compatible bucket (AWS, MinIO, R2). Downloads are served as
+  short-lived presigned redirects and clients may upload directly to the
+  bucket with presigned POSTs. Code that needs a real file (OCR, email
+  attachments, thumbnails) gets a copy from a bounded local read cache.
+
+boto3 is imported only when the S3 backend is configured.
+"""
+import logging
+import os
+import threading
+import unicodedata
+import uuid
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from flask import current_app
+from werkzeug.http import dump_options_header
+
+logger = logging.getLogger(__name__)
+
+_prune_lock = threading.Lock()
+_size_lock = threading.Lock()
+# Bytes each LRU cache directory is believed to hold, kept per process
+_cache_bytes: Dict[str, int] = {}
+
+
+def content_disposition(download_name: str, disposition: str = 'inline') -> str:
+    """Content-Disposition value for `download_name`, built the way send_file does.
+
+    The name is quoted as needed, and a non-ASCII name is sent both as an
+    ASCII approximation and as RFC 5987 `filename*=UTF-8''...`.
+    """
+    try:
+        download_name.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        options = {'filename': simple, 'filename*': f"UTF-8''{quote(download_name, safe='!#$&+^`|~')}"}
+    else:
+        options = {'filename': download_name}
+    return dump_options_header(disposition, options)
+
+
+def prune_lru(directory: str, max_bytes: int) -> int:
+    """Delete least recently used files (by mtime) until `directory` is under 90% of max_bytes.
+
+    Walks the whole directory; returns the bytes left in it.
+    """
+    entries = []
+    total = 0
+    for dirpath, _dirnames, filenames in os.walk(directory):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+    if total <= max_bytes:
+        return total
+    entries.sort()
+    target = max_bytes * 0.9
+    for _mtime, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+    return total
+
+
+def cache_file_added(directory: str, size: int, max_bytes: int) -> None:
+    """Count `size` new bytes in an LRU cache directory, pruning it once the
+    running total passes max_bytes.
+
+    The total is seeded by one walk per process and then kept in memory, so
+    a write only lists the directory when the cache may be full. Files added
+    by other workers are picked up, and the total corrected, at that walk.
+    """
+    with _size_lock:
+        total = _cache_bytes.get(directory)
+        if total is not None:
+            total = _cache_bytes[directory] = total + size
+            if total <= max_bytes:
+                return
+    # One thread walks and evicts; the others keep counting meanwhile
+    if not _prune_lock.acquire(blocking=False):
+        return
+    try:
+        remaining = prune_lru(directory, max_bytes)
+        with _size_lock:
+            _cache_bytes[directory] = remaining
+    finally:
+        _prune_lock.release()
+
+
+class LocalStorage:
+    """Files under a directory on the local (or mounted) disk."""
+
+    is_remote = False
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def _absolute(self, storage_path: str) -> str:
+        return os.path.join(self.root, storage_path)
+
+    def put(self, temp_path: str, storage_path: str, mime_type: Optional[str] = None) -> None:
+        """Move a finished temp file into place (a rename on the same disk)."""
+        abs_path = self._absolute(storage_path)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        os.replace(temp_path, abs_path)
+
+    def exists(self, storage_path: str) -> bool:
+        return os.path.isfile(self._absolute(storage_path))
+
+    def delete(self, storage_path: str) -> None:
+        try:
+            os.remove(self._absolute(storage_path))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, storage_path: str) -> Optional[str]:
+        abs_path = self._absolute(storage_path)
+        return abs_path if os.path.isfile(abs_path) else None
+
+    def download_url(self, storage_path: str, download_name: str, mime_type: Optional[str]) -> Optional[str]:
+        return None
+
+    def presigned_post(self, key: str, mime_type: str, checksum_b64: str, max_size: int) -> Optional[dict]:
+        return None
+
+
+class S3Storage:
+    """An S3-compatible bucket; keys are the storage paths under an optional prefix."""
+
+    is_remote = True
+
+    def __init__(self, bucket: str, cache_dir: str, cache_max_bytes: int, expires: int,
+                 endpoint_url: Optional[str] = None, region: Optional[str] = None,
+                 access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None,
+                 prefix: str = ''):
+        import boto3
+        from botocore.config import Config as BotoConfig
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.expires = expires
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url,
+            region_name=region,
+            aws_access_key_id=access_key_id,
+            aws_secret_access_key=secret_access_key,
+            config=BotoConfig(signature_version='s3v4',
+                              s3={'addressing_style': 'path' if endpoint_url else 'auto'}),
+        )
+
+    def key(self, storage_path: str) -> str:
+        storage_path = storage_path.replace(os.sep, '/')
+        return f"{self.prefix}/{storage_path}" if self.prefix else storage_path
+
+    def _cache_path(self, storage_path: str) -> str:
+        return os.path.join(self.cache_dir, storage_path)
+
+    def _keep_in_cache(self, temp_path: str, storage_path: str) -> None:
+        cache_path = self._cache_path(storage_path)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        os.replace(temp_path, cache_path)
+        cache_file_added(self.cache_dir, os.path.getsize(cache_path), self.cache_max_bytes)
+
+    def put(self, temp_path: str, storage_path: str, mime_type: Optional[str] = None) -> None:
+        extra = {'ContentType': mime_type} if mime_type else None
+        self.client.upload_file(temp_path, self.bucket, self.key(storage_path), ExtraArgs=extra)
+        # The freshly uploaded copy is what OCR or the accounting email reads next
+        self._keep_in_cache(temp_path, storage_path)
+
+    def exists(self, storage_path: str) -> bool:
+        return self.head(storage_path) is not None
+
+    def delete(self, storage_path: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(storage_path))
+        try:
+            os.remove(self._cache_path(storage_path))
+        except FileNotFoundError:
+            pass
+
+    def local_path(self, storage_path: str) -> Optional[str]:
+        """Cached local copy of an object, downloaded on a miss; None if it does not exist."""
+        from botocore.exceptions import ClientError
+
+        cache_path = self._cache_path(storage_path)
+        try:
+            os.utime(cache_path)
+            return cache_path
+        except FileNotFoundError:
+            pass
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = os.path.join(self.cache_dir, f".{uuid.uuid4().hex}.part")
+        try:
+            self.client.download_file(self.bucket, self.key(storage_path), temp_path)
+        except ClientError as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+        self._keep_in_cache(temp_path, storage_path)
+        return cache_path
+
+    def download_url(self, storage_path: str, download_name: str, mime_type: Optional[str]) -> Optional[str]:
+        params = {
+            'Bucket': self.bucket,
+            'Key': self.key(storage_path),
+            'ResponseContentDisposition': content_disposition(download_name),
+        }
+        if mime_type:
+            params['ResponseContentType'] = mime_type
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=self.expires)
+
+    def presigned_post(self, key: str, mime_type: str, checksum_b64: str, max_size: int) -> Optional[dict]:
+        """Form fields for a browser POST straight to the bucket.
+
+        The policy pins the content type, size range and sha256 checksum, so
+        the store rejects a body that does not match the announced hash.
+        """
+        fields = {'Content-Type': mime_type, 'x-amz-checksum-sha256': checksum_b64}
+        conditions = [
+            {'Content-Type': mime_type},
+            {'x-amz-checksum-sha256': checksum_b64},
+            ['content-length-range', 1, max_size],
+        ]
+        return self.client.generate_presigned_post(self.bucket, self.key(key), Fields=fields,
+                                                   Conditions=conditions, ExpiresIn=self.expires)
+
+    def head(self, storage_path: str) -> Optional[dict]:
+        """Object metadata including ContentLength and, if recorded, ChecksumSHA256."""
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(storage_path), ChecksumMode='ENABLED')
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def copy(self, source_path: str, storage_path: str) -> None:
+        self.client.copy_object(Bucket=self.bucket, Key=self.key(storage_path),
+                                CopySource={'Bucket': self.bucket, 'Key': self.key(source_path)})
+
+
+def _create_backend(app):
+    backend = app.config.get('STORAGE_BACKEND', 'local')
+    if backend == 's3':
+        cache_dir = app.config.get('STORAGE_CACHE_DIR') or os.path.join(
+            os.path.abspath(app.config['UPLOAD_FOLDER']), '.remote-cache')
+        return S3Storage(
+            bucket=app.config['S3_BUCKET'],
+            cache_dir=cache_dir,
+            cache_max_bytes=app.config['STORAGE_CACHE_MAX_BYTES'],
+            expires=app.config['S3_PRESIGN_EXPIRES'],
+            endpoint_url=app.config.get('S3_ENDPOINT_URL'),
+            region=app.config.get('S3_REGION'),
+            access_key_id=app.config.get('S3_ACCESS_KEY_ID'),
+            secret_access_key=app.config.get('S3_SECRET_ACCESS_KEY'),
+            prefix=app.config.get('S3_PREFIX', ''),
+        )
+    if backend != 'local':
+        raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return LocalStorage(app.config['UPLOAD_FOLDER'])
+
+
+def get_storage():
+    """The configured backend, created once per app."""
+    app = current_app._get_current_object()
+    storage = app.extensions.get('storage_backend')
+    if storage is None:
+        storage = app.extensions['storage_backend'] = _create_backend(app)
+    return storage
@@ -0,0 +1,97 @@
+"""Preview thumbnails for expense documents.
+
+A thumbnail is a small JPEG of an image or of the first page of a PDF,
+rendered on first request and kept in an on-disk cache keyed by the
+document's content hash, so the same invoice attached to several expenses is
+rendered once. The cache is bounded by THUMBNAIL_CACHE_MAX_BYTES and evicts
+least recently used entries (mtime is bumped on every hit).
+
+Pillow and PyMuPDF are imported lazily; without them get_thumbnail()
+returns None and the route answers 404 so the UI falls back to the icon.
+"""
+import hashlib
+import logging
+import os
+import uuid
+from typing import Optional
+
+from flask import current_app
+
+from services.storage_backends import cache_file_added
+
+logger = logging.getLogger(__name__)
+
+_IMAGE_TYPES = ('image/png', 'image/jpeg', 'image/gif')
+
+
+def thumbnail_url(filename: Optional[str]) -> Optional[str]:
+    return f"/download/{filename}/thumb" if filename else None
+
+
+def thumbnail_urls(expense) -> dict:
+    """Thumbnail URL per document kind for list views (no I/O)."""
+    return {kind: thumbnail_url(getattr(expense, f'{kind}_filename'))
+            for kind in ('quote', 'invoice', 'receipt')
+            if getattr(expense, f'{kind}_filename')}
+
+
+def _cache_dir() -> str:
+    return current_app.config.get('THUMBNAIL_CACHE_DIR') or os.path.join(
+        os.path.abspath(current_app.config['UPLOAD_FOLDER']), '.thumbs')
+
+
+def _cache_path(key: str, size: int) -> str:
+    return os.path.join(_cache_dir(), key[:2], f"{key}_{size}.jpg")
+
+
+def _render(source_path: str, mime_type: Optional[str], size: int):
+    from PIL import Image
+
+    if mime_type == 'application/pdf':
+        import pymupdf
+
+        with pymupdf.open(source_path) as doc:
+            if doc.page_count == 0:
+                return None
+            page = doc.load_page(0)
+            zoom = size / max(page.rect.width, page.rect.height)
+            pix = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+            return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+    if mime_type in _IMAGE_TYPES:
+        with Image.open(source_path) as img:
+            img.draft('RGB', (size, size))  # JPEG: decode at reduced scale
+            img = img.convert('RGB')
+            img.thumbnail((size, size))
+            return img
+    return None
+
+
+def get_thumbnail(source_path: str, content_hash: Optional[str], mime_type: Optional[str]) -> Optional[str]:
+    """Path of the cached thumbnail for a stored document, rendering it if needed."""
+    size = current_app.config['THUMBNAIL_SIZE']
+    key = content_hash or hashlib.sha256(source_path.encode('utf-8')).hexdigest()
+    path = _cache_path(key, size)
+    try:
+        os.utime(path)
+        return path
+    except FileNotFoundError:
+        pass
+
+    try:
+        image = _render(source_path, mime_type, size)
+    except ImportError:
+        logger.warning("Thumbnails need Pillow and PyMuPDF; previews are disabled")
+        return None
+    except Exception as e:
+        logger.warning(f"Could not render thumbnail for {source_path}: {e}")
+        return None
+    if image is None:
+        return None
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    image.save(temp_path, 'JPEG', quality=80, optimize=True)
+    os.replace(temp_path, path)
+    cache_file_added(_cache_dir(), os.path.getsize(path), current_app.config['THUMBNAIL_CACHE_MAX_BYTES'])
+    return path
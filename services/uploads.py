@@ -0,0 +1,77 @@
+"""Receiving uploaded documents for processing.
+
+receive_upload() copies a werkzeug FileStorage into a SpooledTemporaryFile
+while hashing it, so the content hash is known after a single pass and the
+bytes can be handed to OCR as one in-memory buffer. Files up to
+UPLOAD_SPOOL_MAX_BYTES never touch the disk; larger ones roll over to an
+anonymous, uniquely named temp file under UPLOAD_FOLDER/.incoming.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import uuid
+from typing import Optional
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 64 * 1024
+
+
+class ReceivedUpload:
+    """An upload held in a spooled buffer, with its sha256 already computed."""
+
+    def __init__(self, spool, content_hash: str, size: int, filename: str, mimetype: Optional[str]):
+        self.spool = spool
+        self.content_hash = content_hash
+        self.size = size
+        self.filename = filename
+        self.mimetype = mimetype
+        self._data = None
+
+    def read_bytes(self) -> bytes:
+        """The whole document, read once and reused by every caller."""
+        if self._data is None:
+            self.spool.seek(0)
+            self._data = self.spool.read()
+        return self._data
+
+    def save_to(self, directory: str) -> str:
+        """Write the document to a new uniquely named file in `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, uuid.uuid4().hex)
+        with open(path, 'wb') as out:
+            out.write(self.read_bytes())
+        return path
+
+    def close(self) -> None:
+        self._data = None
+        self.spool.close()
+
+
+def incoming_dir() -> str:
+    return os.path.join(os.path.abspath(current_app.config['UPLOAD_FOLDER']), '.incoming')
+
+
+def receive_upload(file, filename: Optional[str] = None, mimetype: Optional[str] = None) -> ReceivedUpload:
+    """Hash an upload (or any binary stream) while copying it into a spooled buffer (caller closes it)."""
+    directory = incoming_dir()
+    os.makedirs(directory, exist_ok=True)
+    spool = tempfile.SpooledTemporaryFile(max_size=current_app.config['UPLOAD_SPOOL_MAX_BYTES'],
+                                          dir=directory)
+    sha256 = hashlib.sha256()
+    size = 0
+    stream = getattr(file, 'stream', file)
+    try:
+        for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+            spool.write(chunk)
+            size += len(chunk)
+    except Exception:
+        spool.close()
+        raise
+    return ReceivedUpload(spool, sha256.hexdigest(), size,
+                          filename or getattr(file, 'filename', '') or '',
+                          mimetype or getattr(file, 'mimetype', None))
@@ -0,0 +1,112 @@
+"""Warm-up routines run from the gunicorn hooks in gunicorn.conf.py.
+
+Workers are recycled every --max-requests, and without warm-up the first
+request in each new worker pays for SQLAlchemy mapper configuration, Jinja
+compilation of the email templates, a fresh DB connection, and compiling
+the current-BudgetYear and logged-in user lookups. With --preload the
+process-independent part is done once in the master and inherited by every
+fork; only the socket-backed part is repeated per worker.
+
+`flask benchmark-warmup` measures what that buys: the first and second
+request of a fresh process, with and without the warm-up run first.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from statistics import median
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import configure_mappers
+
+from models import db, User
+from services.budget_years import get_current_year_id
+from utils.email_sender import precompile_templates
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up_before_fork(app) -> None:
+    """Do the fork-safe warm-up in the master (called at preload time)."""
+    start = time.perf_counter()
+    try:
+        with app.app_context():
+            configure_mappers()
+            template_count = precompile_templates()
+            # Nothing here should have opened connections, but make sure no
+            # pooled socket is inherited by (and shared between) the workers
+            db.engine.dispose()
+        logger.info(
+            f"Pre-fork warm-up done in {(time.perf_counter() - start) * 1000:.0f}ms "
+            f"({template_count} email templates compiled)"
+        )
+    except Exception as e:
+        logger.warning(f"Pre-fork warm-up failed: {e}")
+
+
+def warm_up_worker(app) -> None:
+    """Open one pooled connection and prime per-process caches in a new worker."""
+    start = time.perf_counter()
+    try:
+        with app.app_context():
+            # Forget any connections copied from the master without closing
+            # sockets the master may still own
+            db.engine.dispose(close=False)
+            with db.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            get_current_year_id()
+            # Compile and cache the primary-key lookup the login user loader
+            # runs on every authenticated request
+            db.session.get(User, 0)
+        logger.info(f"Worker warm-up done in {(time.perf_counter() - start) * 1000:.0f}ms")
+    except Exception as e:
+        # A cold worker is still a working worker
+        logger.warning(f"Worker warm-up failed: {e}")
+
+
+def _probe_first_request(path: str, user_id: Optional[int], warm: bool) -> None:
+    """Run in a fresh interpreter: time the first two requests to `path`."""
+    logging.disable(logging.WARNING)
+    from app import app
+
+    warm_up_ms = 0.0
+    if warm:
+        start = time.perf_counter()
+        warm_up_before_fork(app)
+        warm_up_worker(app)
+        warm_up_ms = (time.perf_counter() - start) * 1000
+
+    client = app.test_client()
+    if user_id is not None:
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        status = client.get(path).status_code
+        timings.append((time.perf_counter() - start) * 1000)
+    print(json.dumps({'warm_up_ms': warm_up_ms, 'first_ms': timings[0], 'second_ms': timings[1],
+                      'status': status}))
+
+
+def benchmark_first_request(path: str, user_id: Optional[int] = None, repeat: int = 5) -> dict:
+    """Median first/second request latency of fresh processes, cold vs. warmed up."""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = (f"from services.warmup import _probe_first_request; "
+            f"_probe_first_request({path!r}, {user_id!r}, {{warm}})")
+    result = {'path': path, 'repeat': repeat}
+    for variant, warm in (('cold', False), ('warm', True)):
+        runs = []
+        for _ in range(repeat):
+            completed = subprocess.run([sys.executable, '-c', code.format(warm=warm)], cwd=root,
+                                       capture_output=True, text=True, check=False)
+            if completed.returncode != 0:
+                raise RuntimeError(f"warm-up probe failed:\n{completed.stderr[-2000:]}")
+            runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        result[variant] = {key: round(median(run[key] for run in runs), 1)
+                           for key in ('warm_up_ms', 'first_ms', 'second_ms')}
+        result[variant]['status'] = runs[-1]['status']
+    return result
@@ -0,0 +1,155 @@
+"""Cold archive for closed budget years.
+
+Archiving a BudgetYear freezes it (is_active=False, is_archived=True) and
+moves its expenses out of the hot `expense` table into `expense_archive`.
+When expense is partitioned by year (services/expense_partitions.py) the
+move is a metadata-only DETACH/ATTACH of the year's partition; otherwise
+the rows are copied and deleted in one transaction. restore_year() does the
+reverse.
+
+The year's Department > Category > Subcategory rows stay where they are:
+archived expenses still reference them, and lineage lookups need them.
+Listing endpoints skip archived years unless called with include_archived,
+and archived expenses are read through expense_source().
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import inspect, or_, select, text, union_all
+from sqlalchemy.orm import aliased
+
+from models import db, BudgetYear, Department, Expense, expense_archive
+from services.expense_partitions import is_partitioned, partition_name
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = ', '.join(c.name for c in Expense.__table__.columns)
+
+
+class ArchiveError(ValueError):
+    """The year cannot be archived or restored in its current state."""
+
+
+def expense_source(include_archived: bool = False):
+    """Expense, or an alias of it over expense UNION ALL expense_archive.
+
+    Rows loaded through the alias are plain Expense objects; they are for
+    reading only, since archived rows are not in the table the ORM updates.
+    """
+    if not include_archived:
+        return Expense
+    combined = union_all(select(Expense.__table__), select(expense_archive)).subquery('expense_all')
+    return aliased(Expense, combined, adapt_on_names=True)
+
+
+def get_expense(expense_id: int, include_archived: bool = False):
+    """An expense by id; with include_archived also one in expense_archive
+    (loaded read-only through expense_source())."""
+    expense = db.session.get(Expense, expense_id)
+    if expense is None and include_archived:
+        source = expense_source(include_archived=True)
+        expense = db.session.execute(select(source).where(source.id == expense_id)).scalar()
+    return expense
+
+
+def filter_active_departments(query, include_archived: bool = False):
+    """Limit a Department query to years that are not archived."""
+    if include_archived:
+        return query
+    archived_year_ids = select(BudgetYear.id).where(BudgetYear.is_archived.is_(True))
+    return query.filter(or_(Department.year_id.is_(None), Department.year_id.not_in(archived_year_ids)))
+
+
+def is_year_archived(year_id) -> bool:
+    if year_id is None:
+        return False
+    return bool(db.session.execute(
+        select(BudgetYear.is_archived).where(BudgetYear.id == year_id)
+    ).scalar())
+
+
+def _move_partition(year_id: int, source: str, target: str) -> int:
+    name = partition_name(year_id)
+    attached = db.session.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_inherits
+            WHERE inhrelid = to_regclass(:name) AND inhparent = to_regclass(:source)
+        )
+    """), {'name': name, 'source': source}).scalar()
+    if not attached:
+        return 0
+    rows = db.session.execute(text(f"SELECT count(*) FROM {name}")).scalar()
+    db.session.execute(text(f"ALTER TABLE {source} DETACH PARTITION {name}"))
+    db.session.execute(text(f"ALTER TABLE {target} ATTACH PARTITION {name} FOR VALUES IN ({int(year_id)})"))
+    return rows
+
+
+def _drop_attachment_foreign_key() -> None:
+    """Drop expense_attachment's ON DELETE CASCADE FK to expense, if present.
+
+    Attachments stay put while their expense is archived. The partitioning
+    migration drops this FK, but an unpartitioned Postgres expense table
+    (e.g. one built by db.create_all()) still has it, and the DELETE below
+    would take the year's attachments with it. SQLite does not enforce it.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    for fk in inspect(db.session.connection()).get_foreign_keys('expense_attachment'):
+        if fk['referred_table'] == 'expense' and fk['name']:
+            db.session.execute(text(f'ALTER TABLE expense_attachment DROP CONSTRAINT "{fk["name"]}"'))
+            logger.warning(f"Dropped foreign key {fk['name']} so archived expenses keep their attachments")
+
+
+def _move_rows(year_id: int, source: str, target: str) -> int:
+    # Copy and delete: expense is not partitioned (SQLite, or a Postgres
+    # database that skipped migration l2m3n4o5p6q7)
+    if source == 'expense':
+        _drop_attachment_foreign_key()
+    db.session.execute(text(
+        f"INSERT INTO {target} ({_COLUMNS}) SELECT {_COLUMNS} FROM {source} WHERE budget_year_id = :year_id"
+    ), {'year_id': year_id})
+    return db.session.execute(text(
+        f"DELETE FROM {source} WHERE budget_year_id = :year_id"
+    ), {'year_id': year_id}).rowcount
+
+
+def _move_expenses(year_id: int, source: str, target: str) -> int:
+    if is_partitioned():
+        return _move_partition(year_id, source, target)
+    return _move_rows(year_id, source, target)
+
+
+def archive_year(year_id: int) -> dict:
+    """Freeze a budget year and move its expenses to the archive."""
+    year = db.session.get(BudgetYear, year_id)
+    if year is None:
+        raise ArchiveError('Budget year not found')
+    if year.is_current:
+        raise ArchiveError('The current budget year cannot be archived')
+    if year.is_archived:
+        raise ArchiveError(f'Budget year {year.year} is already archived')
+
+    moved = _move_expenses(year_id, 'expense', 'expense_archive')
+    year.is_active = False
+    year.is_archived = True
+    year.archived_at = datetime.utcnow()
+    db.session.commit()
+    logger.info(f"Archived budget year {year.year}: {moved} expense(s) moved to expense_archive")
+    return {'year': year.year, 'expenses_moved': moved}
+
+
+def restore_year(year_id: int) -> dict:
+    """Bring an archived year's expenses back into the hot table."""
+    year = db.session.get(BudgetYear, year_id)
+    if year is None:
+        raise ArchiveError('Budget year not found')
+    if not year.is_archived:
+        raise ArchiveError(f'Budget year {year.year} is not archived')
+
+    moved = _move_expenses(year_id, 'expense_archive', 'expense')
+    year.is_active = True
+    year.is_archived = False
+    year.archived_at = None
+    db.session.commit()
+    logger.info(f"Restored budget year {year.year}: {moved} expense(s) moved back from expense_archive")
+    return {'year': year.year, 'expenses_moved': moved}
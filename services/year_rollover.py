@@ -0,0 +1,268 @@
+"""Set-based budget-year rollover.
+
+Copying a year's Department > Category > Subcategory tree, its manager
+assignments and its users into another year is done with a handful of
+INSERT ... SELECT / UPDATE ... FROM statements instead of a flush per row.
+New ids are drawn from the table sequences up front into temporary id
+mapping tables, so each level can be inserted in one statement and joined
+to the next. Postgres only, like the rest of the reporting SQL.
+
+dry_run executes everything inside a SAVEPOINT and rolls it back, so the
+returned diff is exactly what a real run would do. Rolling back does not
+return sequence values, so a dry run maps new rows to negative placeholder
+ids instead of calling nextval(), and counts the subcategories it would
+create rather than inserting them.
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import text
+
+from models import db
+from services.budget_hierarchy import invalidate_hierarchy
+
+logger = logging.getLogger(__name__)
+
+
+def _create_department_map(source_year_id: int, target_year_id: int, dry_run: bool) -> None:
+    """Map every source department to its target-year department (same
+    lineage, else same name), or to a freshly allocated id for one to be
+    created.
+
+    A target already claimed by the lineage of another source department is
+    not matched by name as well; a source whose name is taken by such a
+    target is skipped (target_id NULL) rather than created twice.
+    """
+    db.session.execute(text("""
+        CREATE TEMP TABLE rollover_department_map ON COMMIT DROP AS
+        SELECT source_id,
+               CASE WHEN NOT is_new THEN matched_id
+                    WHEN :dry_run THEN -row_number() OVER (ORDER BY source_id)
+                    ELSE nextval(pg_get_serial_sequence('department', 'id')) END AS target_id,
+               is_new
+        FROM (
+            SELECT s.id AS source_id, t.id AS matched_id,
+                   t.id IS NULL AND NOT EXISTS (
+                       SELECT 1 FROM department c
+                       WHERE c.year_id = :target_year_id AND c.name = s.name
+                   ) AS is_new
+            FROM department s
+            LEFT JOIN LATERAL (
+                SELECT t.id FROM department t
+                WHERE t.year_id = :target_year_id
+                  AND (t.lineage_id = s.lineage_id
+                       OR (t.name = s.name AND NOT EXISTS (
+                           SELECT 1 FROM department o
+                           WHERE o.year_id = :source_year_id AND o.lineage_id = t.lineage_id
+                       )))
+                ORDER BY t.lineage_id = s.lineage_id DESC
+                LIMIT 1
+            ) t ON true
+            WHERE s.year_id = :source_year_id
+        ) matched
+    """), {'source_year_id': source_year_id, 'target_year_id': target_year_id, 'dry_run': dry_run})
+
+
+def _link_existing_lineage() -> None:
+    """Adopt the source lineage for target rows that were created by hand
+    and only matched by name, so later years resolve them by lineage."""
+    db.session.execute(text("""
+        UPDATE department t SET lineage_id = s.lineage_id
+        FROM rollover_department_map m
+        JOIN department s ON s.id = m.source_id
+        WHERE NOT m.is_new AND t.id = m.target_id AND t.lineage_id <> s.lineage_id
+    """))
+    db.session.execute(text("""
+        UPDATE category t SET lineage_id = s.lineage_id
+        FROM rollover_department_map m
+        JOIN category s ON s.department_id = m.source_id
+        WHERE NOT m.is_new AND t.department_id = m.target_id
+          AND t.name = s.name AND t.lineage_id <> s.lineage_id
+    """))
+    db.session.execute(text("""
+        UPDATE subcategory t SET lineage_id = s.lineage_id
+        FROM rollover_department_map m
+        JOIN category sc ON sc.department_id = m.source_id
+        JOIN subcategory s ON s.category_id = sc.id
+        JOIN category tc ON tc.department_id = m.target_id AND tc.lineage_id = sc.lineage_id
+        WHERE NOT m.is_new AND t.category_id = tc.id
+          AND t.name = s.name AND t.lineage_id <> s.lineage_id
+    """))
+
+
+def _copy_structure(target_year_id: int, dry_run: bool) -> dict:
+    # Departments (budgets reset for the new year)
+    created_departments = db.session.execute(text("""
+        INSERT INTO department (id, name, lineage_id, budget, currency, year_id)
+        SELECT m.target_id, s.name, s.lineage_id, 0.0, s.currency, :target_year_id
+        FROM rollover_department_map m
+        JOIN department s ON s.id = m.source_id
+        WHERE m.is_new
+        ORDER BY s.id
+        RETURNING name
+    """), {'target_year_id': target_year_id}).scalars().all()
+
+    skipped_departments = db.session.execute(text("""
+        SELECT s.name FROM rollover_department_map m
+        JOIN department s ON s.id = m.source_id
+        WHERE NOT m.is_new
+        ORDER BY s.name
+    """)).scalars().all()
+
+    # Categories of newly created departments only, as before
+    db.session.execute(text("""
+        CREATE TEMP TABLE rollover_category_map ON COMMIT DROP AS
+        SELECT c.id AS source_id,
+               CASE WHEN :dry_run THEN -row_number() OVER (ORDER BY c.id)
+                    ELSE nextval(pg_get_serial_sequence('category', 'id')) END AS target_id,
+               m.target_id AS target_department_id
+        FROM category c
+        JOIN rollover_department_map m ON m.source_id = c.department_id
+        WHERE m.is_new
+    """), {'dry_run': dry_run})
+    categories_created = db.session.execute(text("""
+        INSERT INTO category (id, name, lineage_id, budget, is_welfare, department_id)
+        SELECT cm.target_id, c.name, c.lineage_id, 0.0, c.is_welfare, cm.target_department_id
+        FROM rollover_category_map cm
+        JOIN category c ON c.id = cm.source_id
+        ORDER BY c.id
+    """)).rowcount
+
+    # Nothing later refers to the new subcategories, so a dry run only counts them
+    if dry_run:
+        subcategories_created = db.session.execute(text("""
+            SELECT count(*) FROM subcategory s
+            JOIN rollover_category_map cm ON cm.source_id = s.category_id
+        """)).scalar()
+    else:
+        subcategories_created = db.session.execute(text("""
+            INSERT INTO subcategory (name, lineage_id, budget, category_id)
+            SELECT s.name, s.lineage_id, 0.0, cm.target_id
+            FROM subcategory s
+            JOIN rollover_category_map cm ON cm.source_id = s.category_id
+            ORDER BY s.id
+        """)).rowcount
+
+    # Manager assignments for every mapped department (new or existing)
+    managers_copied = db.session.execute(text("""
+        INSERT INTO manager_departments (user_id, department_id)
+        SELECT md.user_id, m.target_id
+        FROM manager_departments md
+        JOIN rollover_department_map m ON m.source_id = md.department_id
+        WHERE m.target_id IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """)).rowcount
+
+    return {
+        'departments_created': created_departments,
+        'departments_skipped': skipped_departments,
+        'categories_created': categories_created,
+        'subcategories_created': subcategories_created,
+        'managers_copied': managers_copied,
+    }
+
+
+# Target-year departments a user's current department `cur` maps to: the same
+# lineage, else the same name unless that department is the lineage of
+# another department in the user's year (as in _create_department_map)
+_USER_TARGETS = """
+    SELECT t.id FROM department t
+    WHERE t.year_id = :target_year_id
+      AND (t.lineage_id = cur.lineage_id
+           OR (t.name = cur.name AND NOT EXISTS (
+               SELECT 1 FROM department o
+               WHERE o.year_id IS NOT DISTINCT FROM cur.year_id
+                 AND o.lineage_id = t.lineage_id AND o.id <> cur.id
+           )))
+"""
+
+
+def _migrate_users(target_year_id: int) -> dict:
+    """Point every user at their department in the target year, found by
+    lineage or, for departments created by hand, by name."""
+    skipped = db.session.execute(text(f"""
+        SELECT u.username, cur.name AS department
+        FROM "user" u
+        JOIN department cur ON cur.id = u.department_id
+        WHERE cur.year_id IS DISTINCT FROM :target_year_id
+          AND NOT EXISTS ({_USER_TARGETS})
+        ORDER BY u.username
+    """), {'target_year_id': target_year_id}).mappings().all()
+
+    migrated = db.session.execute(text(f"""
+        UPDATE "user" u
+        SET department_id = t.id
+        FROM department cur
+        CROSS JOIN LATERAL ({_USER_TARGETS}
+            ORDER BY t.lineage_id = cur.lineage_id DESC
+            LIMIT 1
+        ) t
+        WHERE cur.id = u.department_id
+          AND cur.year_id IS DISTINCT FROM :target_year_id
+    """), {'target_year_id': target_year_id}).rowcount
+
+    return {
+        'users_migrated': migrated,
+        'users_skipped': [{'user': row['username'], 'department': row['department']} for row in skipped],
+    }
+
+
+def _run(work, dry_run: bool) -> dict:
+    if dry_run:
+        savepoint = db.session.begin_nested()
+        try:
+            result = work()
+        finally:
+            savepoint.rollback()
+        result['dry_run'] = True
+        return result
+
+    result = work()
+    db.session.commit()
+    # Core statements bypass the ORM events that normally invalidate this
+    invalidate_hierarchy()
+    result['dry_run'] = False
+    return result
+
+
+def roll_over_structure(source_year_id: int, target_year_id: int,
+                        migrate_users: bool = False, dry_run: bool = False) -> dict:
+    """Copy source year's structure and manager assignments into target year.
+
+    Departments that already exist (by lineage or name) in the target year
+    are skipped, but still receive the source department's manager
+    assignments.
+    """
+    def work():
+        _create_department_map(source_year_id, target_year_id, dry_run)
+        _link_existing_lineage()
+        result = _copy_structure(target_year_id, dry_run)
+        if migrate_users:
+            result.update(_migrate_users(target_year_id))
+        else:
+            result.update({'users_migrated': 0, 'users_skipped': []})
+        return result
+
+    return _run(work, dry_run)
+
+
+def migrate_users_to_year(target_year_id: int, dry_run: bool = False) -> dict:
+    return _run(lambda: _migrate_users(target_year_id), dry_run)
+
+
+def describe_rollover(result: dict, source_name: Optional[str] = None, target_name: Optional[str] = None) -> str:
+    """Human readable summary, as returned by the copy-structure endpoint."""
+    if result.get('dry_run'):
+        msg = (f'Dry run: copying {source_name} to {target_name} would create '
+               f'{len(result["departments_created"])} department(s), {result["categories_created"]} category(ies) '
+               f'and {result["subcategories_created"]} subcategory(ies)')
+    else:
+        msg = f'Structure copied successfully from {source_name} to {target_name}'
+    skipped = result['departments_skipped']
+    if skipped:
+        msg += f'. Skipped {len(skipped)} existing department(s): {", ".join(skipped)}'
+    if result['managers_copied']:
+        msg += f'. {result["managers_copied"]} manager assignment(s) copied.'
+    if result['users_migrated']:
+        msg += f' {result["users_migrated"]} user(s) migrated to new year.'
+    return msg
@@ -8,7 +8,8 @@ from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
-from dotenv import load_dotenv
+from functools import lru_cache
+from jinja2 import Environment, select_autoescape
 from templates.email_templates import (
     EXPENSE_SUBMITTED_TEMPLATE,
     EXPENSE_STATUS_UPDATE_TEMPLATE,
@@ -20,11 +21,6 @@ from templates.email_templates import (
     EXPENSE_PAYMENT_NOTIFICATION_TEMPLATE
 )
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Initialize logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # SMTP (Mailgun) configuration - using environment variables for security
@@ -45,7 +41,7 @@ def send_email_smtp(to_email, subject, html_content, attachments=None, cc_emails
         to_email: Recipient email address
         subject: Email subject
         html_content: HTML content of the email
-        attachments: List of file paths to attach to the email
+        attachments: List of file paths, or (path, filename) tuples, to attach to the email
     """
     try:
         if not (SMTP_USERNAME and SMTP_PASSWORD):
@@ -80,15 +76,16 @@ def send_email_smtp(to_email, subject, html_content, attachments=None, cc_emails
 
         # Attach files if provided
         if attachments:
-            for file_path in attachments:
+            for attachment in attachments:
+                # Deduplicated uploads are stored under their hash, so callers pass the real name
+                file_path, filename = attachment if isinstance(attachment, tuple) else (attachment, os.path.basename(attachment))
                 if os.path.exists(file_path):
                     try:
                         with open(file_path, 'rb') as f:
                             part = MIMEBase('application', 'octet-stream')
                             part.set_payload(f.read())
                             encoders.encode_base64(part)
-                            
-                            filename = os.path.basename(file_path)
+
                             part.add_header('Content-Disposition', f'attachment; filename= {filename}')
                             msg.attach(part)
                             logger.info(f"Attached file: {filename}")
@@ -145,6 +142,21 @@ def send_async_email(app, recipient, subject, html_content, attachments=None, cc
         logger.error(f"Full traceback: {traceback.format_exc()}")
         raise
 
+_jinja_env = Environment(autoescape=select_autoescape(['html', 'xml']))
+
+@lru_cache(maxsize=32)
+def get_compiled_template(template):
+    """Compile a template string once; the email templates are module constants."""
+    return _jinja_env.from_string(template)
+
+def precompile_templates():
+    """Compile every *_TEMPLATE in templates.email_templates (used by warm-up)."""
+    from templates import email_templates
+    names = [name for name in dir(email_templates) if name.endswith('_TEMPLATE')]
+    for name in names:
+        get_compiled_template(getattr(email_templates, name))
+    return len(names)
+
 def send_email(subject, recipient, template, attachments=None, cc=None, **kwargs):
     """Send an email using a template - now with improved reliability
     
@@ -152,7 +164,7 @@ def send_email(subject, recipient, template, attachments=None, cc=None, **kwargs
         subject: Email subject
         recipient: Recipient email address
         template: Email template string
-        attachments: Optional list of file paths to attach
+        attachments: Optional list of file paths, or (path, filename) tuples, to attach
         **kwargs: Template variables
     """
     try:
@@ -173,12 +185,8 @@ def send_email(subject, recipient, template, attachments=None, cc=None, **kwargs
         else:
             cc_list = list(cc)
 
-        # Create Jinja2 environment for proper template rendering
-        from jinja2 import Environment, select_autoescape
-        env = Environment(autoescape=select_autoescape(['html', 'xml']))
-        
-        # Convert the template string to a Jinja2 template
-        template_obj = env.from_string(template)
+        # Templates are compiled once per process and reused
+        template_obj = get_compiled_template(template)
         
         # Render the template with kwargs
         html_content = template_obj.render(**kwargs)